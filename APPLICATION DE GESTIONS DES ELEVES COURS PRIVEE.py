@@ -3,80 +3,229 @@
 # COURS PRIVÉ - Desktop manager (Tkinter + SQLite3)
 # Owner: DR.ALMOUSTAPHA MANOMI
 # Requires Python 3.
+# Data operations live in cours_prive.py (also usable from the command line).
+# Modules needed by a single action (webbrowser, csv, shutil, ...) are imported
+# where they are used, to keep start-up short.
+
+import time
+STARTED = time.perf_counter()   # start of the startup timing report (see StartupTimer)
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import sqlite3, os, csv, datetime, webbrowser, shutil
+import sqlite3, os, queue, datetime, threading
+from collections import OrderedDict
 from pathlib import Path
 
-THIS_DIR = Path(__file__).parent
-DB = THIS_DIR / "data.db"
-PHOTOS = THIS_DIR / "photos"
-PHOTOS.mkdir(exist_ok=True)
+from cours_prive import (
+    DB, THIS_DIR, PHOTOS, THUMBS, THUMB_SIZE, LOG_DIR, LOG_FILES, TRACE, Database, init_db, _esc, _number,
+    # students
+    PAGE_SIZE, MAX_PAGES, SEARCH_DELAY_MS, SEARCH_LIMIT, STUDENT_COLUMNS, SORT_KEYS, student_page, search_students,
+    student_rows, student_values, student_tags, load_student_view, get_student, student_classe, save_student, delete_student,
+    store_photo, photo_path, thumbnail_path, photo_maintenance,
+    # lessons, grades, payments
+    add_lesson, delete_lesson, add_grade, delete_grade, class_ranking, normalize_date, period_bounds, week_lessons,
+    add_payment, student_payments, FEE_SCOPES, fee_schedule, set_fee, delete_fee, overdue_students, revenue,
+    # messages
+    MESSAGE_PAGE, INBOX_LIMIT, message_page, send_message, mark_read, broadcast_message, unread_messages,
+    # planning
+    WEEKDAYS, add_slot, delete_slot, week_schedule, find_free_slots, timetable_conflicts, parse_time, format_time,
+    resource_names, find_resource,
+    # exports, imports, bulletins
+    export_csv, import_csv, IMPORT_TABLES, BULLETIN_PAGE, BULLETIN_SCOPES, bulletin_data, render_bulletin, bulletin_filename,
+    write_bulletins, scope_values,
+    # backups
+    BACKUP_DIR, BACKUP_INTERVAL, backup_database, prune_backups, list_backups, backup_due, verify_backup, restore_backup,
+)
 
 # Theme colors (chosen)
 PRIMARY = "#0b6e6e"   # dark teal
 ACCENT  = "#ff6b6b"   # coral
 
-def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE,
-            last_name TEXT,
-            first_name TEXT,
-            classe TEXT,
-            cycle TEXT,
-            year TEXT,
-            photo TEXT,
-            notes TEXT,
-            phone TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS lessons (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER,
-            date TEXT,
-            topic TEXT,
-            duration INTEGER,
-            note TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER,
-            date TEXT,
-            amount REAL,
-            method TEXT,
-            note TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER,
-            date TEXT,
-            sender TEXT,
-            content TEXT,
-            read_flag INTEGER DEFAULT 0
-        )
-    """)
-    conn.commit(); conn.close()
+VIEW_CACHE_SIZE = 64    # student views kept in memory
+BACKUP_FIRST_CHECK_MS = 60_000      # first look for a due backup, once start-up is over
+BACKUP_CHECK_MS = 5 * 60_000
+
+class ViewCache:
+    """Bounded LRU cache of load_student_view() results, keyed by student id.
+
+    Used from the Tk thread only. Every invalidation bumps `version`; a view
+    loaded under an older version is not stored, since the write may have
+    landed after the read started.
+    """
+
+    def __init__(self, maxsize=VIEW_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.version = 0
+        self._views = OrderedDict()
+
+    def __contains__(self, sid):
+        return sid in self._views
+
+    def get(self, sid):
+        view = self._views.get(sid)
+        if view is not None: self._views.move_to_end(sid)
+        return view
+
+    def put(self, sid, view, version):
+        if version != self.version: return
+        self._views[sid] = view; self._views.move_to_end(sid)
+        while len(self._views) > self.maxsize: self._views.popitem(last=False)
+
+    def pop(self, sid):
+        self.version += 1
+        return self._views.pop(sid, None)
+
+    def discard_if(self, predicate):
+        self.version += 1
+        for sid in [sid for sid, view in self._views.items() if predicate(view)]:
+            del self._views[sid]
+
+    def clear(self):
+        self.version += 1
+        self._views.clear()
+
+QUERY_POLL_MS = 30      # how often Tk collects finished queries while some are outstanding
+
+def untraced(func):
+    """Keep a polling callback out of TRACE; it would bury real operations under its ticks."""
+    func.untraced = True
+    return func
+
+class QueryExecutor:
+    """Runs database reads on one worker thread and hands results back to Tk.
+
+    submit(key, work, callback) queues work() (which uses `db` from the worker
+    thread, hence the worker's own connection); callback(result) later runs on
+    the Tk thread from an after() poll. Only the newest request per key counts:
+    an older one still queued is dropped, one already running is interrupted,
+    and a result that arrives late is discarded. Submitting the same `ident`
+    as the request in flight just waits for that result (duplicate refreshes
+    coalesce).
+    """
+
+    def __init__(self, widget, db, on_busy=None, on_error=None):
+        self.widget, self.db = widget, db
+        self.on_busy, self.on_error = on_busy, on_error
+        self._cond = threading.Condition()
+        self._pending = {}      # key -> task, in submission order
+        self._latest = {}       # key -> newest task; anything else is stale
+        self._running = None
+        self._conn = None
+        self._results = queue.Queue()
+        self._polling = self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, key, work, callback, ident=None):
+        with self._cond:
+            running = self._running
+            if running and running["key"] == key and ident is not None and running["ident"] == ident:
+                running["callback"] = callback
+                self._pending.pop(key, None); self._latest[key] = running
+            else:
+                task = {"key": key, "ident": ident, "work": work, "callback": callback}
+                self._pending.pop(key, None)
+                self._pending[key] = self._latest[key] = task
+                if running and running["key"] == key and self._conn:
+                    self._conn.interrupt()
+                self._cond.notify()
+        if not self._polling:
+            self._polling = True
+            if self.on_busy: self.on_busy(True)
+            self.widget.after(QUERY_POLL_MS, self._poll)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed: self._cond.wait()
+                if self._closed: break
+                task = self._pending.pop(next(iter(self._pending)))
+                self._running = task
+            try:
+                # opened here rather than once up front: a locked or unreachable
+                # data.db fails this task (reported through on_error) and the
+                # next one tries again, instead of killing the worker
+                if self._conn is None: self._conn = self.db.connection()
+                with TRACE.operation(f"lecture {task['key']}"): result, error = task["work"](), None
+            except Exception as e: result, error = None, e
+            with self._cond:
+                self._running = None
+                if self._latest.get(task["key"]) is task:
+                    self._results.put((task, result, error))
+        self.db.release_thread()
+
+    @untraced
+    def _poll(self):
+        while True:
+            try: task, result, error = self._results.get_nowait()
+            except queue.Empty: break
+            with self._cond:
+                if self._latest.get(task["key"]) is not task: continue
+                del self._latest[task["key"]]
+            if error is None:
+                with TRACE.operation(f"affichage {task['key']}"): task["callback"](result)
+            elif self.on_error: self.on_error(error)
+        with self._cond:
+            busy = bool(self._pending) or self._running is not None
+        if busy or not self._results.empty():
+            self.widget.after(QUERY_POLL_MS, self._poll)
+        else:
+            self._polling = False
+            if self.on_busy: self.on_busy(False)
+
+    def close(self):
+        with self._cond:
+            self._closed = True; self._cond.notify()
+        if self._conn: self._conn.interrupt()
+
+class TracedCallWrapper(tk.CallWrapper):
+    """Tk callback wrapper that times every handler (button, binding, after) in TRACE."""
+    def __call__(self, *args):
+        if getattr(self.func, "untraced", False): return super().__call__(*args)
+        with TRACE.operation(getattr(self.func, "__qualname__", "callback")):
+            return super().__call__(*args)
+
+tk.CallWrapper = TracedCallWrapper
+
+class StartupTimer:
+    """Splits the launch, from STARTED to the first page of students on
+    screen, into phases. report() records them in TRACE (diagnostics window,
+    logs/operations.csv) and writes one line to the log."""
+
+    def __init__(self, start=STARTED):
+        self.start = self._last = start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last)); self._last = now
+
+    def total_ms(self):
+        return 1000 * (self._last - self.start)
+
+    def report(self):
+        for phase, seconds in self.phases: TRACE.record("op", f"démarrage: {phase}", seconds)
+        TRACE.record("op", "démarrage", self._last - self.start)
+        TRACE.logger("app").info("startup %.0f ms: %s", self.total_ms(), ", ".join(f"{p} {1000 * s:.0f} ms" for p, s in self.phases))
 
 class App(ttk.Frame):
-    def __init__(self, master):
+    def __init__(self, master, db=None, startup=None):
         super().__init__(master)
+        self.startup = startup      # StartupTimer, reported once the first page is shown
+        self._ready_note = None     # (label, ms) shown instead of TRACE.last the next time the app goes idle
+        self.db = db or Database(DB)
+        self.executor = QueryExecutor(self, self.db, on_busy=self._show_busy, on_error=self._show_query_error)
+        self.view_cache = ViewCache()
+        master.report_callback_exception = self._report_error
         master.title("COURS PRIVÉ - DR.ALMOUSTAPHA MANOMI")
         master.geometry("1000x650")
         self.pack(fill="both", expand=True)
         self.create_style(master)
         self.create_widgets()
-        init_db()
+        if startup: startup.mark("interface")
+        init_db(self.db)
+        if startup: startup.mark("base")
         self.load_students()
+        self.after(BACKUP_FIRST_CHECK_MS, self._scheduled_backup)
 
     def create_style(self, master):
         style = ttk.Style(master)
@@ -99,9 +248,24 @@ class App(ttk.Frame):
         paned.add(right, weight=4)
 
         ttk.Label(left, text="Liste des élèves", style='Heading.TLabel').pack(anchor="w", padx=6, pady=(6,0))
-        self.lst = tk.Listbox(left, width=40)
-        self.lst.pack(fill="both", expand=True, padx=6)
-        self.lst.bind("<<ListboxSelect>>", self.on_select)
+        listf = ttk.Frame(left)
+        listf.pack(fill="both", expand=True, padx=6)
+        self.tree = ttk.Treeview(listf, columns=[c[0] for c in STUDENT_COLUMNS], show="headings", selectmode="browse")
+        for col, label, width in STUDENT_COLUMNS:
+            self.tree.heading(col, text=label, command=(lambda c=col: self.sort_students(c)) if col in SORT_KEYS else "")
+            self.tree.column(col, width=width, anchor="w")
+        self.tree.tag_configure("unread", foreground=ACCENT)
+        self.tree_scroll = ttk.Scrollbar(listf, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_student_scroll)
+        self.tree_scroll.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.sort_col, self.sort_desc = "id", False
+        self._row_keys = {}     # item id -> keyset key of the loaded row
+        self._more_above = self._more_below = self._paging = False
+        self._next_page = None  # ((after, sort, desc), rows) fetched ahead in the background
+        self._stale_rows = set()    # ids whose row refresh is still queued
+        self._list_version = 0  # bumped when the list is reloaded or edited; older prefetches are dropped
 
         btnf = ttk.Frame(left)
         btnf.pack(fill="x", padx=6, pady=6)
@@ -114,13 +278,16 @@ class App(ttk.Frame):
         sf.pack(fill="x", padx=6, pady=(0,6))
         ttk.Label(sf, text="Recherche:").pack(side="left")
         self.search_var = tk.StringVar()
+        self._search_job = None
+        self.search_var.trace_add("write", lambda *a: self.schedule_search())
         ent = ttk.Entry(sf, textvariable=self.search_var)
         ent.pack(side="left", fill="x", expand=True, padx=4)
         ent.bind("<Return>", lambda e: self.load_students())
         ttk.Button(sf, text="Go", command=self.load_students).pack(side="left", padx=4)
 
-        # Right: tabs
-        tabs = ttk.Notebook(right)
+        # Right: tabs. Only the first one is built now; the others are built
+        # on first activation (see _build_tab)
+        self.tabs = tabs = ttk.Notebook(right)
         tabs.pack(fill="both", expand=True)
         self.tab_info = ttk.Frame(tabs)
         self.tab_notes = ttk.Frame(tabs)
@@ -134,12 +301,42 @@ class App(ttk.Frame):
         tabs.add(self.tab_inscription, text="Inscription")
         tabs.add(self.tab_reports, text="Rapports / Paiements")
         tabs.add(self.tab_planning, text="Planning")
+        self._tab_builders = {str(self.tab_notes): self._build_notes_tab, str(self.tab_messages): self._build_messages_tab,
+                              str(self.tab_inscription): self._build_inscription_tab, str(self.tab_reports): self._build_reports_tab,
+                              str(self.tab_planning): self._build_planning_tab}
+        self._view = None       # student view last shown, replayed into tabs built later
+        tabs.bind("<<NotebookTabChanged>>", lambda e: self._build_tab(tabs.select()))
 
         # Info area
+        self.photo_view = ttk.Label(self.tab_info)
+        self.photo_view.pack(anchor="ne", padx=6, pady=(6, 0))
+        self._thumbs = OrderedDict()    # photo key -> tk.PhotoImage, most recent last
         self.info_text = tk.Text(self.tab_info, state="disabled")
         self.info_text.pack(fill="both", expand=True, padx=6, pady=6)
 
-        # Notes tab layout
+        # Status bar (progress bar and cancel button appear while a job runs)
+        statusf = ttk.Frame(self)
+        statusf.pack(fill="x", side="bottom")
+        self.status = ttk.Label(statusf, text="Prêt", relief=tk.SUNKEN, anchor="w")
+        self.status.pack(side="left", fill="x", expand=True)
+        self.progress = ttk.Progressbar(statusf, length=160, mode="determinate")
+        self.cancel_btn = ttk.Button(statusf, text="Annuler", command=self.cancel_job)
+        self._job = None
+
+    def _build_tab(self, tab):
+        """Build `tab` if it has not been built yet, then show the current student in it."""
+        builder = self._tab_builders.pop(str(tab), None)
+        if builder is None: return
+        with TRACE.operation(f"onglet {self.tabs.tab(tab, 'text')}"): builder()
+        if self._view is not None: self.show_student_view(self._view)
+
+    def _tab_ready(self, tab):
+        return str(tab) not in self._tab_builders
+
+    def show_tab(self, tab):
+        self._build_tab(tab); self.tabs.select(tab)
+
+    def _build_notes_tab(self):
         nf = ttk.Frame(self.tab_notes)
         nf.pack(fill="both", expand=True)
         lf = ttk.Frame(nf)
@@ -157,9 +354,15 @@ class App(ttk.Frame):
         ttk.Label(rf, text="Calculs & Bulletins").pack(anchor="w")
         self.avg_label = ttk.Label(rf, text="Sélectionnez un élève...")
         self.avg_label.pack(anchor="w", pady=6)
-        ttk.Button(rf, text="Ajouter contrôle / note", command=self.add_grade).pack(anchor="w", pady=4)
+        self.lst_grades = tk.Listbox(rf, height=12)
+        self.lst_grades.pack(fill="both", expand=True)
+        btng = ttk.Frame(rf)
+        btng.pack(fill="x", pady=4)
+        ttk.Button(btng, text="Ajouter contrôle / note", command=self.add_grade).pack(side="left", padx=2)
+        ttk.Button(btng, text="Supprimer note", command=self.delete_grade).pack(side="left", padx=2)
+        ttk.Button(btng, text="Classement de la classe", command=self.view_class_ranking).pack(side="left", padx=2)
 
-        # Messages tab
+    def _build_messages_tab(self):
         mf = ttk.Frame(self.tab_messages)
         mf.pack(fill="both", expand=True, padx=6, pady=6)
         leftm = ttk.Frame(mf)
@@ -167,6 +370,9 @@ class App(ttk.Frame):
         ttk.Label(leftm, text="Messages").pack(anchor="w")
         self.lst_msgs = tk.Listbox(leftm, width=30)
         self.lst_msgs.pack(fill="y", expand=True)
+        self.more_msgs_btn = ttk.Button(leftm, text="Messages plus anciens", command=self.load_older_messages)
+        self.more_msgs_btn.pack(fill="x", pady=(4, 0))
+        self._msg_rows = []     # rows shown in lst_msgs, same order
         rightm = ttk.Frame(mf)
         rightm.pack(side="left", fill="both", expand=True, padx=6)
         self.msg_text = tk.Text(rightm, height=15)
@@ -178,8 +384,11 @@ class App(ttk.Frame):
         ttk.Entry(sendf, textvariable=self.sender_var, width=12).pack(side="left", padx=4)
         ttk.Button(sendf, text="Envoyer", command=self.send_message).pack(side="left", padx=6)
         ttk.Button(sendf, text="Marquer lu", command=self.mark_msg_read).pack(side="left", padx=4)
+        ttk.Button(sendf, text="Tout marquer lu", command=self.mark_student_read).pack(side="left", padx=4)
+        ttk.Button(sendf, text="Envoyer à la classe", command=self.broadcast_to_class).pack(side="left", padx=4)
+        ttk.Button(sendf, text="Non lus (tous)", command=self.inbox_window).pack(side="left", padx=4)
 
-        # Inscription tab: form
+    def _build_inscription_tab(self):
         f = ttk.Frame(self.tab_inscription, padding=6)
         f.pack(fill="both", expand=True)
         lefti = ttk.Frame(f)
@@ -197,7 +406,7 @@ class App(ttk.Frame):
         self.photo_label.pack()
         ttk.Button(lefti, text="Enregistrer", command=self.save_inscription).pack(pady=6)
 
-        # Reports & payments tab
+    def _build_reports_tab(self):
         rptf = ttk.Frame(self.tab_reports, padding=6)
         rptf.pack(fill="both", expand=True)
         ttk.Label(rptf, text="Exports & paiements").pack(anchor="w")
@@ -205,144 +414,421 @@ class App(ttk.Frame):
         ttk.Button(btns, text="Exporter élèves CSV", command=self.export_students_csv).pack(side="left", padx=4)
         ttk.Button(btns, text="Exporter paiements CSV", command=self.export_payments_csv).pack(side="left", padx=4)
         ttk.Button(btns, text="Générer bulletin (HTML)", command=self.generate_report_html).pack(side="left", padx=4)
+        ttk.Button(btns, text="Bulletins par lot", command=self.batch_bulletins_window).pack(side="left", padx=4)
         ttk.Button(btns, text="Ajouter paiement", command=self.add_payment).pack(side="left", padx=4)
         ttk.Button(btns, text="Voir paiements", command=self.view_payments_window).pack(side="left", padx=4)
-        ttk.Button(rptf, text="Ouvrir dossier photos", command=lambda: os.startfile(str(PHOTOS))).pack(anchor="w", pady=6)
+        ttk.Button(btns, text="Importer CSV", command=self.import_csv_window).pack(side="left", padx=4)
+        ledger = ttk.Frame(rptf); ledger.pack(anchor="w", pady=6)
+        ttk.Button(ledger, text="Grille des frais", command=self.fees_window).pack(side="left", padx=4)
+        ttk.Button(ledger, text="Élèves en retard de paiement", command=self.overdue_window).pack(side="left", padx=4)
+        ttk.Button(ledger, text="Recettes", command=self.revenue_window).pack(side="left", padx=4)
+        self.export_incremental = tk.BooleanVar(value=False)
+        ttk.Checkbutton(rptf, text="Exporter seulement les ajouts/modifications depuis le dernier export incrémental",
+                        variable=self.export_incremental).pack(anchor="w")
+        photof = ttk.Frame(rptf); photof.pack(anchor="w", pady=6)
+        ttk.Button(photof, text="Ouvrir dossier photos", command=lambda: os.startfile(str(PHOTOS))).pack(side="left", padx=4)
+        ttk.Button(photof, text="Nettoyer les photos", command=self.clean_photos).pack(side="left", padx=4)
+        ttk.Button(photof, text="Diagnostics", command=self.diagnostics_window).pack(side="left", padx=4)
+        ttk.Button(photof, text="Sauvegardes", command=self.backups_window).pack(side="left", padx=4)
 
-        # Planning
+    def _build_planning_tab(self):
         pf = ttk.Frame(self.tab_planning, padding=6)
         pf.pack(fill="both", expand=True)
-        ttk.Label(pf, text="Planning simple").pack(anchor="w")
-        self.plan_text = tk.Text(pf, height=20)
-        self.plan_text.pack(fill="both", expand=True)
+        planbar = ttk.Frame(pf); planbar.pack(fill="x")
+        self.plan_week = datetime.date.today()
+        ttk.Button(planbar, text="<", width=3, command=lambda: self.move_plan_week(-7)).pack(side="left")
+        self.plan_label = ttk.Label(planbar, width=30, anchor="center")
+        self.plan_label.pack(side="left")
+        ttk.Button(planbar, text=">", width=3, command=lambda: self.move_plan_week(7)).pack(side="left")
+        ttk.Button(planbar, text="Nouveau créneau", command=self.add_slot_window).pack(side="left", padx=(12, 4))
+        ttk.Button(planbar, text="Supprimer créneau", command=self.delete_slot).pack(side="left", padx=4)
+        ttk.Button(planbar, text="Créneau libre", command=self.free_slot_window).pack(side="left", padx=4)
+        ttk.Button(planbar, text="Conflits", command=self.show_conflicts).pack(side="left", padx=4)
+        ttk.Button(planbar, text="Leçons de la semaine", command=self.show_week_lessons).pack(side="left", padx=4)
+        cols = (("day", "Jour", 130), ("time", "Heure", 90), ("student", "Élève", 160), ("teacher", "Enseignant", 120),
+                ("room", "Salle", 80), ("topic", "Sujet", 160))
+        self.plan_tree = ttk.Treeview(pf, columns=[c[0] for c in cols], show="headings", selectmode="browse")
+        for col, label, width in cols:
+            self.plan_tree.heading(col, text=label); self.plan_tree.column(col, width=width, anchor="w")
+        self.plan_tree.pack(fill="both", expand=True, pady=(6, 0))
+        self.load_week()
+
+    # Background jobs
+    def start_job(self, label, work, on_done):
+        """Run work(progress, cancelled) on a worker thread.
+
+        The worker reports through a queue polled from the Tk thread; the
+        status bar shows a progress bar and an Annuler button until
+        on_done(result) is called.
+        """
+        if self._job:
+            messagebox.showinfo("Occupé", "Une tâche est déjà en cours"); return
+        events, cancel = queue.Queue(), threading.Event()
+        def run():
+            try:
+                with TRACE.operation(f"tâche {label}"):
+                    events.put(("done", work(lambda done, total: events.put(("progress", done, total)), cancel.is_set)))
+            except Exception as e:
+                events.put(("error", e))
+            finally:
+                self.db.release_thread()
+        self._job = cancel
+        self.status.config(text=label)
+        self.progress.config(value=0, maximum=1); self.progress.pack(side="left", padx=4); self.cancel_btn.pack(side="left")
+        threading.Thread(target=run, daemon=True).start()
+        self.after(100, self._poll_job, events, label, on_done)
+
+    @untraced
+    def _poll_job(self, events, label, on_done):
+        while True:
+            try: event = events.get_nowait()
+            except queue.Empty: break
+            if event[0] == "progress":
+                done, total = event[1:]
+                self.progress.config(maximum=max(total, 1), value=done)
+                self.status.config(text=f"{label} {done}/{total}")
+                continue
+            self._job = None
+            self.progress.pack_forget(); self.cancel_btn.pack_forget()
+            if event[0] == "error":
+                self.status.config(text=f"{label} échec: {event[1]}")
+                messagebox.showerror("Erreur", str(event[1]))
+            else:
+                on_done(event[1])
+            return
+        self.after(100, self._poll_job, events, label, on_done)
+
+    def cancel_job(self):
+        if self._job: self._job.set()
+
+    def _show_busy(self, busy):
+        if self._job: return
+        if busy: self.status.config(text="Chargement..."); return
+        last, self._ready_note = self._ready_note or TRACE.last, None
+        self.status.config(text=f"Prêt ({last[0]}: {last[1]:.0f} ms)" if last else "Prêt")
 
-        # Status bar
-        self.status = ttk.Label(self, text="Prêt", relief=tk.SUNKEN, anchor="w")
-        self.status.pack(fill="x", side="bottom")
+    def _report_error(self, exc, value, tb):
+        # unexpected errors in Tk handlers: logged and shown, instead of a traceback on a hidden console
+        TRACE.error("interface", value)
+        self.status.config(text=f"Erreur: {value}")
+        messagebox.showerror("Erreur", f"{type(value).__name__}: {value}\n\nDétails dans {LOG_DIR / LOG_FILES['app']}")
 
-    # DB helpers
-    def conn(self):
-        return sqlite3.connect(DB)
+    def _show_query_error(self, error):
+        self._paging = False    # a page that failed to load must not block further scrolling
+        self.status.config(text=f"Erreur base de données: {error}")
 
-    def load_students(self):
+    def schedule_search(self):
+        # search-as-you-type: restart the timer on every keystroke so only the
+        # last state of the entry is queried
+        if self._search_job: self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DELAY_MS, self.load_students)
+
+    def load_students(self, select=None):
+        """(Re)load the list in the background; `select` is an id to select once shown."""
+        if self._search_job:
+            self.after_cancel(self._search_job); self._search_job = None
         q = self.search_var.get().strip()
-        conn = self.conn(); c = conn.cursor()
         if q:
-            c.execute("SELECT id, code, last_name, first_name, classe FROM students WHERE code LIKE ? OR last_name LIKE ? OR first_name LIKE ? ORDER BY id", (f"%{q}%",f"%{q}%",f"%{q}%"))
+            work = lambda: search_students(self.db, q, SEARCH_LIMIT)
         else:
-            c.execute("SELECT id, code, last_name, first_name, classe FROM students ORDER BY id")
-        rows = c.fetchall(); conn.close()
-        self.lst.delete(0, tk.END)
-        for r in rows:
-            display = f"{r[1]} - {r[2]} {r[3]} ({r[4]})"
-            self.lst.insert(tk.END, f"{r[0]}|{display}")
+            sort, desc = self.sort_col, self.sort_desc
+            work = lambda: student_page(self.db, sort, desc, limit=PAGE_SIZE + 1)
+        self.executor.submit("students", work, lambda rows: self._show_students(rows, bool(q), select))
+
+    def _show_students(self, rows, searching, select):
+        self.tree.delete(*self.tree.get_children()); self._row_keys.clear()
+        self._next_page = None; self._list_version += 1
+        self._more_above = self._more_below = self._paging = False
+        if searching:
+            for r in rows:
+                self.tree.insert("", "end", iid=str(r[0]), values=student_values(r), tags=student_tags(r))
+            if self.sort_col != "id": self._sort_loaded_rows()
+        else:
+            self._extend_student_window(True, rows)
+        if select is not None and self.tree.exists(str(select)):
+            self.tree.selection_set(str(select)); self.tree.see(str(select))
+        if self.startup:
+            startup, self.startup = self.startup, None
+            startup.mark("première page"); startup.report()
+            self._ready_note = ("démarrage", startup.total_ms())
+
+    def _load_page(self, forward):
+        """Fetch the next (or previous) page on the executor, then show it; the
+        page below comes from the prefetch when it is ready."""
+        children = self.tree.get_children()
+        if not children: self._paging = False; return
+        sort, desc, version = self.sort_col, self.sort_desc, self._list_version
+        if forward:
+            after = self._row_keys[children[-1]]
+            ahead, self._next_page = self._next_page, None
+            if ahead and ahead[0] == (after, sort, desc):
+                self._extend_student_window(True, ahead[1]); return
+            work = lambda: student_page(self.db, sort, desc, after=after, limit=PAGE_SIZE + 1)
+        else:
+            before = self._row_keys[children[0]]
+            work = lambda: student_page(self.db, sort, desc, before=before, limit=PAGE_SIZE + 1)
+        def loaded(rows):
+            # the list was reloaded or edited meanwhile: the page may not fit any more
+            if version != self._list_version: self._paging = False; return
+            self._extend_student_window(forward, rows)
+        self.executor.submit("students_page", work, loaded)
+
+    def _extend_student_window(self, forward, rows):
+        """Add a fetched page of `rows` below (or above) the loaded ones and drop
+        the page at the other end once more than MAX_PAGES are shown, keeping
+        the visible rows in place."""
+        children = self.tree.get_children()
+        top = round(self.tree.yview()[0] * len(children))
+        self._next_page = None
+        if forward:
+            self._more_below = len(rows) > PAGE_SIZE
+            rows = rows[:PAGE_SIZE]
+        else:
+            self._more_above = len(rows) > PAGE_SIZE
+            rows = rows[-PAGE_SIZE:]
+            top += len(rows)
+        for r in (rows if forward else reversed(rows)):
+            iid = str(r[0])
+            self.tree.insert("", "end" if forward else 0, iid=iid, values=student_values(r), tags=student_tags(r))
+            self._row_keys[iid] = (r[5], r[0])
+        children = self.tree.get_children()
+        excess = len(children) - PAGE_SIZE * MAX_PAGES
+        if excess > 0:
+            dropped = children[:excess] if forward else children[-excess:]
+            self.tree.delete(*dropped)
+            for iid in dropped: self._row_keys.pop(iid, None)
+            if forward: self._more_above = True; top -= excess
+            else: self._more_below = True
+        if children and top:
+            self.tree.yview_moveto(max(top, 0) / len(self.tree.get_children()))
+        self._paging = False
+        self._prefetch_next_page()
+
+    def _prefetch_next_page(self):
+        """Fetch the page below the loaded rows in the background, so scrolling
+        down does not wait for the database."""
+        children = self.tree.get_children()
+        if not self._more_below or not children: return
+        after, sort, desc, version = self._row_keys[children[-1]], self.sort_col, self.sort_desc, self._list_version
+        def loaded(rows):
+            if version == self._list_version: self._next_page = ((after, sort, desc), rows)
+        self.executor.submit("students_next", lambda: student_page(self.db, sort, desc, after=after, limit=PAGE_SIZE + 1), loaded)
+
+    def _on_student_scroll(self, first, last):
+        self.tree_scroll.set(first, last)
+        if self._paging: return
+        if float(last) >= 0.98 and self._more_below:
+            self._paging = True; self.after_idle(self._load_page, True)
+        elif float(first) <= 0.02 and self._more_above:
+            self._paging = True; self.after_idle(self._load_page, False)
+
+    def sort_students(self, col):
+        if self.sort_col == col: self.sort_desc = not self.sort_desc
+        else: self.sort_col, self.sort_desc = col, False
+        for c, label, _ in STUDENT_COLUMNS:
+            arrow = (" ▼" if self.sort_desc else " ▲") if c == col else ""
+            self.tree.heading(c, text=label + arrow)
+        if self.search_var.get().strip(): self._sort_loaded_rows()
+        else: self.load_students()
+
+    def _sort_loaded_rows(self):
+        # search results are few and already loaded: reorder them in place
+        idx = [c[0] for c in STUDENT_COLUMNS].index(self.sort_col)
+        items = sorted(self.tree.get_children(), key=lambda i: str(self.tree.set(i, STUDENT_COLUMNS[idx][0])).lower(), reverse=self.sort_desc)
+        for pos, iid in enumerate(items): self.tree.move(iid, "", pos)
+
+    def refresh_student_row(self, sid):
+        """Update one row of the list after an edit instead of reloading it."""
+        self.refresh_student_rows([sid])
+
+    def refresh_student_rows(self, ids):
+        """Update the loaded rows among `ids` with one background query; rows of
+        deleted students go. Ids still waiting from an earlier call are read
+        again with these, since this request supersedes that one."""
+        self._next_page = None; self._list_version += 1
+        self._stale_rows.update(i for i in ids if self.tree.exists(str(i)))
+        if not self._stale_rows: return
+        stale = sorted(self._stale_rows)
+        self.executor.submit("student_rows", lambda: student_rows(self.db, stale), lambda rows: self._update_student_rows(stale, rows))
+
+    def _update_student_rows(self, ids, rows):
+        self._stale_rows.difference_update(ids)
+        rows = {r[0]: r for r in rows}
+        for sid in ids:
+            iid, r = str(sid), rows.get(sid)
+            if not self.tree.exists(iid): continue
+            if r is None:
+                self.tree.delete(iid); self._row_keys.pop(iid, None)
+            else:
+                # the row keeps its keyset key: it still marks a valid position for paging
+                self.tree.item(iid, values=student_values(r), tags=student_tags(r))
+
+    def selected_id(self):
+        sel = self.tree.selection()
+        return int(sel[0]) if sel else None
 
     def on_select(self, event=None):
-        sel = self.lst.curselection()
-        if not sel: return
-        raw = self.lst.get(sel[0])
-        sid = int(raw.split("|",1)[0])
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT code,last_name,first_name,classe,cycle,year,photo,notes,phone FROM students WHERE id=?", (sid,))
-        s = c.fetchone(); conn.close()
-        txt = f"Code: {s[0]}\nNom: {s[2]} {s[1]}\nClasse: {s[3]} | Cycle: {s[4]} | Année: {s[5]}\nTéléphone: {s[8] or ''}\n\nNotes:\n{s[7] or ''}"
+        sid = self.selected_id()
+        if sid is not None: self.refresh_student(sid)
+
+    def refresh_student(self, sid):
+        """Show a student's tabs from the cache, or load them in the background;
+        quick clicks through the list only ever display the last student."""
+        view = self.view_cache.get(sid)
+        if view is not None:
+            self.show_student_view(view); self._prefetch_neighbours(sid); return
+        version = self.view_cache.version
+        def loaded(view):
+            if view is not None: self.view_cache.put(sid, view, version)
+            self.show_student_view(view); self._prefetch_neighbours(sid)
+        # the version is part of the ident so a load started before a write is not reused
+        self.executor.submit("student_view", lambda: load_student_view(self.db, sid), loaded, ident=(sid, version))
+
+    def _prefetch_neighbours(self, sid):
+        iid = str(sid)
+        if not self.tree.exists(iid): return
+        ids = [int(i) for i in (self.tree.prev(iid), self.tree.next(iid)) if i and int(i) not in self.view_cache]
+        if not ids: return
+        version = self.view_cache.version
+        def loaded(views):
+            for view in views:
+                if view is not None: self.view_cache.put(view["id"], view, version)
+        self.executor.submit("prefetch", lambda: [load_student_view(self.db, i) for i in ids], loaded)
+
+    def invalidate_student(self, sid, classmates=False):
+        """Drop the cached views a write to student `sid` made stale: its own and,
+        with `classmates`, those of its classe (rank and classe average change)."""
+        view = self.view_cache.pop(sid)
+        if classmates:
+            # not cached: finding its classe would take a query on the Tk thread
+            if view is None: self.view_cache.clear(); return
+            classe = view["student"][3]
+            self.view_cache.discard_if(lambda v: v["student"][3] == classe)
+
+    def show_student_view(self, view):
+        if view is None or view["id"] != self.selected_id(): return
+        s = view["student"]
+        due, paid, owed = view["balance"]
+        txt = f"Code: {s[0]}\nNom: {s[2]} {s[1]}\nClasse: {s[3]} | Cycle: {s[4]} | Année: {s[5]}\nTéléphone: {s[8] or ''}\n"
+        txt += f"Frais: {due:g} | Payé: {paid:g} | Reste dû: {owed:g}\n\nNotes:\n{s[7] or ''}"
         self.info_text.configure(state="normal"); self.info_text.delete("1.0","end"); self.info_text.insert("1.0", txt); self.info_text.configure(state="disabled")
-        # load lessons and messages
-        self.load_lessons(sid); self.load_messages(sid); self.compute_average(sid)
+        self.show_photo(s[6], view["thumbnail"])
+        self._view = view
+        # tabs not built yet get the view when they are (_build_tab)
+        if self._tab_ready(self.tab_notes):
+            self.show_lessons(view["lessons"]); self.show_grades(view["grades"]); self.show_average(view["average"])
+        if self._tab_ready(self.tab_messages): self.show_messages(view["messages"])
+
+    def show_photo(self, photo, thumb):
+        """Show the thumbnail of `photo`; images are decoded on first display only."""
+        img = self._thumbs.get(photo)
+        if img is None and photo:
+            try: img = self._tk_thumbnail(photo, thumb)
+            except (tk.TclError, OSError): img = None
+            if img is not None:
+                self._thumbs[photo] = img
+                if len(self._thumbs) > VIEW_CACHE_SIZE: self._thumbs.popitem(last=False)
+        if img is not None: self._thumbs.move_to_end(photo)
+        self.photo_view.config(image=img or "", text="" if img else ("Photo indisponible" if photo else ""))
+
+    def _tk_thumbnail(self, photo, thumb):
+        if thumb is not None: return tk.PhotoImage(file=str(thumb))
+        src = photo_path(photo)
+        if src.suffix.lower() not in (".png", ".gif"): return None     # needs PIL
+        img = tk.PhotoImage(file=str(src))
+        img = img.subsample(max(1, -(-max(img.width(), img.height()) // THUMB_SIZE)))
+        cached = thumbnail_path(photo)
+        if cached is not None:
+            THUMBS.mkdir(exist_ok=True); img.write(str(cached), format="png")
+        return img
 
     def add_student(self):
         # open inscription tab and clear form
+        self.show_tab(self.tab_inscription)
         for k in self.form: self.form[k].set("")
         self.photo_label.config(text="Aucune photo"); self.chosen_photo = None
         messagebox.showinfo("Ajouter", "Remplissez le formulaire dans l'onglet Inscription, puis cliquez Enregistrer.")
 
     def edit_student(self):
-        sel = self.lst.curselection()
-        if not sel:
+        sid = self.selected_id()
+        if sid is None:
             messagebox.showinfo("Info","Sélectionnez un élève à modifier"); return
-        raw = self.lst.get(sel[0]); sid = int(raw.split("|",1)[0])
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT code,last_name,first_name,classe,cycle,year,photo,notes,phone FROM students WHERE id=?", (sid,))
-        r = c.fetchone(); conn.close()
+        self.executor.submit("edit_student", lambda: get_student(self.db, sid),
+                             lambda r: self._fill_edit_form(sid, r))
+
+    def _fill_edit_form(self, sid, r):
         if r:
+            self.show_tab(self.tab_inscription)
             self.form["code"].set(r[0]); self.form["prénom"].set(r[2]); self.form["nom"].set(r[1])
             self.form["classe"].set(r[3]); self.form["cycle"].set(r[4]); self.form["année"].set(r[5])
             self.form["téléphone_parent"].set(r[8] or "")
-            self.photo_label.config(text=r[6] or "Aucune photo")
+            self.photo_label.config(text="Photo enregistrée" if r[6] else "Aucune photo")
             self.chosen_photo = r[6]; self.editing_id = sid
             messagebox.showinfo("Modifier", "Faites les changements dans l'onglet Inscription, puis Enregistrer.")
 
     def delete_student(self):
-        sel = self.lst.curselection()
-        if not sel:
+        sid = self.selected_id()
+        if sid is None:
             messagebox.showinfo("Info","Sélectionnez un élève à supprimer"); return
         if not messagebox.askyesno("Confirm","Supprimer cet élève ?"): return
-        raw = self.lst.get(sel[0]); sid = int(raw.split("|",1)[0])
-        conn = self.conn(); c = conn.cursor()
-        c.execute("DELETE FROM students WHERE id=?", (sid,))
-        c.execute("DELETE FROM lessons WHERE student_id=?", (sid,))
-        c.execute("DELETE FROM payments WHERE student_id=?", (sid,))
-        c.execute("DELETE FROM messages WHERE student_id=?", (sid,))
-        conn.commit(); conn.close(); self.load_students()
+        self.invalidate_student(sid, classmates=True)
+        delete_student(self.db, sid)
+        self.refresh_student_row(sid)
 
     def choose_photo(self):
         p = filedialog.askopenfilename(title="Choisir photo", filetypes=[("Images","*.png;*.gif;*.jpg;*.jpeg"),("All","*.*")])
         if p:
-            dest = PHOTOS / Path(p).name
-            try: shutil.copy(p, dest)
-            except Exception: pass
-            self.photo_label.config(text=str(dest)); self.chosen_photo = str(dest)
+            try: key = store_photo(p)
+            except OSError as e:
+                TRACE.error("choose_photo", e); messagebox.showerror("Photo", f"Copie impossible: {e}"); return
+            self.photo_label.config(text=Path(p).name); self.chosen_photo = key
 
     def save_inscription(self):
-        code = self.form["code"].get().strip()
-        prenom = self.form["prénom"].get().strip()
-        nom = self.form["nom"].get().strip()
-        classe = self.form["classe"].get().strip()
-        cycle = self.form["cycle"].get().strip()
-        year = self.form["année"].get().strip()
-        phone = self.form["téléphone_parent"].get().strip() if "téléphone_parent" in self.form else ""
-        photo = getattr(self, "chosen_photo", None)
-        if not code or not prenom:
+        form = {"code": "code", "prénom": "first_name", "nom": "last_name", "classe": "classe", "cycle": "cycle",
+                "année": "year", "téléphone_parent": "phone"}
+        fields = {col: self.form[key].get().strip() for key, col in form.items() if key in self.form}
+        fields["photo"] = getattr(self, "chosen_photo", None)
+        if not fields["code"] or not fields["first_name"]:
             messagebox.showwarning("Champs manquants","Code et prénom requis"); return
-        conn = self.conn(); c = conn.cursor()
-        if getattr(self, "editing_id", None):
-            c.execute("UPDATE students SET code=?, last_name=?, first_name=?, classe=?, cycle=?, year=?, photo=?, phone=? WHERE id=?",
-                      (code, nom, prenom, classe, cycle, year, photo, phone, self.editing_id))
-            self.editing_id = None
-        else:
-            try:
-                c.execute("INSERT INTO students (code,last_name,first_name,classe,cycle,year,photo,phone) VALUES (?,?,?,?,?,?,?,?)",
-                          (code, nom, prenom, classe, cycle, year, photo, phone))
-            except Exception as e:
-                messagebox.showerror("Erreur", str(e))
-        conn.commit(); conn.close(); self.load_students(); messagebox.showinfo("OK","Élève enregistré")
+        sid = getattr(self, "editing_id", None)
+        try:
+            if sid:
+                self.invalidate_student(sid, classmates=True)   # old classe
+                save_student(self.db, fields, sid)
+                self.invalidate_student(sid, classmates=True)   # new classe
+                self.editing_id = None
+            else:
+                sid = save_student(self.db, fields)
+                self.load_students(select=sid)
+        except sqlite3.Error as e:
+            TRACE.error("save_inscription", e); messagebox.showerror("Erreur", str(e)); return
+        self.refresh_student_row(sid)
+        if self.tree.exists(str(sid)): self.refresh_student(sid)
+        messagebox.showinfo("OK","Élève enregistré")
 
     def open_inscription_window(self, edit=False):
         # helper kept for backward compatibility
         messagebox.showinfo("Inscription", "Utilisez l'onglet Inscription pour remplir le formulaire.")
 
     # Lessons / notes
-    def load_lessons(self, student_id):
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT id,date,topic,duration,note FROM lessons WHERE student_id=? ORDER BY date DESC", (student_id,))
-        rows = c.fetchall(); conn.close()
+    def show_lessons(self, rows):
         self.lst_lessons.delete(0, tk.END)
         for r in rows:
             self.lst_lessons.insert(tk.END, f"{r[0]}|{r[1]} - {r[2]} ({r[3]}min) Note:{r[4] or ''}")
 
     def add_lesson(self):
-        sel = self.lst.curselection(); 
-        if not sel: messagebox.showinfo("Info","Sélectionnez un élève"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0])
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève"); return
         w = tk.Toplevel(self); w.title("Ajouter leçon")
         ttk.Label(w, text="Date (YYYY-MM-DD)").pack(); dvar = tk.StringVar(value=str(datetime.date.today())); ttk.Entry(w, textvariable=dvar).pack()
         ttk.Label(w, text="Sujet").pack(); tvar = tk.StringVar(); ttk.Entry(w, textvariable=tvar).pack()
         ttk.Label(w, text="Durée (min)").pack(); dur = tk.IntVar(value=60); ttk.Entry(w, textvariable=dur).pack()
         ttk.Label(w, text="Note/Commentaire").pack(); nvar = tk.StringVar(); ttk.Entry(w, textvariable=nvar).pack()
         def save():
-            conn = self.conn(); c = conn.cursor()
-            c.execute("INSERT INTO lessons (student_id,date,topic,duration,note) VALUES (?,?,?,?,?)", (sid, dvar.get(), tvar.get(), dur.get(), nvar.get()))
-            conn.commit(); conn.close(); w.destroy(); self.load_lessons(sid)
+            try: add_lesson(self.db, sid, dvar.get(), tvar.get(), dur.get(), nvar.get())
+            except (tk.TclError, ValueError) as e: messagebox.showwarning("Leçon", str(e), parent=w); return
+            self.invalidate_student(sid)
+            w.destroy(); self.refresh_student(sid)
         ttk.Button(w, text="Enregistrer", command=save).pack(pady=6)
 
     def delete_lesson(self):
@@ -350,134 +836,561 @@ class App(ttk.Frame):
         if not sel: messagebox.showinfo("Info","Sélectionnez une leçon"); return
         rid = int(self.lst_lessons.get(sel[0]).split("|",1)[0])
         if not messagebox.askyesno("Confirm","Supprimer cette leçon ?"): return
-        conn = self.conn(); c = conn.cursor(); c.execute("DELETE FROM lessons WHERE id=?", (rid,)); conn.commit(); conn.close(); self.load_students()
+        delete_lesson(self.db, rid)
+        sid = self.selected_id()
+        if sid is not None: self.invalidate_student(sid); self.refresh_student(sid)
 
     def add_grade(self):
-        sel = self.lst.curselection()
-        if not sel: messagebox.showinfo("Info","Sélectionnez un élève"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0])
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève"); return
         w = tk.Toplevel(self); w.title("Ajouter note/contrôle")
-        ttk.Label(w, text="Titre").pack(); title = tk.StringVar(); ttk.Entry(w, textvariable=title).pack()
+        today = str(datetime.date.today())
+        ttk.Label(w, text="Matière").pack(); subject = tk.StringVar(); ttk.Entry(w, textvariable=subject).pack()
         ttk.Label(w, text="Valeur (0-20)").pack(); val = tk.DoubleVar(value=10); ttk.Entry(w, textvariable=val).pack()
+        ttk.Label(w, text="Coefficient").pack(); coef = tk.DoubleVar(value=1); ttk.Entry(w, textvariable=coef).pack()
+        ttk.Label(w, text="Date (YYYY-MM-DD)").pack(); dvar = tk.StringVar(value=today); ttk.Entry(w, textvariable=dvar).pack()
+        # left blank, add_grade() takes the term of the grade's date
+        ttk.Label(w, text="Trimestre (vide: d'après la date)").pack(); term = tk.StringVar(); ttk.Entry(w, textvariable=term).pack()
         ttk.Label(w, text="Commentaire").pack(); cvar = tk.StringVar(); ttk.Entry(w, textvariable=cvar).pack()
         def save():
-            conn = self.conn(); c = conn.cursor()
-            c.execute("INSERT INTO lessons (student_id,date,topic,duration,note) VALUES (?,?,?,?,?)", (sid, str(datetime.date.today()), title.get(), 0, str(val.get()) + " | " + cvar.get()))
-            conn.commit(); conn.close(); w.destroy(); self.load_lessons(sid); self.compute_average(sid)
+            try:
+                value, coefficient = float(val.get()), float(coef.get())
+            except (tk.TclError, ValueError):
+                messagebox.showwarning("Note", "Valeur et coefficient doivent être des nombres", parent=w); return
+            try: add_grade(self.db, sid, dvar.get(), subject.get(), value, coefficient, term.get().strip() or None, cvar.get())
+            except ValueError as e: messagebox.showwarning("Note", str(e), parent=w); return
+            self.invalidate_student(sid, classmates=True)
+            w.destroy(); self.refresh_student(sid)
         ttk.Button(w, text="Enregistrer", command=save).pack(pady=6)
 
-    def compute_average(self, student_id):
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT note FROM lessons WHERE student_id=? AND note IS NOT NULL", (student_id,))
-        rows = c.fetchall(); conn.close()
-        grades = []
+    def show_grades(self, rows):
+        self.lst_grades.delete(0, tk.END)
         for r in rows:
-            try:
-                g = float(str(r[0]).split("|")[0].strip()); grades.append(g)
-            except Exception:
-                pass
-        if grades:
-            avg = sum(grades)/len(grades)
-            self.avg_label.config(text=f"Moyenne: {avg:.2f} ({len(grades)} notes)")
-        else:
-            self.avg_label.config(text="Aucune note disponible")
+            self.lst_grades.insert(tk.END, f"{r[0]}|{r[1]} - {r[2]} ({r[3] or '-'}) {r[4]:g}/20 x{r[5]:g} {r[6] or ''}")
+
+    def delete_grade(self):
+        sel = self.lst_grades.curselection()
+        if not sel: messagebox.showinfo("Info","Sélectionnez une note"); return
+        rid = int(self.lst_grades.get(sel[0]).split("|",1)[0])
+        if not messagebox.askyesno("Confirm","Supprimer cette note ?"): return
+        delete_grade(self.db, rid)
+        sid = self.selected_id()
+        if sid is not None: self.invalidate_student(sid, classmates=True); self.refresh_student(sid)
+
+    def show_average(self, average):
+        # `average` is one read of the trigger-maintained summary tables
+        avg, count, rank, size, class_avg = average
+        if avg is None:
+            self.avg_label.config(text="Aucune note disponible"); return
+        txt = f"Moyenne: {avg:.2f} ({count} notes) | Rang: {rank}/{size}"
+        if class_avg is not None: txt += f" | Moyenne classe: {class_avg:.2f}"
+        self.avg_label.config(text=txt)
+
+    def view_class_ranking(self):
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève"); return
+        def work():
+            classe = student_classe(self.db, sid)
+            return classe, class_ranking(self.db, classe)
+        self.executor.submit("class_ranking", work, lambda result: self._show_class_ranking(*result))
+
+    def _show_class_ranking(self, classe, rows):
+        w = tk.Toplevel(self); w.title(f"Classement {classe or ''}")
+        lb = tk.Listbox(w, width=60)
+        lb.pack(fill="both", expand=True)
+        for r in rows:
+            lb.insert(tk.END, f"{r[0]}. {r[2]} - {r[4]} {r[3]} : {r[5]:.2f}")
 
     # Messages
-    def load_messages(self, student_id):
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT id,date,sender,content,read_flag FROM messages WHERE student_id=? ORDER BY date DESC", (student_id,))
-        rows = c.fetchall(); conn.close()
-        self.lst_msgs.delete(0, tk.END)
+    def show_messages(self, rows, append=False):
+        """Show the newest page of messages, or append an older page."""
+        if not append:
+            self.lst_msgs.delete(0, tk.END); self._msg_rows = []
         for r in rows:
-            flag = "" if r[4] else "*NEW* "
-            self.lst_msgs.insert(tk.END, f"{r[0]}|{flag}{r[1]} - {r[2]}: {r[3][:30]}")
+            self._msg_rows.append(r); self.lst_msgs.insert(tk.END, self._message_line(r))
+        self.more_msgs_btn.config(state="normal" if len(rows) >= MESSAGE_PAGE else "disabled")
+
+    @staticmethod
+    def _message_line(r):
+        flag = "" if r[4] else "*NEW* "
+        return f"{r[0]}|{flag}{r[1]} - {r[2]}: {r[3][:30]}"
+
+    def load_older_messages(self):
+        sid = self.selected_id()
+        if sid is None or not self._msg_rows: return
+        last = self._msg_rows[-1]
+        def loaded(rows):
+            if self.selected_id() == sid: self.show_messages(rows, append=True)
+        self.executor.submit("older_messages", lambda: message_page(self.db, sid, before=(last[1], last[0])), loaded)
+
+    def _messages_read(self, sids):
+        """Targeted refresh after messages were marked read or sent: the affected
+        list rows and cached views only."""
+        for sid in sids: self.invalidate_student(sid)
+        self.refresh_student_rows(sids)
 
     def send_message(self):
-        sel = self.lst.curselection(); 
-        if not sel: messagebox.showinfo("Info","Sélectionnez un élève pour envoyer"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0]); content = self.msg_text.get("1.0","end").strip()
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève pour envoyer"); return
+        content = self.msg_text.get("1.0","end").strip()
         if not content: messagebox.showwarning("Vide","Écrivez un message"); return
-        conn = self.conn(); c = conn.cursor()
-        c.execute("INSERT INTO messages (student_id,date,sender,content,read_flag) VALUES (?,?,?,?,0)", (sid, str(datetime.datetime.now()), self.sender_var.get(), content))
-        conn.commit(); conn.close(); self.msg_text.delete("1.0","end"); self.load_messages(sid); messagebox.showinfo("OK","Message envoyé"); messagebox.showinfo("Notification","Message envoyé aux parents/élève")
+        send_message(self.db, sid, self.sender_var.get(), content)
+        self.invalidate_student(sid); self.refresh_student_row(sid)
+        self.msg_text.delete("1.0","end"); self.refresh_student(sid); messagebox.showinfo("OK","Message envoyé"); messagebox.showinfo("Notification","Message envoyé aux parents/élève")
 
     def mark_msg_read(self):
         sel = self.lst_msgs.curselection()
         if not sel: messagebox.showinfo("Info","Sélectionnez un message"); return
-        rid = int(self.lst_msgs.get(sel[0]).split("|",1)[0])
-        conn = self.conn(); c = conn.cursor(); c.execute("UPDATE messages SET read_flag=1 WHERE id=?", (rid,)); conn.commit(); conn.close()
-        self.load_students()
+        i = sel[0]; r = self._msg_rows[i]
+        if r[4]: return
+        self._messages_read(mark_read(self.db, message_ids=[r[0]]))
+        # rewrite the one line instead of reloading the conversation
+        self._msg_rows[i] = r = r[:4] + (1,)
+        self.lst_msgs.delete(i); self.lst_msgs.insert(i, self._message_line(r))
+
+    def mark_student_read(self):
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève"); return
+        self._messages_read(mark_read(self.db, student_id=sid))
+        self.show_messages([r[:4] + (1,) for r in self._msg_rows])
+
+    def broadcast_to_class(self):
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève de la classe"); return
+        content = self.msg_text.get("1.0","end").strip()
+        if not content: messagebox.showwarning("Vide","Écrivez un message"); return
+        self.executor.submit("broadcast_classe", lambda: student_classe(self.db, sid), lambda classe: self._broadcast(sid, classe, content))
+
+    def _broadcast(self, sid, classe, content):
+        if not messagebox.askyesno("Envoyer à la classe", f"Envoyer ce message à tous les élèves de la classe {classe or '(sans classe)'} ?"): return
+        sids = broadcast_message(self.db, classe, self.sender_var.get(), content)
+        self._messages_read(sids)
+        self.msg_text.delete("1.0","end"); self.refresh_student(sid)
+        messagebox.showinfo("OK", f"Message envoyé à {len(sids)} élèves")
+
+    def inbox_window(self):
+        self.executor.submit("inbox", lambda: unread_messages(self.db), self._show_inbox)
+
+    def _show_inbox(self, rows):
+        w = tk.Toplevel(self); w.title(f"Messages non lus ({len(rows)}{'+' if len(rows) >= INBOX_LIMIT else ''})")
+        lb = tk.Listbox(w, width=100, height=20)
+        lb.pack(fill="both", expand=True)
+        for r in rows:
+            lb.insert(tk.END, f"{r[5]} | {r[2]} - {r[4]} {r[3]} | {r[6]}: {r[7][:60]}")
+        def open_student(event=None):
+            sel = lb.curselection()
+            if not sel: return
+            sid, code = rows[sel[0]][1], rows[sel[0]][2]
+            if self.tree.exists(str(sid)):
+                self.tree.selection_set(str(sid)); self.tree.see(str(sid))
+            else:
+                self.search_var.set(code); self.load_students(select=sid)
+        def read_all():
+            if not messagebox.askyesno("Messages", "Marquer tous les messages comme lus ?", parent=w): return
+            self._messages_read(mark_read(self.db))
+            sid = self.selected_id()
+            if sid is not None: self.refresh_student(sid)
+            w.destroy()
+        lb.bind("<Double-Button-1>", open_student)
+        ttk.Button(w, text="Tout marquer lu", command=read_all).pack(pady=4)
 
     # Payments
     def add_payment(self):
-        sel = self.lst.curselection()
-        if not sel:
+        sid = self.selected_id()
+        if sid is None:
             messagebox.showinfo("Info","Sélectionnez un élève avant d'ajouter un paiement"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0])
         w = tk.Toplevel(self); w.title("Ajouter paiement")
         ttk.Label(w, text="Date (YYYY-MM-DD)").pack(); d = tk.StringVar(value=str(datetime.date.today())); ttk.Entry(w, textvariable=d).pack()
         ttk.Label(w, text="Montant").pack(); amt = tk.DoubleVar(value=0.0); ttk.Entry(w, textvariable=amt).pack()
         ttk.Label(w, text="Méthode (espèces/carte)").pack(); method = tk.StringVar(); ttk.Entry(w, textvariable=method).pack()
         ttk.Label(w, text="Note").pack(); note = tk.StringVar(); ttk.Entry(w, textvariable=note).pack()
         def save():
-            conn = self.conn(); c = conn.cursor()
-            c.execute("INSERT INTO payments (student_id,date,amount,method,note) VALUES (?,?,?,?,?)", (sid, d.get(), float(amt.get()), method.get(), note.get()))
-            conn.commit(); conn.close(); w.destroy(); messagebox.showinfo("OK","Paiement enregistré")
+            try: add_payment(self.db, sid, d.get(), float(amt.get()), method.get(), note.get())
+            except (tk.TclError, ValueError) as e: messagebox.showwarning("Paiement", str(e), parent=w); return
+            self.invalidate_student(sid)
+            w.destroy(); self.refresh_student(sid); messagebox.showinfo("OK","Paiement enregistré")
         ttk.Button(w, text="Enregistrer", command=save).pack(pady=6)
 
     def view_payments_window(self):
-        sel = self.lst.curselection()
-        if not sel:
+        sid = self.selected_id()
+        if sid is None:
             messagebox.showinfo("Info","Sélectionnez un élève pour voir ses paiements"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0])
-        conn = self.conn(); c = conn.cursor(); c.execute("SELECT id,date,amount,method,note FROM payments WHERE student_id=? ORDER BY date DESC", (sid,))
-        rows = c.fetchall(); conn.close()
+        self.executor.submit("payments", lambda: student_payments(self.db, sid),
+                             self._show_payments)
+
+    def _show_payments(self, rows):
         w = tk.Toplevel(self); w.title("Paiements")
         lb = tk.Listbox(w, width=80)
         lb.pack(fill="both", expand=True)
         for r in rows:
             lb.insert(tk.END, f"{r[1]} | {r[2]} | {r[3]} | {r[4] or ''}")
 
+    # Planning
+    def move_plan_week(self, days):
+        self.plan_week += datetime.timedelta(days=days); self.load_week()
+
+    def load_week(self):
+        day = self.plan_week.isoformat()
+        self.executor.submit("week_schedule", lambda: week_schedule(self.db, day), self._show_week)
+
+    def _show_week(self, rows):
+        start, end = period_bounds("week", self.plan_week.isoformat())
+        last = datetime.date.fromisoformat(end) - datetime.timedelta(days=1)
+        self.plan_label.config(text=f"Semaine du {start} au {last.isoformat()}")
+        self.plan_tree.delete(*self.plan_tree.get_children())
+        for r in rows:
+            self.plan_tree.insert("", "end", iid=str(r[1]), values=(f"{WEEKDAYS[r[2]]} {r[0][5:]}", f"{format_time(r[3])}-{format_time(r[4])}",
+                                                                    r[5], r[6] or "", r[7] or "", r[8] or ""))
+
+    def add_slot_window(self):
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info", "Sélectionnez un élève"); return
+        w = tk.Toplevel(self); w.title("Nouveau créneau")
+        day = tk.StringVar(value=WEEKDAYS[0]); start, end = tk.StringVar(value="08:00"), tk.StringVar(value="09:00")
+        teacher, room, topic = tk.StringVar(), tk.StringVar(), tk.StringVar()
+        vfrom, vuntil = tk.StringVar(value=str(datetime.date.today())), tk.StringVar()
+        ttk.Label(w, text="Jour").pack(); ttk.Combobox(w, textvariable=day, values=WEEKDAYS, state="readonly").pack()
+        ttk.Label(w, text="Début (HH:MM)").pack(); ttk.Entry(w, textvariable=start).pack()
+        ttk.Label(w, text="Fin (HH:MM)").pack(); ttk.Entry(w, textvariable=end).pack()
+        ttk.Label(w, text="Enseignant").pack(); teachers = ttk.Combobox(w, textvariable=teacher); teachers.pack()
+        ttk.Label(w, text="Salle").pack(); rooms = ttk.Combobox(w, textvariable=room); rooms.pack()
+        self._fill_resources("slot_resources", teachers, rooms)
+        ttk.Label(w, text="Sujet").pack(); ttk.Entry(w, textvariable=topic).pack()
+        ttk.Label(w, text="À partir du (YYYY-MM-DD)").pack(); ttk.Entry(w, textvariable=vfrom).pack()
+        ttk.Label(w, text="Jusqu'au (exclu, vide = sans fin)").pack(); ttk.Entry(w, textvariable=vuntil).pack()
+        def save():
+            try:
+                until = normalize_date(vuntil.get()) if vuntil.get().strip() else None
+                add_slot(self.db, sid, WEEKDAYS.index(day.get()), parse_time(start.get()), parse_time(end.get()),
+                         normalize_date(vfrom.get()), until, teacher.get(), room.get(), topic.get())
+            except ValueError as e:
+                messagebox.showwarning("Créneau", str(e), parent=w); return
+            w.destroy(); self.load_week()
+        ttk.Button(w, text="Enregistrer", command=save).pack(pady=6)
+
+    def delete_slot(self):
+        sel = self.plan_tree.selection()
+        if not sel: messagebox.showinfo("Info", "Sélectionnez un créneau"); return
+        if not messagebox.askyesno("Confirm", "Supprimer ce créneau (toutes les semaines) ?"): return
+        delete_slot(self.db, int(sel[0]))
+        self.load_week()
+
+    def free_slot_window(self):
+        w = tk.Toplevel(self); w.title("Trouver un créneau libre")
+        teacher, room, duration = tk.StringVar(), tk.StringVar(), tk.StringVar(value="60")
+        for_student = tk.BooleanVar(value=self.selected_id() is not None)
+        ttk.Label(w, text="Enseignant").pack(); teachers = ttk.Combobox(w, textvariable=teacher); teachers.pack()
+        ttk.Label(w, text="Salle").pack(); rooms = ttk.Combobox(w, textvariable=room); rooms.pack()
+        self._fill_resources("free_resources", teachers, rooms)
+        ttk.Label(w, text="Durée (min)").pack(); ttk.Entry(w, textvariable=duration).pack()
+        ttk.Checkbutton(w, text="Libre aussi pour l'élève sélectionné", variable=for_student).pack()
+        lb = tk.Listbox(w, width=40, height=14)
+        def search():
+            try: minutes = _number(duration.get(), "durée", int)
+            except ValueError as e: messagebox.showwarning("Créneau", str(e), parent=w); return
+            t, r = teacher.get(), room.get()
+            sid = self.selected_id() if for_student.get() else None
+            def work():
+                return find_free_slots(self.db, minutes, teacher_id=find_resource(self.db, "teachers", t),
+                                       room_id=find_resource(self.db, "rooms", r), student_id=sid)
+            def show(slots):
+                if not lb.winfo_exists(): return
+                lb.delete(0, tk.END)
+                for weekday, start, end in slots:
+                    lb.insert(tk.END, f"{WEEKDAYS[weekday]} {format_time(start)} - {format_time(end)}")
+            self.executor.submit("free_slots", work, show)
+        ttk.Button(w, text="Chercher", command=search).pack(pady=4)
+        lb.pack(fill="both", expand=True, padx=6, pady=6)
+
+    def _fill_resources(self, key, teachers, rooms):
+        # the pickers of a planning window get their names once they are read
+        def loaded(names):
+            if not teachers.winfo_exists(): return
+            teachers.config(values=names[0]); rooms.config(values=names[1])
+        self.executor.submit(key, lambda: (resource_names(self.db, "teachers"), resource_names(self.db, "rooms")), loaded)
+
+    def show_conflicts(self):
+        self.executor.submit("conflicts", lambda: timetable_conflicts(self.db), self._show_conflicts)
+
+    def _show_conflicts(self, rows):
+        if not rows: messagebox.showinfo("Planning", "Aucun conflit dans le planning"); return
+        w = tk.Toplevel(self); w.title("Conflits du planning")
+        lb = tk.Listbox(w, width=60)
+        lb.pack(fill="both", expand=True)
+        for a, b, label in rows:
+            lb.insert(tk.END, f"Créneaux {a} et {b}: même {label}")
+
+    def show_week_lessons(self):
+        day = self.plan_week.isoformat()
+        self.executor.submit("week_lessons", lambda: week_lessons(self.db, day), self._show_week_lessons)
+
+    def _show_week_lessons(self, rows):
+        w = tk.Toplevel(self); w.title("Leçons de la semaine")
+        lb = tk.Listbox(w, width=70)
+        lb.pack(fill="both", expand=True)
+        for date, name, topic, duration in rows:
+            lb.insert(tk.END, f"{date}  {name} - {topic or ''} ({duration or 0} min)")
+
+    def fees_window(self):
+        w = tk.Toplevel(self); w.title("Grille des frais")
+        lb = tk.Listbox(w, width=50, height=12)
+        lb.pack(fill="both", expand=True, padx=6, pady=6)
+        keys = []   # (scope, value) of each line, in listbox order
+        def show(rows):
+            if not lb.winfo_exists(): return
+            lb.delete(0, tk.END); keys[:] = [r[:2] for r in rows]
+            for scope, value, amount in rows:
+                lb.insert(tk.END, f"{FEE_SCOPES[scope]} | {value} | {amount:g}")
+        reload = lambda: self.executor.submit("fee_schedule", lambda: fee_schedule(self.db), show)
+        form = ttk.Frame(w); form.pack(fill="x", padx=6)
+        scopes = {label: col for col, label in FEE_SCOPES.items()}
+        scope, value, amount = tk.StringVar(value="Classe"), tk.StringVar(), tk.StringVar()
+        ttk.Combobox(form, textvariable=scope, values=list(scopes), state="readonly", width=8).pack(side="left")
+        ttk.Entry(form, textvariable=value, width=12).pack(side="left", padx=4)
+        ttk.Entry(form, textvariable=amount, width=10).pack(side="left", padx=4)
+        def save():
+            try: fee = _number(amount.get(), "montant")
+            except ValueError as e: messagebox.showwarning("Frais", str(e), parent=w); return
+            set_fee(self.db, scopes[scope.get()], value.get().strip(), fee)
+            self._fees_changed(); reload()
+        def remove():
+            sel = lb.curselection()
+            if not sel: return
+            delete_fee(self.db, *keys[sel[0]])
+            self._fees_changed(); reload()
+        ttk.Button(form, text="Enregistrer", command=save).pack(side="left", padx=4)
+        ttk.Button(form, text="Supprimer", command=remove).pack(side="left")
+        reload()
+
+    def _fees_changed(self):
+        # every cached balance may be stale; the student on screen is shown again
+        self.view_cache.clear()
+        sid = self.selected_id()
+        if sid is not None: self.refresh_student(sid)
+
+    def overdue_window(self):
+        self.executor.submit("overdue", lambda: overdue_students(self.db), self._show_overdue)
+
+    def _show_overdue(self, rows):
+        w = tk.Toplevel(self); w.title("Élèves en retard de paiement")
+        lb = tk.Listbox(w, width=90)
+        lb.pack(fill="both", expand=True)
+        for r in rows:
+            lb.insert(tk.END, f"{r[1]} - {r[3]} {r[2]} ({r[4] or ''}) | dû {r[5]:g} | payé {r[6]:g} | reste {r[7]:g}")
+
+    def revenue_window(self):
+        w = tk.Toplevel(self); w.title("Recettes")
+        period = tk.StringVar(value="monthly")
+        bar = ttk.Frame(w); bar.pack(fill="x", padx=6, pady=6)
+        lb = tk.Listbox(w, width=60, height=20)
+        lb.pack(fill="both", expand=True)
+        def show(rows):
+            lb.delete(0, tk.END)
+            for r in rows:
+                lb.insert(tk.END, f"{r[0]} | {r[1] or '-'} | {r[2]:g} ({r[3]} paiements)")
+        def reload():
+            p = period.get()
+            self.executor.submit("revenue", lambda: revenue(self.db, p), lambda rows: w.winfo_exists() and show(rows))
+        ttk.Radiobutton(bar, text="Par mois", variable=period, value="monthly", command=reload).pack(side="left")
+        ttk.Radiobutton(bar, text="Par jour", variable=period, value="daily", command=reload).pack(side="left", padx=6)
+        reload()
+
+    # Diagnostics
+    def diagnostics_window(self):
+        w = tk.Toplevel(self); w.title("Diagnostics - temps par opération")
+        ttk.Label(w, text=f"Requêtes de plus de {TRACE.slow_ms:g} ms enregistrées avec leur plan dans {LOG_DIR / LOG_FILES['trace']}"
+                  " (seuil: variable COURS_PRIVE_SLOW_MS)").pack(anchor="w", padx=6, pady=4)
+        cols = (("kind", "Type", 70), ("name", "Opération / requête", 420), ("calls", "Appels", 60), ("p50", "p50 ms", 70),
+                ("p95", "p95 ms", 70), ("max", "max ms", 70), ("total", "total ms", 80), ("rows", "lignes", 60))
+        tree = ttk.Treeview(w, columns=[c[0] for c in cols], show="headings", height=22)
+        for col, label, width in cols:
+            tree.heading(col, text=label); tree.column(col, width=width, anchor="w" if col == "name" else "e")
+        tree.pack(fill="both", expand=True, padx=6)
+        only_ops = tk.BooleanVar(value=False)
+        def reload():
+            tree.delete(*tree.get_children())
+            for kind, name, calls, p50, p95, top, total, rows in TRACE.stats():
+                if only_ops.get() and kind != "op": continue
+                tree.insert("", "end", values=("Opération" if kind == "op" else "SQL", name, calls, f"{p50:.1f}", f"{p95:.1f}",
+                                               f"{top:.1f}", f"{total:.0f}", "" if rows is None else f"{rows:.0f}"))
+        bar = ttk.Frame(w); bar.pack(fill="x", padx=6, pady=6)
+        ttk.Checkbutton(bar, text="Opérations seulement", variable=only_ops, command=reload).pack(side="left")
+        ttk.Button(bar, text="Rafraîchir", command=reload).pack(side="left", padx=4)
+        ttk.Button(bar, text="Remettre à zéro", command=lambda: (TRACE.reset(), reload())).pack(side="left", padx=4)
+        ttk.Button(bar, text="Ouvrir le dossier des journaux",
+                   command=lambda: (LOG_DIR.mkdir(exist_ok=True), os.startfile(str(LOG_DIR)))).pack(side="left", padx=4)
+        reload()
+
     # Reports / exports
     def export_students_csv(self):
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT code,last_name,first_name,classe,cycle,year,photo,phone FROM students")
-        rows = c.fetchall(); conn.close()
-        p = Path(__file__).parent / "students_export.csv"
-        with open(p, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["code","last_name","first_name","classe","cycle","year","photo","phone"])
-            w.writerows(rows)
-        messagebox.showinfo("Export", f"CSV créé: {p}")
+        self.export_table("students")
 
     def export_payments_csv(self):
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT student_id,date,amount,method,note FROM payments")
-        rows = c.fetchall(); conn.close()
-        p = Path(__file__).parent / "payments_export.csv"
-        with open(p, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["student_id","date","amount","method","note"])
-            w.writerows(rows)
-        messagebox.showinfo("Export", f"CSV créé: {p}")
+        self.export_table("payments")
+
+    def export_table(self, table):
+        incremental = self.export_incremental.get()
+        p = filedialog.asksaveasfilename(title="Exporter", initialdir=str(THIS_DIR), initialfile=f"{table}_export.csv",
+                                         defaultextension=".csv", filetypes=[("CSV","*.csv"),("CSV compressé","*.csv.gz")])
+        if not p: return
+        def done(count):
+            if count is None: self.status.config(text="Export annulé")
+            else: self.status.config(text=f"Export terminé: {count} lignes -> {p}")
+        self.start_job("Export", lambda progress, cancelled: export_csv(self.db, table, p, incremental, progress, cancelled), done)
+
+    def import_csv_window(self):
+        w = tk.Toplevel(self); w.title("Importer CSV")
+        labels = {label: table for table, label in IMPORT_TABLES.items()}
+        ttk.Label(w, text="Type de données").pack(padx=8, pady=(8,0))
+        kind = tk.StringVar(value=IMPORT_TABLES["students"])
+        ttk.Combobox(w, textvariable=kind, values=list(labels), state="readonly").pack(padx=8)
+        upsert = tk.BooleanVar(value=False); dry_run = tk.BooleanVar(value=True)
+        ttk.Checkbutton(w, text="Mettre à jour les élèves existants (même code)", variable=upsert).pack(anchor="w", padx=8)
+        ttk.Checkbutton(w, text="Simulation (rien n'est enregistré)", variable=dry_run).pack(anchor="w", padx=8)
+        def choose():
+            p = filedialog.askopenfilename(title="Fichier CSV", initialdir=str(THIS_DIR), filetypes=[("CSV","*.csv *.csv.gz"),("All","*.*")], parent=w)
+            if not p: return
+            table, up, dry = labels[kind.get()], upsert.get(), dry_run.get()
+            w.destroy()
+            def done(report):
+                if report is None: self.status.config(text="Import annulé"); return
+                self.status.config(text=report.summary().split("\n", 1)[0])
+                if not report.dry_run:
+                    self.view_cache.clear()
+                    if table == "students": self.load_students()
+                messagebox.showinfo("Import", report.summary())
+            self.start_job("Import", lambda progress, cancelled: import_csv(self.db, table, p, up, dry, progress, cancelled), done)
+        ttk.Button(w, text="Choisir le fichier et lancer", command=choose).pack(pady=8)
+
+    def clean_photos(self):
+        if not messagebox.askyesno("Photos", "Ranger les anciennes photos et supprimer celles qu'aucun élève n'utilise ?"): return
+        def done(result):
+            if result is None: self.status.config(text="Nettoyage annulé"); return
+            adopted, removed, freed = result
+            self.view_cache.clear(); self._thumbs.clear()
+            self.status.config(text="Photos nettoyées")
+            messagebox.showinfo("Photos", f"{adopted} photos rangées, {removed} fichiers supprimés ({freed / 1e6:.1f} Mo libérés)")
+        self.start_job("Nettoyage des photos", lambda progress, cancelled: photo_maintenance(self.db, progress, cancelled), done)
+
+    # Backups
+    def _scheduled_backup(self):
+        """Snapshot when the latest is older than BACKUP_INTERVAL minutes; checked
+        every few minutes and skipped while another job runs."""
+        self.after(BACKUP_CHECK_MS, self._scheduled_backup)
+        if not self._job and backup_due(): self.backup_now(auto=True)
+
+    def backup_now(self, auto=False, on_done=None):
+        def work(progress, cancelled):
+            try: result = backup_database(self.db, progress=progress, cancelled=cancelled)
+            except (OSError, sqlite3.Error) as e:
+                if not auto: raise
+                # no dialog for scheduled runs: logged, and retried at the next check
+                TRACE.error("sauvegarde automatique", e); return e
+            if result is not None: prune_backups()
+            return result
+        def done(result):
+            if result is None: self.status.config(text="Sauvegarde annulée"); return
+            if isinstance(result, Exception): self.status.config(text=f"Sauvegarde automatique échouée: {result}"); return
+            snapshot, new, copied = result
+            self.status.config(text=f"Sauvegarde {snapshot.name}{'' if new else ' (aucun changement)'}, {copied} photos copiées")
+            if on_done: on_done()
+        self.start_job("Sauvegarde", work, done)
+
+    def backups_window(self):
+        w = tk.Toplevel(self); w.title("Sauvegardes")
+        ttk.Label(w, text=f"Dossier: {BACKUP_DIR} (variable COURS_PRIVE_BACKUPS); sauvegarde automatique toutes les "
+                          f"{BACKUP_INTERVAL} min tant que l'application est ouverte").pack(anchor="w", padx=6, pady=4)
+        lb = tk.Listbox(w, width=80, height=14)
+        lb.pack(fill="both", expand=True, padx=6)
+        snaps = []
+        def reload():
+            if not w.winfo_exists(): return
+            snaps[:] = list_backups()
+            lb.delete(0, tk.END)
+            for path, when in snaps:
+                lb.insert(tk.END, f"{when:%d/%m/%Y %H:%M:%S} | {path.stat().st_size / 1e6:.1f} Mo | {path.name}")
+        def selected():
+            sel = lb.curselection()
+            if not sel: messagebox.showinfo("Sauvegardes", "Sélectionnez une sauvegarde", parent=w); return None
+            return snaps[sel[0]]
+        def verify():
+            snap = selected()
+            if snap is None: return
+            def done(problems):
+                if problems: messagebox.showerror("Vérification", "\n".join(problems[:10]), parent=w)
+                else: messagebox.showinfo("Vérification", f"{snap[0].name}: sauvegarde intacte", parent=w)
+            self.start_job("Vérification", lambda progress, cancelled: verify_backup(snap[0]), done)
+        def restore():
+            snap = selected()
+            if snap is None: return
+            if not messagebox.askyesno("Restaurer", f"Remplacer toutes les données par la sauvegarde du {snap[1]:%d/%m/%Y %H:%M} ?\n"
+                                       "L'état actuel est sauvegardé juste avant.", parent=w): return
+            def done(before):
+                self.view_cache.clear(); self._thumbs.clear(); self.load_students()
+                if self._tab_ready(self.tab_planning): self.load_week()
+                reload()
+                self.status.config(text=f"Sauvegarde du {snap[1]:%d/%m/%Y %H:%M} restaurée")
+                messagebox.showinfo("Restaurer", f"Données restaurées. L'état précédent est dans {before.name}", parent=w)
+            self.start_job("Restauration", lambda progress, cancelled: restore_backup(self.db, snap[0], progress), done)
+        bar = ttk.Frame(w); bar.pack(fill="x", padx=6, pady=6)
+        ttk.Button(bar, text="Sauvegarder maintenant", command=lambda: self.backup_now(on_done=reload)).pack(side="left")
+        ttk.Button(bar, text="Vérifier", command=verify).pack(side="left", padx=4)
+        ttk.Button(bar, text="Restaurer", command=restore).pack(side="left", padx=4)
+        ttk.Button(bar, text="Ouvrir le dossier",
+                   command=lambda: (BACKUP_DIR.mkdir(parents=True, exist_ok=True), os.startfile(str(BACKUP_DIR)))).pack(side="left", padx=4)
+        reload()
 
     def generate_report_html(self):
-        sel = self.lst.curselection()
-        if not sel: messagebox.showinfo("Info","Sélectionnez un élève"); return
-        sid = int(self.lst.get(sel[0]).split("|",1)[0])
-        conn = self.conn(); c = conn.cursor()
-        c.execute("SELECT code,last_name,first_name,classe,cycle,year,photo,phone FROM students WHERE id=?", (sid,)); s = c.fetchone()
-        c.execute("SELECT date,topic,duration,note FROM lessons WHERE student_id=? ORDER BY date DESC", (sid,)); lessons = c.fetchall()
-        conn.close()
-        html = f"<html><head><meta charset='utf-8'><title>Bulletin {s[2]} {s[1]}</title></head><body><h1>Bulletin - COURS PRIVÉ</h1><h2>{s[2]} {s[1]} ({s[0]})</h2><p>Classe: {s[3]} | Cycle: {s[4]} | Année: {s[5]}</p><p>Téléphone: {s[7] or ''}</p><h3>Leçons / Contrôles</h3><ul>"
-        for L in lessons:
-            html += f"<li>{L[0]} - {L[1]} - Durée {L[2]} - Note: {L[3] or ''}</li>"
-        html += "</ul></body></html>"
-        p = Path(__file__).parent / f"bulletin_{s[0]}.html"
-        with open(p, "w", encoding="utf-8") as f: f.write(html)
+        sid = self.selected_id()
+        if sid is None: messagebox.showinfo("Info","Sélectionnez un élève"); return
+        # read and rendered on the query thread, whose connection self.db.connection() gives there
+        work = lambda: next((render_bulletin(d) + (d,) for d in bulletin_data(self.db.connection(), student_id=sid)), None)
+        self.executor.submit("report_html", work, self._write_report_html)
+
+    def _write_report_html(self, result):
+        if result is None: return
+        code, body, data = result
+        p = THIS_DIR / bulletin_filename(code, data[0][-1])
+        p.write_text(BULLETIN_PAGE.substitute(title=_esc(f"Bulletin {data[0][2]} {data[0][1]}"), body=body), encoding="utf-8")
         messagebox.showinfo("Généré", f"Bulletin HTML: {p}")
+        import webbrowser
         webbrowser.open(p.as_uri())
 
+    def batch_bulletins_window(self):
+        w = tk.Toplevel(self); w.title("Bulletins par lot")
+        scopes = {label: col for col, label in BULLETIN_SCOPES.items()}
+        scope, value = tk.StringVar(value="Classe"), tk.StringVar()
+        ttk.Label(w, text="Générer pour").pack(padx=8, pady=(8,0))
+        ttk.Combobox(w, textvariable=scope, values=list(scopes), state="readonly").pack(padx=8)
+        values = ttk.Combobox(w, textvariable=value, state="readonly")
+        values.pack(padx=8, pady=4)
+        def fill_values(*a):
+            col = scopes[scope.get()]
+            value.set("")
+            self.executor.submit("scope_values", lambda: scope_values(self.db, col),
+                                 lambda rows: values.winfo_exists() and values.config(values=rows))
+        scope.trace_add("write", fill_values); fill_values()
+        combined = tk.BooleanVar(value=True)
+        ttk.Checkbutton(w, text="Fichier combiné imprimable", variable=combined).pack(anchor="w", padx=8)
+        def run():
+            if not value.get() and not values.cget("values"): return
+            out = filedialog.askdirectory(title="Dossier des bulletins", initialdir=str(THIS_DIR), parent=w)
+            if not out: return
+            col, val, comb = scopes[scope.get()], value.get(), combined.get()
+            w.destroy()
+            def done(count):
+                self.status.config(text="Bulletins annulés" if count is None else f"{count} bulletins générés dans {out}")
+            self.start_job("Bulletins", lambda progress, cancelled: write_bulletins(self.db, col, val, out, comb, progress, cancelled), done)
+        ttk.Button(w, text="Générer", command=run).pack(pady=8)
+
 if __name__ == '__main__':
-    init_db()
+    startup = StartupTimer()
+    startup.mark("modules")
+    db = Database(DB)
     root = tk.Tk()
-    app = App(root)
+    startup.mark("fenêtre")
+    app = App(root, db, startup)
+    def on_close():
+        app.executor.close(); root.destroy(); db.close(); TRACE.save_summary()
+    root.protocol("WM_DELETE_WINDOW", on_close)
     root.mainloop()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# COURS PRIVÉ - benchmark of the daily operations of cours_prive.py on
+# synthetic databases.
+#
+#   python benchmark.py                          # 1k and 10k students
+#   python benchmark.py --sizes 1000 10000 100000 --json bench.json
+#
+# Seeded databases are built once into bench_data/ (fixed random seed, so
+# every machine gets the same data) and each run works on a fresh copy, so
+# write operations never skew the next run. Per operation it reports the
+# median and p95 latency and the throughput.
+
+import os, sys, csv, json, time, random, shutil, sqlite3, datetime, tempfile, argparse, statistics
+from pathlib import Path
+
+import cours_prive as core
+
+BENCH_DIR = core.THIS_DIR / "bench_data"
+SEED = 20251115
+# per student: rows of realistic daily use over about three school years
+VOLUMES = {"lessons": 20, "grades": 10, "payments": 5, "messages": 8}
+CLASSES = {"CP": "Primaire", "CE1": "Primaire", "CE2": "Primaire", "CM1": "Primaire", "CM2": "Primaire",
+           "6e": "Collège", "5e": "Collège", "4e": "Collège", "3e": "Collège",
+           "2nde": "Lycée", "1ère": "Lycée", "Tle": "Lycée"}
+FIRST_NAMES = ("Ibrahim", "Mariam", "Abdoul", "Aïcha", "Moussa", "Fatima", "Harouna", "Safiatou", "Yacouba", "Hadiza",
+               "Oumar", "Zeinabou", "Issa", "Rakia", "Amadou", "Nana", "Souleymane", "Habi", "Seyni", "Ramatou")
+LAST_NAMES = ("Amadou", "Abdou", "Salifou", "Mahamadou", "Oumarou", "Issoufou", "Moussa", "Adamou", "Sabo", "Boubacar",
+              "Hamani", "Garba", "Idrissa", "Saidou", "Tahirou", "Yacouba", "Zakari", "Maïga", "Soumana", "Hassane")
+SUBJECTS = ("Maths", "Français", "Anglais", "Physique", "SVT", "Histoire-Géo")
+METHODS = ("espèces", "TRANSFERE", "carte")
+TEACHERS, ROOMS = 40, 15
+
+def seed_database(path, size, rng):
+    """Create a migrated database with `size` students and VOLUMES rows each."""
+    db = core.Database(path)
+    core.init_db(db)
+    start = datetime.date(2023, 9, 1)
+    day = lambda: (start + datetime.timedelta(days=rng.randrange(3 * 365))).isoformat()
+    classes = list(CLASSES)
+    with db.transaction() as c:
+        for cycle, amount in (("Primaire", 60000), ("Collège", 90000), ("Lycée", 120000)):
+            c.execute("INSERT INTO fee_schedules (scope, value, amount) VALUES ('cycle', ?, ?)", (cycle, amount))
+        c.executemany("INSERT INTO teachers (name) VALUES (?)", [(f"Enseignant {i}",) for i in range(TEACHERS)])
+        c.executemany("INSERT INTO rooms (name) VALUES (?)", [(f"Salle {i}",) for i in range(ROOMS)])
+    for first in range(0, size, 1000):
+        with db.transaction() as c:
+            ids = range(first + 1, min(first + 1000, size) + 1)
+            students = []
+            for i in ids:
+                classe = rng.choice(classes)
+                students.append((i, f"E{i:06d}", rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES), classe, CLASSES[classe],
+                                 "2025-2026", f"+227 9{rng.randrange(10**7):07d}"))
+            c.executemany("INSERT INTO students (id, code, last_name, first_name, classe, cycle, year, phone) VALUES (?,?,?,?,?,?,?,?)", students)
+            c.executemany("INSERT INTO lessons (student_id, date, topic, duration, note) VALUES (?,?,?,?,?)",
+                          [(i, day(), rng.choice(SUBJECTS), rng.choice((60, 90, 120)), "") for i in ids for _ in range(VOLUMES["lessons"])])
+            grades = []
+            for i in ids:
+                for _ in range(VOLUMES["grades"]):
+                    d = day(); grades.append((i, d, rng.choice(SUBJECTS), core.school_term(d), round(rng.uniform(4, 19), 1), rng.choice((1, 2, 3)), ""))
+            c.executemany("INSERT INTO grades (student_id, date, subject, term, value, coefficient, comment) VALUES (?,?,?,?,?,?,?)", grades)
+            c.executemany("INSERT INTO payments (student_id, date, amount, method, note) VALUES (?,?,?,?,?)",
+                          [(i, day(), rng.choice((10000, 15000, 20000, 30000)), rng.choice(METHODS), "") for i in ids for _ in range(VOLUMES["payments"])])
+            c.executemany("INSERT INTO messages (student_id, date, sender, content, read_flag) VALUES (?,?,?,?,?)",
+                          [(i, f"{day()} {rng.randrange(8, 19):02d}:{rng.randrange(60):02d}:00", "Prof", "Compte rendu de la séance",
+                            int(rng.random() < 0.8)) for i in ids for _ in range(VOLUMES["messages"])])
+            # a conflict-free timetable: student k+1 has teacher k % TEACHERS in hour
+            # k // (TEACHERS * 6) of weekday (k // TEACHERS) % 6; the first ROOMS teachers get a room
+            slots = []
+            for k in range(ids[0] - 1, min(ids[-1], TEACHERS * 6 * 12)):
+                teacher, start_min = k % TEACHERS, 480 + 60 * (k // (TEACHERS * 6))
+                slots.append((k + 1, teacher + 1, teacher + 1 if teacher < ROOMS else None, (k // TEACHERS) % 6, start_min, start_min + 60))
+            c.executemany("INSERT INTO schedule_slots (student_id, teacher_id, room_id, weekday, start_min, end_min, valid_from) "
+                          "VALUES (?,?,?,?,?,?,'2025-09-01')", slots)
+    db.connection().execute("ANALYZE")
+    db.close()
+
+def seeded_copy(size, work_dir):
+    """Path of a fresh copy of the seeded database of `size` students (built on first use)."""
+    BENCH_DIR.mkdir(exist_ok=True)
+    seed = BENCH_DIR / f"students_{size}.db"
+    if not seed.exists():
+        print(f"Création de la base de {size} élèves...", file=sys.stderr)
+        tmp = seed.with_suffix(".part")
+        if tmp.exists(): tmp.unlink()
+        t0 = time.perf_counter()
+        seed_database(tmp, size, random.Random(SEED + size))
+        os.replace(tmp, seed)
+        print(f"  faite en {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+    copy = Path(work_dir) / seed.name
+    shutil.copyfile(seed, copy)
+    return copy
+
+def operations(db, size, rng, work_dir):
+    """(name, callable, repeat factor): each callable performs one operation."""
+    ids = lambda: rng.randrange(1, size + 1)
+    middle = db.query_one("SELECT IFNULL(last_name,''), id FROM students ORDER BY IFNULL(last_name,''), id LIMIT 1 OFFSET ?", (size // 2,))
+    def older_messages():
+        sid = ids()
+        page = core.message_page(db, sid)
+        if page: core.message_page(db, sid, before=(page[-1][1], page[-1][0]))
+    lessons_csv = Path(work_dir) / "lessons.csv"
+    with open(lessons_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f); w.writerow(core.IMPORT_COLUMNS["lessons"])
+        w.writerows((ids(), "2026-01-15", "Maths", 60, "") for _ in range(1000))
+    bulletins_dir = Path(work_dir) / "bulletins"
+    return [
+        ("liste: première page", lambda: core.student_page(db, "last_name", limit=core.PAGE_SIZE + 1), 1),
+        ("liste: page au milieu", lambda: core.student_page(db, "last_name", after=middle, limit=core.PAGE_SIZE + 1), 1),
+        ("recherche", lambda: core.search_students(db, rng.choice(FIRST_NAMES)[:3], core.SEARCH_LIMIT), 1),
+        ("fiche élève", lambda: core.load_student_view(db, ids()), 1),
+        ("messages plus anciens", older_messages, 1),
+        ("ajout paiement", lambda: core.add_payment(db, ids(), "2026-01-10", 15000, "espèces"), 1),
+        ("ajout note", lambda: core.add_grade(db, ids(), "2026-01-10", "Maths", 12.5, 2), 1),
+        ("ajout message", lambda: core.send_message(db, ids(), "Prof", "Bonjour"), 1),
+        ("élèves en retard", lambda: core.overdue_students(db, 100), 1),
+        ("recettes mensuelles", lambda: core.revenue(db, "monthly"), 1),
+        ("paiements du mois", lambda: core.rows_in_period(db, "payments", "month", "2025-03-15"), 1),
+        ("planning de la semaine", lambda: core.week_schedule(db, "2026-01-12"), 1),
+        ("créneaux libres", lambda: core.find_free_slots(db, 60, teacher_id=rng.randrange(1, TEACHERS + 1), room_id=1), 1),
+        ("messages non lus", lambda: core.unread_messages(db), 1),
+        ("export élèves CSV", lambda: core.export_csv(db, "students", Path(work_dir) / "students.csv"), 0.2),
+        ("import 1000 leçons (test)", lambda: core.import_csv(db, "lessons", lessons_csv, dry_run=True), 0.2),
+        ("bulletins d'une classe", lambda: core.write_bulletins(db, "classe", rng.choice(list(CLASSES)), bulletins_dir), 0.1),
+    ]
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    times.sort()
+    return {"calls": repeat, "p50_ms": 1000 * statistics.median(times), "p95_ms": 1000 * times[min(len(times) - 1, int(0.95 * len(times)))],
+            "per_s": repeat / sum(times) if sum(times) else float("inf")}
+
+def run(size, repeat):
+    rng = random.Random(SEED)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = seeded_copy(size, work_dir)
+        db = None
+        def open_db():
+            nonlocal db
+            db = core.Database(path); core.init_db(db); core.student_page(db, limit=core.PAGE_SIZE + 1)
+        results = {"ouverture + première page": measure(open_db, 1)}
+        try:
+            for name, fn, factor in operations(db, size, rng, work_dir):
+                results[name] = measure(fn, max(1, round(repeat * factor)))
+        finally:
+            db.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark des opérations de cours_prive.py")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="nombres d'élèves (ex. 1000 10000 100000)")
+    parser.add_argument("--repeat", type=int, default=20, help="appels par opération")
+    parser.add_argument("--json", help="écrire aussi les résultats dans ce fichier")
+    args = parser.parse_args(argv)
+    report = {}
+    for size in args.sizes:
+        results = report[size] = run(size, args.repeat)
+        print(f"\n{size} élèves")
+        print(f"{'opération':32} {'appels':>6} {'p50 ms':>9} {'p95 ms':>9} {'par s':>9}")
+        for name, r in results.items():
+            print(f"{name:32} {r['calls']:6} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['per_s']:9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"sqlite": sqlite3.sqlite_version, "python": sys.version.split()[0], "results": report}, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1978 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# COURS PRIVÉ - headless core: database, migrations and every data operation
+# (students, search, lessons/grades, payments, messages, planning, exports,
+# imports, bulletins). The Tk application and the command line both call it.
+# Owner: DR.ALMOUSTAPHA MANOMI
+# Requires Python 3.
+
+# Modules only some operations need (csv, gzip, shutil, hashlib, logging, the
+# process pool, PIL) are imported inside them: the app starts many times a day.
+import sqlite3, os, re, io, sys, html, time, string, itertools, datetime, threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+THIS_DIR = Path(__file__).parent
+DB = THIS_DIR / "data.db"
+PHOTOS = THIS_DIR / "photos"
+PHOTOS.mkdir(exist_ok=True)
+THUMBS = PHOTOS / "thumbs"
+
+# SQLite tuning. WAL lets readers work while a write is in progress; set
+# COURS_PRIVE_JOURNAL=DELETE if data.db lives on a network share without
+# shared-memory support.
+JOURNAL_MODE = os.environ.get("COURS_PRIVE_JOURNAL", "WAL")
+PRAGMAS = (
+    ("synchronous", "NORMAL"),       # safe with WAL, far fewer fsyncs
+    ("cache_size", -16000),          # 16 MB page cache
+    ("mmap_size", 64 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "ON"),
+)
+# Tracing. Every statement run on a Database connection and every block
+# wrapped in TRACE.operation() is timed. Statements slower than SLOW_MS go to
+# logs/slow_queries.log (rotated) with their query plan; errors and startup
+# timings go to logs/app.log. The latest samples of each operation feed the
+# diagnostics window, and save_summary() appends the session's p50/p95 to
+# logs/operations.csv (moved to operations.old.csv past OPERATIONS_MAX_BYTES)
+# to compare over months.
+LOG_DIR = THIS_DIR / "logs"
+LOG_FILES = {"trace": "slow_queries.log", "app": "app.log"}
+OPERATIONS_MAX_BYTES = 1_000_000
+SLOW_MS = float(os.environ.get("COURS_PRIVE_SLOW_MS", 200))
+TRACE_SAMPLES = 500     # durations kept per operation
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+def _interrupted(exc):
+    """True for the error of a statement stopped by Connection.interrupt()."""
+    # sqlite_errorcode is there from Python 3.11; SQLITE_INTERRUPT is 9
+    return isinstance(exc, sqlite3.OperationalError) and getattr(exc, "sqlite_errorcode", None) == getattr(sqlite3, "SQLITE_INTERRUPT", 9)
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Tracer:
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self.last = None            # (operation, ms) of the last finished operation
+        self._samples = {}          # (kind, name) -> deque of (seconds, rows)
+        self._explained = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._logs = {}
+
+    def logger(self, name="trace"):
+        """Logger writing to LOG_FILES[name]: "trace" for slow statements, "app" for errors and startup."""
+        log = self._logs.get(name)
+        if log is not None: return log
+        import logging
+        from logging.handlers import RotatingFileHandler
+        # the Tk thread and the query thread may both get here first
+        with self._lock:
+            log = logging.getLogger(f"cours_prive.{name}")
+            if not log.handlers:
+                LOG_DIR.mkdir(exist_ok=True)
+                handler = RotatingFileHandler(LOG_DIR / LOG_FILES[name], maxBytes=1_000_000, backupCount=5, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+                log.addHandler(handler); log.setLevel(logging.INFO); log.propagate = False
+            self._logs[name] = log
+        return log
+
+    def record(self, kind, name, seconds, rows=None):
+        with self._lock:
+            samples = self._samples.get((kind, name))
+            if samples is None: samples = self._samples[(kind, name)] = deque(maxlen=TRACE_SAMPLES)
+            samples.append((seconds, rows))
+
+    def current(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else "-"
+
+    @contextmanager
+    def operation(self, name):
+        """Time a block as operation `name`; statements inside are logged under it."""
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            # an interrupted query was superseded on purpose (see QueryExecutor)
+            if not _interrupted(e): self.error(name, e)
+            raise
+        finally:
+            stack.pop()
+            seconds = time.perf_counter() - t0
+            self.record("op", name, seconds)
+            self.last = (name, 1000 * seconds)
+            if 1000 * seconds >= self.slow_ms:
+                self.logger().warning("slow operation %.1f ms: %s", 1000 * seconds, name)
+
+    def statement(self, conn, sql, params, seconds, rows):
+        text = " ".join(sql.split())
+        # one entry per statement shape, however many ids an IN (...) list has
+        key = re.sub(r"\((?:\?,\s*)+\?\)", "(?...)", text)[:300]
+        self.record("sql", key, seconds, rows)
+        if 1000 * seconds < self.slow_ms: return
+        plan = ""
+        if params is not None and key not in self._explained and text.split(" ", 1)[0].upper() in EXPLAINABLE:
+            self._explained.add(key)
+            try:
+                plan = " | ".join(r[3] for r in conn.cursor(sqlite3.Cursor).execute("EXPLAIN QUERY PLAN " + sql, params))
+            except sqlite3.Error as e:
+                plan = f"(plan indisponible: {e})"
+        self.logger().warning("slow query %.1f ms, %s rows, in %s: %s%s", 1000 * seconds, "?" if rows is None or rows < 0 else rows,
+                              self.current(), text[:2000], f"\n    plan: {plan}" if plan else "")
+
+    def error(self, name, exc):
+        self.logger("app").error("%s failed: %s: %s", name, type(exc).__name__, exc)
+
+    def stats(self):
+        """(kind, name, calls, p50 ms, p95 ms, max ms, total ms, mean rows) per operation, costliest first."""
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._samples.items()]
+        out = []
+        for (kind, name), samples in items:
+            times = sorted(s for s, _ in samples)
+            rows = [r for _, r in samples if r is not None and r >= 0]
+            out.append((kind, name, len(times), 1000 * _percentile(times, 0.5), 1000 * _percentile(times, 0.95),
+                        1000 * times[-1], 1000 * sum(times), sum(rows) / len(rows) if rows else None))
+        return sorted(out, key=lambda r: -r[6])
+
+    def reset(self):
+        with self._lock: self._samples.clear()
+
+    def save_summary(self, path=None):
+        """Append this session's operation latencies to logs/operations.csv, keeping one older file."""
+        ops = [r for r in self.stats() if r[0] == "op"]
+        if not ops: return
+        import csv
+        path = Path(path or LOG_DIR / "operations.csv")
+        path.parent.mkdir(exist_ok=True)
+        if path.exists() and path.stat().st_size > OPERATIONS_MAX_BYTES:
+            os.replace(path, path.with_suffix(".old" + path.suffix))
+        new = not path.exists()
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            if new: w.writerow(("date", "operation", "calls", "p50_ms", "p95_ms", "max_ms"))
+            today = datetime.date.today().isoformat()
+            w.writerows((today, name, calls, f"{p50:.1f}", f"{p95:.1f}", f"{top:.1f}") for _, name, calls, p50, p95, top, _, _ in ops)
+
+TRACE = Tracer()
+
+class _TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try: return super().execute(sql, params)
+        finally: TRACE.statement(self.connection, sql, params, time.perf_counter() - t0, self.rowcount)
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try: return super().executemany(sql, seq)
+        finally: TRACE.statement(self.connection, sql, None, time.perf_counter() - t0, self.rowcount)
+
+class _TracedConnection(sqlite3.Connection):
+    # Connection.execute does not go through cursor(), hence the overrides
+    def cursor(self, factory=_TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+BUSY_TIMEOUT = 5.0      # seconds to wait on a locked database
+STATEMENT_CACHE = 256   # prepared statements kept per connection
+
+class Database:
+    """Long-lived SQLite connections shared by the whole application.
+
+    Each thread gets one connection, opened on first use and kept until
+    close(); the Tk thread therefore reuses a single connection and its
+    prepared-statement cache. Writes go through transaction().
+    """
+
+    def __init__(self, path=DB, journal_mode=JOURNAL_MODE):
+        self.path = Path(path)
+        self.journal_mode = journal_mode
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+        # schema checks are cached against the version init_db() saw: the schema
+        # only changes through migrations
+        self.schema_version = None
+        self._tables = {}
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, factory=_TracedConnection,
+                                   cached_statements=STATEMENT_CACHE, check_same_thread=False)
+            try: self._configure(conn)
+            except sqlite3.Error:
+                conn.close(); raise
+            self._local.conn = conn; self._local.depth = 0
+            with self._lock: self._opened.append(conn)
+        return conn
+
+    def _configure(self, conn):
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor inside BEGIN IMMEDIATE ... COMMIT (rollback on error).
+
+        Nested calls join the outermost transaction.
+        """
+        conn = self.connection()
+        outer = self._local.depth == 0
+        if outer: conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield conn.cursor()
+            if outer: conn.execute("COMMIT")
+        except BaseException:
+            # a failed COMMIT (busy, deferred constraint) leaves the transaction
+            # open; without the rollback every later BEGIN on this thread fails
+            if outer and conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.depth -= 1
+
+    def query(self, sql, params=()):
+        return self._traced_fetch(sql, params, lambda cur: cur.fetchall())
+
+    def query_one(self, sql, params=()):
+        return self._traced_fetch(sql, params, lambda cur: cur.fetchone())
+
+    def _traced_fetch(self, sql, params, fetch):
+        # timed here rather than by the cursor, so the time includes fetching
+        cur = self.connection().cursor(sqlite3.Cursor)
+        t0 = time.perf_counter()
+        result = fetch(cur.execute(sql, params))
+        TRACE.statement(cur.connection, sql, params, time.perf_counter() - t0,
+                        len(result) if isinstance(result, list) else int(result is not None))
+        return result
+
+    @contextmanager
+    def snapshot(self):
+        """Yield the thread's connection inside a read transaction, so long
+        reads (exports) see one consistent state without blocking writers."""
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def release_thread(self):
+        """Close the calling thread's connection (end of a worker thread)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None: return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._opened: self._opened.remove(conn)
+        conn.close()
+
+    def has_table(self, name):
+        found = self._tables.get(name)
+        if found is None:
+            found = self._tables[name] = self.query_one("SELECT 1 FROM sqlite_master WHERE name=?", (name,)) is not None
+        return found
+
+    def execute(self, sql, params=()):
+        """Run a single write statement in its own transaction; returns lastrowid."""
+        with self.transaction() as c:
+            c.execute(sql, params)
+            return c.lastrowid
+
+    def close(self):
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for conn in opened:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+# Dates are stored as ISO text: 'YYYY-MM-DD' for lessons, payments and grades,
+# 'YYYY-MM-DD HH:MM:SS' for messages. Both sort chronologically as strings, so
+# a period is a half-open range [start, end) served by the date indexes.
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d", "%d/%m/%y")
+
+def normalize_date(value):
+    """Canonical 'YYYY-MM-DD' of a date typed in one of DATE_FORMATS (or an ISO timestamp)."""
+    text = str(value or "").strip()
+    for fmt in DATE_FORMATS:
+        try: return datetime.datetime.strptime(text[:10] if fmt == "%Y-%m-%d" else text, fmt).date().isoformat()
+        except ValueError: pass
+    raise ValueError(f"date invalide: '{text}' (AAAA-MM-JJ)")
+
+def normalize_timestamp(value):
+    """Canonical 'YYYY-MM-DD HH:MM:SS' of an ISO timestamp or a bare date."""
+    text = str(value or "").strip()
+    try: return datetime.datetime.fromisoformat(text).isoformat(" ", "seconds")
+    except ValueError: return normalize_date(text) + " 00:00:00"
+
+def now_timestamp():
+    return datetime.datetime.now().isoformat(" ", "seconds")
+
+def period_bounds(period, day=None):
+    """[start, end) of the 'day', 'week' (Monday first), 'month' or 'year' containing `day` (default today)."""
+    day = datetime.date.fromisoformat(normalize_date(day)) if day else datetime.date.today()
+    if period == "day":
+        start, end = day, day + datetime.timedelta(days=1)
+    elif period == "week":
+        start = day - datetime.timedelta(days=day.weekday()); end = start + datetime.timedelta(days=7)
+    elif period == "month":
+        start = day.replace(day=1); end = (start + datetime.timedelta(days=32)).replace(day=1)
+    elif period == "year":
+        start, end = day.replace(month=1, day=1), day.replace(year=day.year + 1, month=1, day=1)
+    else:
+        raise ValueError(f"période inconnue: {period}")
+    return start.isoformat(), end.isoformat()
+
+# Schema migrations. PRAGMA user_version records how many of MIGRATIONS have
+# been applied to a database file; init_db() runs the missing ones in order,
+# inside one transaction, so an interrupted upgrade leaves data.db untouched.
+# Never edit a released migration: append a new function instead.
+
+def _migrate_base_tables(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE,
+            last_name TEXT,
+            first_name TEXT,
+            classe TEXT,
+            cycle TEXT,
+            year TEXT,
+            photo TEXT,
+            notes TEXT,
+            phone TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS lessons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            date TEXT,
+            topic TEXT,
+            duration INTEGER,
+            note TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            date TEXT,
+            amount REAL,
+            method TEXT,
+            note TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            date TEXT,
+            sender TEXT,
+            content TEXT,
+            read_flag INTEGER DEFAULT 0
+        )
+    """)
+
+def _rebuild_with_student_fk(c, table, columns):
+    """Recreate `table` with a cascading foreign key on student_id.
+
+    SQLite cannot add a constraint to an existing table, so the rows are
+    copied into a new table; rows whose student no longer exists are dropped.
+    """
+    cols = ", ".join(name for name, _ in columns)
+    defs = ",\n            ".join(f"{name} {decl}" for name, decl in columns)
+    c.execute(f"""
+        CREATE TABLE {table}_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+            {defs}
+        )
+    """)
+    c.execute(f"INSERT INTO {table}_new (id, student_id, {cols}) SELECT id, student_id, {cols} FROM {table} "
+              "WHERE student_id IN (SELECT id FROM students)")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    c.execute(f"CREATE INDEX idx_{table}_student_date ON {table}(student_id, date)")
+
+def _migrate_foreign_keys(c):
+    _rebuild_with_student_fk(c, "lessons", [("date", "TEXT"), ("topic", "TEXT"), ("duration", "INTEGER"), ("note", "TEXT")])
+    _rebuild_with_student_fk(c, "payments", [("date", "TEXT"), ("amount", "REAL"), ("method", "TEXT"), ("note", "TEXT")])
+    _rebuild_with_student_fk(c, "messages", [("date", "TEXT"), ("sender", "TEXT"), ("content", "TEXT"), ("read_flag", "INTEGER DEFAULT 0")])
+
+def _migrate_student_search(c):
+    # External-content FTS5 index: the text lives only in students, the index
+    # is kept in sync by triggers. remove_diacritics folds "Élève" to "eleve".
+    try:
+        c.execute("""
+            CREATE VIRTUAL TABLE students_fts USING fts5(
+                code, last_name, first_name, classe, phone, notes,
+                content='students', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e): raise
+        return  # SQLite built without FTS5: search_students() falls back to LIKE
+    c.execute("""
+        CREATE TRIGGER students_fts_ai AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, code, last_name, first_name, classe, phone, notes)
+            VALUES (new.id, new.code, new.last_name, new.first_name, new.classe, new.phone, new.notes);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER students_fts_ad AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, code, last_name, first_name, classe, phone, notes)
+            VALUES ('delete', old.id, old.code, old.last_name, old.first_name, old.classe, old.phone, old.notes);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER students_fts_au AFTER UPDATE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, code, last_name, first_name, classe, phone, notes)
+            VALUES ('delete', old.id, old.code, old.last_name, old.first_name, old.classe, old.phone, old.notes);
+            INSERT INTO students_fts (rowid, code, last_name, first_name, classe, phone, notes)
+            VALUES (new.id, new.code, new.last_name, new.first_name, new.classe, new.phone, new.notes);
+        END
+    """)
+    c.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+def _migrate_student_sort_indexes(c):
+    # one index per sortable column of the student list (see SORT_KEYS)
+    for col in ("code", "last_name", "first_name", "classe"):
+        c.execute(f"CREATE INDEX idx_students_sort_{col} ON students(IFNULL({col},''))")
+
+def school_term(date):
+    """Trimestre of a YYYY-MM-DD date: T1 Sept-Dec, T2 Jan-Mar, T3 Apr-Aug."""
+    try: month = int(str(date)[5:7])
+    except ValueError: return None
+    return "T1" if month >= 9 else "T2" if month <= 3 else "T3"
+
+def _migrate_grades(c):
+    c.execute("""
+        CREATE TABLE grades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            date TEXT,
+            subject TEXT,
+            term TEXT,
+            value REAL NOT NULL CHECK (value BETWEEN 0 AND 20),
+            coefficient REAL NOT NULL DEFAULT 1 CHECK (coefficient > 0),
+            comment TEXT
+        )
+    """)
+    c.execute("CREATE INDEX idx_grades_student_date ON grades(student_id, date)")
+    # Running sums per student and per classe ('' for no classe), maintained by
+    # the triggers below: an average is weighted_sum / coef_sum.
+    c.execute("""
+        CREATE TABLE student_averages (
+            student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+            weighted_sum REAL NOT NULL DEFAULT 0,
+            coef_sum REAL NOT NULL DEFAULT 0,
+            grade_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE class_averages (
+            classe TEXT PRIMARY KEY,
+            weighted_sum REAL NOT NULL DEFAULT 0,
+            coef_sum REAL NOT NULL DEFAULT 0,
+            grade_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    add = """
+        INSERT INTO student_averages (student_id, weighted_sum, coef_sum, grade_count)
+        VALUES (new.student_id, new.value * new.coefficient, new.coefficient, 1)
+        ON CONFLICT(student_id) DO UPDATE SET weighted_sum = weighted_sum + excluded.weighted_sum,
+            coef_sum = coef_sum + excluded.coef_sum, grade_count = grade_count + 1;
+        INSERT INTO class_averages (classe, weighted_sum, coef_sum, grade_count)
+        VALUES ((SELECT IFNULL(classe,'') FROM students WHERE id = new.student_id), new.value * new.coefficient, new.coefficient, 1)
+        ON CONFLICT(classe) DO UPDATE SET weighted_sum = weighted_sum + excluded.weighted_sum,
+            coef_sum = coef_sum + excluded.coef_sum, grade_count = grade_count + 1;
+    """
+    remove = """
+        UPDATE student_averages SET weighted_sum = weighted_sum - old.value * old.coefficient,
+            coef_sum = coef_sum - old.coefficient, grade_count = grade_count - 1
+        WHERE student_id = old.student_id;
+        UPDATE class_averages SET weighted_sum = weighted_sum - old.value * old.coefficient,
+            coef_sum = coef_sum - old.coefficient, grade_count = grade_count - 1
+        WHERE classe = (SELECT IFNULL(classe,'') FROM students WHERE id = old.student_id);
+    """
+    c.execute(f"CREATE TRIGGER grades_avg_ai AFTER INSERT ON grades BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER grades_avg_ad AFTER DELETE ON grades BEGIN {remove} END")
+    c.execute(f"CREATE TRIGGER grades_avg_au AFTER UPDATE OF student_id, value, coefficient ON grades BEGIN {remove} {add} END")
+    # A deleted student's grades go away by cascade once the row is gone, so
+    # its share of the class sums is removed beforehand.
+    c.execute("""
+        CREATE TRIGGER students_avg_bd BEFORE DELETE ON students BEGIN
+            UPDATE class_averages SET
+                weighted_sum = weighted_sum - IFNULL((SELECT weighted_sum FROM student_averages WHERE student_id = old.id), 0),
+                coef_sum = coef_sum - IFNULL((SELECT coef_sum FROM student_averages WHERE student_id = old.id), 0),
+                grade_count = grade_count - IFNULL((SELECT grade_count FROM student_averages WHERE student_id = old.id), 0)
+            WHERE classe = IFNULL(old.classe,'');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER students_avg_au AFTER UPDATE OF classe ON students
+        WHEN IFNULL(old.classe,'') <> IFNULL(new.classe,'') BEGIN
+            UPDATE class_averages SET
+                weighted_sum = weighted_sum - IFNULL((SELECT weighted_sum FROM student_averages WHERE student_id = old.id), 0),
+                coef_sum = coef_sum - IFNULL((SELECT coef_sum FROM student_averages WHERE student_id = old.id), 0),
+                grade_count = grade_count - IFNULL((SELECT grade_count FROM student_averages WHERE student_id = old.id), 0)
+            WHERE classe = IFNULL(old.classe,'');
+            INSERT INTO class_averages (classe, weighted_sum, coef_sum, grade_count)
+            SELECT IFNULL(new.classe,''), weighted_sum, coef_sum, grade_count FROM student_averages WHERE student_id = new.id
+            ON CONFLICT(classe) DO UPDATE SET weighted_sum = weighted_sum + excluded.weighted_sum,
+                coef_sum = coef_sum + excluded.coef_sum, grade_count = grade_count + excluded.grade_count;
+        END
+    """)
+    # Grades used to be saved as lessons with duration 0 and note "<value> | <comment>"
+    moved = []
+    for lid, sid, date, topic, note in c.execute("SELECT id, student_id, date, topic, note FROM lessons WHERE duration=0 AND note LIKE '%|%'").fetchall():
+        value, _, comment = note.partition("|")
+        try: value = float(value)
+        except ValueError: continue
+        if 0 <= value <= 20:
+            moved.append((lid, sid, date, topic, school_term(date), value, comment.strip()))
+    c.executemany("INSERT INTO grades (student_id, date, subject, term, value, comment) VALUES (?,?,?,?,?,?)", [m[1:] for m in moved])
+    c.executemany("DELETE FROM lessons WHERE id=?", [(m[0],) for m in moved])
+
+CHANGE_TRACKED = ("students", "payments")
+
+def _migrate_change_tracking(c):
+    # Every insert/update of a tracked table bumps change_counter.seq and
+    # stamps the row's entry in row_versions with it; incremental exports take
+    # the rows stamped after their watermark. Writers are serialized by SQLite,
+    # so seq follows commit order.
+    c.execute("CREATE TABLE change_counter (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)")
+    c.execute("INSERT INTO change_counter VALUES (1, 1)")
+    c.execute("""
+        CREATE TABLE row_versions (
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (tbl, row_id)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX idx_row_versions_seq ON row_versions(tbl, seq)")
+    c.execute("CREATE TABLE export_watermarks (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)")
+    for table in CHANGE_TRACKED:
+        stamp = f"""
+            UPDATE change_counter SET seq = seq + 1 WHERE id = 1;
+            INSERT INTO row_versions (tbl, row_id, seq) VALUES ('{table}', new.id, (SELECT seq FROM change_counter WHERE id = 1))
+            ON CONFLICT(tbl, row_id) DO UPDATE SET seq = excluded.seq;
+        """
+        c.execute(f"CREATE TRIGGER {table}_version_ai AFTER INSERT ON {table} BEGIN {stamp} END")
+        c.execute(f"CREATE TRIGGER {table}_version_au AFTER UPDATE ON {table} BEGIN {stamp} END")
+        c.execute(f"CREATE TRIGGER {table}_version_ad AFTER DELETE ON {table} BEGIN "
+                  f"DELETE FROM row_versions WHERE tbl = '{table}' AND row_id = old.id; END")
+        c.execute(f"INSERT INTO row_versions (tbl, row_id, seq) SELECT '{table}', id, 1 FROM {table}")
+
+# Fee owed by the student aliased `s`: its classe's fee, else its cycle's, else 0
+FEE_DUE_SQL = ("COALESCE((SELECT amount FROM fee_schedules WHERE scope='classe' AND value=IFNULL(s.classe,'')), "
+               "(SELECT amount FROM fee_schedules WHERE scope='cycle' AND value=IFNULL(s.cycle,'')), 0)")
+
+def _revenue_sql(row, sign):
+    # trigger statements adding (sign "") or removing (sign "-") payment `row` from the revenue rollups
+    return "".join(f"""
+        INSERT INTO revenue_{period} (period, method, total, count)
+        VALUES (substr(IFNULL({row}.date,''), 1, {length}), IFNULL({row}.method,''), {sign}{row}.amount, {sign}1)
+        ON CONFLICT(period, method) DO UPDATE SET total = total + excluded.total, count = count + excluded.count;
+    """ for period, length in (("daily", 10), ("monthly", 7)))
+
+def _migrate_ledger(c):
+    c.execute("""
+        CREATE TABLE fee_schedules (
+            scope TEXT NOT NULL CHECK (scope IN ('classe', 'cycle')),
+            value TEXT NOT NULL,
+            amount REAL NOT NULL CHECK (amount >= 0),
+            PRIMARY KEY (scope, value)
+        )
+    """)
+    c.execute("CREATE INDEX idx_students_cycle ON students(IFNULL(cycle,''))")
+    # Summary tables, all maintained by the triggers below
+    c.execute("""
+        CREATE TABLE student_balances (
+            student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+            fees_due REAL NOT NULL DEFAULT 0,
+            paid REAL NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("CREATE INDEX idx_student_balances_owed ON student_balances(fees_due - paid)")
+    for period, length in (("daily", 10), ("monthly", 7)):
+        c.execute(f"""
+            CREATE TABLE revenue_{period} (
+                period TEXT NOT NULL,
+                method TEXT NOT NULL,
+                total REAL NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, method)
+            ) WITHOUT ROWID
+        """)
+    add = f"""
+        INSERT INTO student_balances (student_id, paid) VALUES (new.student_id, new.amount)
+        ON CONFLICT(student_id) DO UPDATE SET paid = paid + excluded.paid;
+        {_revenue_sql("new", "")}
+    """
+    remove = f"""
+        UPDATE student_balances SET paid = paid - old.amount WHERE student_id = old.student_id;
+        {_revenue_sql("old", "-")}
+    """
+    c.execute(f"CREATE TRIGGER payments_ledger_ai AFTER INSERT ON payments BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER payments_ledger_ad AFTER DELETE ON payments BEGIN {remove} END")
+    c.execute(f"CREATE TRIGGER payments_ledger_au AFTER UPDATE OF student_id, date, amount, method ON payments BEGIN {remove} {add} END")
+    c.execute(f"""
+        CREATE TRIGGER students_ledger_ai AFTER INSERT ON students BEGIN
+            INSERT INTO student_balances (student_id, fees_due) SELECT s.id, {FEE_DUE_SQL} FROM students s WHERE s.id = new.id
+            ON CONFLICT(student_id) DO UPDATE SET fees_due = excluded.fees_due;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER students_ledger_au AFTER UPDATE OF classe, cycle ON students BEGIN
+            UPDATE student_balances SET fees_due = (SELECT {FEE_DUE_SQL} FROM students s WHERE s.id = new.id)
+            WHERE student_id = new.id;
+        END
+    """)
+    # a fee change re-prices only the students of that classe / cycle
+    for scope in ("classe", "cycle"):
+        reprice = lambda row: f"""
+            UPDATE student_balances SET fees_due = (SELECT {FEE_DUE_SQL} FROM students s WHERE s.id = student_balances.student_id)
+            WHERE student_id IN (SELECT id FROM students WHERE IFNULL({scope},'') = {row}.value);
+        """
+        c.execute(f"CREATE TRIGGER fees_{scope}_ai AFTER INSERT ON fee_schedules WHEN new.scope = '{scope}' BEGIN {reprice('new')} END")
+        c.execute(f"CREATE TRIGGER fees_{scope}_au AFTER UPDATE ON fee_schedules WHEN new.scope = '{scope}' BEGIN {reprice('old')} {reprice('new')} END")
+        c.execute(f"CREATE TRIGGER fees_{scope}_ad AFTER DELETE ON fee_schedules WHEN old.scope = '{scope}' BEGIN {reprice('old')} END")
+    c.execute(f"INSERT INTO student_balances (student_id, fees_due, paid) SELECT s.id, {FEE_DUE_SQL}, "
+              "IFNULL((SELECT SUM(amount) FROM payments WHERE student_id = s.id), 0) FROM students s")
+    for period, length in (("daily", 10), ("monthly", 7)):
+        c.execute(f"INSERT INTO revenue_{period} (period, method, total, count) SELECT substr(IFNULL(date,''), 1, {length}), "
+                  "IFNULL(method,''), SUM(amount), COUNT(*) FROM payments GROUP BY 1, 2")
+
+# table -> SQL function giving the canonical form of its date column
+DATED_TABLES = {"lessons": "date", "payments": "date", "grades": "date", "messages": "datetime"}
+
+def _migrate_dates(c):
+    normalize = {"date": normalize_date, "datetime": normalize_timestamp}
+    for table, kind in DATED_TABLES.items():
+        changed = []
+        for rid, value in c.execute(f"SELECT id, date FROM {table} WHERE date IS NOT NULL").fetchall():
+            try: canonical = normalize[kind](value)
+            except ValueError: continue     # unreadable: kept as typed, never matches a range
+            if canonical != value: changed.append((canonical, rid))
+        # payment updates re-file their amounts in the revenue rollups by trigger
+        c.executemany(f"UPDATE {table} SET date=? WHERE id=?", changed)
+        c.execute(f"CREATE INDEX idx_{table}_date ON {table}(date)")
+        # reject non-canonical dates from now on; NULL stays allowed. The
+        # '+0 days' modifier makes SQLite roll impossible days (02-30) over.
+        for event in ("INSERT", "UPDATE OF date"):
+            c.execute(f"""
+                CREATE TRIGGER {table}_date_{event.split()[0].lower()} BEFORE {event} ON {table}
+                WHEN new.date IS NOT NULL AND new.date IS NOT {kind}(new.date, '+0 days') BEGIN
+                    SELECT RAISE(ABORT, 'date invalide (AAAA-MM-JJ)');
+                END
+            """)
+    for period in ("daily", "monthly"):
+        c.execute(f"DELETE FROM revenue_{period} WHERE count = 0")
+
+def _migrate_schedule(c):
+    for table in ("teachers", "rooms"):
+        c.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE COLLATE NOCASE)")
+    # A weekly recurring slot: every `weekday` (0 = Monday) from start_min to
+    # end_min (minutes since midnight), for dates in [valid_from, valid_until).
+    c.execute("""
+        CREATE TABLE schedule_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            teacher_id INTEGER REFERENCES teachers(id) ON DELETE CASCADE,
+            room_id INTEGER REFERENCES rooms(id) ON DELETE SET NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_min INTEGER NOT NULL CHECK (start_min >= 0),
+            end_min INTEGER NOT NULL CHECK (end_min > start_min AND end_min <= 1440),
+            valid_from TEXT NOT NULL,
+            valid_until TEXT,
+            topic TEXT
+        )
+    """)
+    # Interval indexes: an overlap probe seeks (resource, weekday) and then
+    # ranges over start_min < end, so it only visits that day's slots.
+    for col in ("student_id", "teacher_id", "room_id"):
+        c.execute(f"CREATE INDEX idx_schedule_{col} ON schedule_slots({col}, weekday, start_min, end_min)")
+    c.execute("CREATE INDEX idx_schedule_week ON schedule_slots(weekday, start_min)")
+
+def _migrate_inbox(c):
+    c.execute("UPDATE messages SET read_flag = 0 WHERE read_flag IS NULL")
+    # unread messages per student, for the list badges
+    c.execute("""
+        CREATE TABLE unread_counts (
+            student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+            unread INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    add = """
+        INSERT INTO unread_counts (student_id, unread) SELECT new.student_id, 1 WHERE new.read_flag = 0
+        ON CONFLICT(student_id) DO UPDATE SET unread = unread + 1;
+    """
+    remove = "UPDATE unread_counts SET unread = unread - 1 WHERE student_id = old.student_id AND old.read_flag = 0;"
+    c.execute(f"CREATE TRIGGER messages_unread_ai AFTER INSERT ON messages BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER messages_unread_ad AFTER DELETE ON messages BEGIN {remove} END")
+    c.execute(f"CREATE TRIGGER messages_unread_au AFTER UPDATE OF student_id, read_flag ON messages BEGIN {remove} {add} END")
+    c.execute("INSERT INTO unread_counts (student_id, unread) SELECT student_id, COUNT(*) FROM messages WHERE read_flag = 0 GROUP BY student_id")
+    # the unread items only, newest first: stays small however long the history grows
+    c.execute("CREATE INDEX idx_messages_unread ON messages(date) WHERE read_flag = 0")
+
+# First calendar year of the school year in students.year ('2025', '2025-2026',
+# '2025/2026'), or NULL when it cannot be read; a school year runs from
+# 1 September to 31 August.
+SCHOOL_YEAR_SQL = "(CASE WHEN s.year GLOB '[0-9][0-9][0-9][0-9]*' THEN CAST(substr(s.year, 1, 4) AS INTEGER) END)"
+
+def _in_school_year(row):
+    # payment `row` falls in the school year of the student aliased `s` (any date if that year is unknown)
+    return (f"({SCHOOL_YEAR_SQL} IS NULL OR ({row}.date >= {SCHOOL_YEAR_SQL} || '-09-01' "
+            f"AND {row}.date < ({SCHOOL_YEAR_SQL} + 1) || '-09-01'))")
+
+# Paid by the student aliased `s` in its school year, served by idx_payments_student_date
+PAID_SQL = f"IFNULL((SELECT SUM(p.amount) FROM payments p WHERE p.student_id = s.id AND {_in_school_year('p')}), 0)"
+
+def _migrate_ledger_school_year(c):
+    # The fee is per school year, so student_balances.paid now only counts the
+    # payments of the student's school year (students.year); before, last
+    # year's payments also counted toward this year's fee.
+    for event in ("ai", "ad", "au"):
+        c.execute(f"DROP TRIGGER payments_ledger_{event}")
+    add = f"""
+        INSERT INTO student_balances (student_id, paid) SELECT new.student_id, new.amount FROM students s
+        WHERE s.id = new.student_id AND {_in_school_year('new')}
+        ON CONFLICT(student_id) DO UPDATE SET paid = paid + excluded.paid;
+        {_revenue_sql("new", "")}
+    """
+    remove = f"""
+        UPDATE student_balances SET paid = paid - old.amount WHERE student_id = old.student_id
+        AND EXISTS (SELECT 1 FROM students s WHERE s.id = old.student_id AND {_in_school_year('old')});
+        {_revenue_sql("old", "-")}
+    """
+    c.execute(f"CREATE TRIGGER payments_ledger_ai AFTER INSERT ON payments BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER payments_ledger_ad AFTER DELETE ON payments BEGIN {remove} END")
+    c.execute(f"CREATE TRIGGER payments_ledger_au AFTER UPDATE OF student_id, date, amount, method ON payments BEGIN {remove} {add} END")
+    # re-enrolment for a new school year starts from nothing paid
+    c.execute(f"""
+        CREATE TRIGGER students_ledger_year_au AFTER UPDATE OF year ON students BEGIN
+            UPDATE student_balances SET paid = (SELECT {PAID_SQL} FROM students s WHERE s.id = new.id) WHERE student_id = new.id;
+        END
+    """)
+    c.execute(f"UPDATE student_balances SET paid = (SELECT {PAID_SQL} FROM students s WHERE s.id = student_balances.student_id)")
+
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_foreign_keys,
+    _migrate_student_search,
+    _migrate_student_sort_indexes,
+    _migrate_grades,
+    _migrate_change_tracking,
+    _migrate_ledger,
+    _migrate_dates,
+    _migrate_schedule,
+    _migrate_inbox,
+    _migrate_ledger_school_year,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def init_db(db):
+    if db.schema_version == SCHEMA_VERSION: return
+    conn = db.connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    db._tables.clear()
+    if version >= SCHEMA_VERSION:
+        db.schema_version = version
+        return
+    # Table rebuilds must run with enforcement off (it cannot be toggled
+    # inside a transaction); integrity is checked before committing instead.
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        with db.transaction() as c:
+            for number, migrate in enumerate(MIGRATIONS[version:], version + 1):
+                migrate(c)
+                c.execute(f"PRAGMA user_version={number}")
+            broken = c.execute("PRAGMA foreign_key_check").fetchall()
+            if broken:
+                raise sqlite3.IntegrityError(f"Migration: références invalides {broken[:5]}")
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    db.schema_version = SCHEMA_VERSION
+
+# Student search
+SEARCH_DELAY_MS = 250   # debounce between the last keystroke and the query
+# bm25 column weights, in students_fts column order
+SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 1.0, 2.0, 1.0)
+
+def fts_query(text):
+    """Turn free text into an FTS5 query where every word is a prefix:
+    'ele dup' -> '"ele"* "dup"*' (all words must match)."""
+    return " ".join(f'"{w}"*' for w in re.findall(r"\w+", text))
+
+def search_students(db, text, limit=-1):
+    """Return (id, code, last_name, first_name, classe, unread) rows matching `text`, best first."""
+    match = fts_query(text)
+    if match and db.has_table("students_fts"):
+        weights = ", ".join(map(str, SEARCH_WEIGHTS))
+        return db.query(f"SELECT s.id, s.code, s.last_name, s.first_name, s.classe, {UNREAD_SQL} FROM students_fts "
+                        f"JOIN students s ON s.id = students_fts.rowid WHERE students_fts MATCH ? "
+                        f"ORDER BY bm25(students_fts, {weights}) LIMIT ?", (match, limit))
+    like = f"%{text}%"
+    return db.query(f"SELECT id, code, last_name, first_name, classe, {UNREAD_SQL} FROM students s "
+                    "WHERE code LIKE ? OR last_name LIKE ? OR first_name LIKE ? ORDER BY id LIMIT ?", (like, like, like, limit))
+
+# Student list. The Treeview only ever holds MAX_PAGES pages of PAGE_SIZE rows;
+# pages are fetched by keyset pagination as the user scrolls and the page at
+# the opposite end is dropped, so memory and redraw cost do not depend on the
+# number of students.
+PAGE_SIZE = 100
+MAX_PAGES = 3
+SEARCH_LIMIT = 200      # ranked search results shown at once
+STUDENT_COLUMNS = (("code", "Code", 60), ("last_name", "Nom", 110), ("first_name", "Prénom", 110), ("classe", "Classe", 60),
+                   ("unread", "Msg", 40))
+# unread message count of the student aliased `s` (last column of list rows)
+UNREAD_SQL = "IFNULL((SELECT unread FROM unread_counts WHERE student_id = s.id), 0)"
+# ORDER BY expression per sortable column; IFNULL keeps NULLs comparable so a
+# keyset bound never skips them (matching indexes: _migrate_student_sort_indexes)
+SORT_KEYS = {"id": "id", "code": "IFNULL(code,'')", "last_name": "IFNULL(last_name,'')",
+             "first_name": "IFNULL(first_name,'')", "classe": "IFNULL(classe,'')"}
+
+def student_page(db, sort="id", descending=False, after=None, before=None, limit=PAGE_SIZE):
+    """Return one page of (id, code, last_name, first_name, classe, sort value, unread) rows in display order.
+
+    `after` / `before` is the (sort value, id) key of the row the page follows /
+    precedes. Each page is an index seek, so page 1000 costs the same as page 1.
+    """
+    expr = SORT_KEYS[sort]
+    backward = before is not None
+    reverse = backward != descending
+    direction, op = ("DESC", "<") if reverse else ("ASC", ">")
+    sql = f"SELECT id, code, last_name, first_name, classe, {expr}, {UNREAD_SQL} FROM students s"
+    bound = before if backward else after
+    params = ()
+    if bound is not None:
+        if expr == "id":
+            sql += f" WHERE id {op} ?"; params = (bound[1],)
+        else:
+            # the plain range on the leading term is what lets SQLite seek the index
+            sql += f" WHERE {expr} {op}= ? AND ({expr}, id) {op} (?, ?)"; params = (bound[0], bound[0], bound[1])
+    sql += f" ORDER BY {expr} {direction}" + ("" if expr == "id" else f", id {direction}") + " LIMIT ?"
+    rows = db.query(sql, params + (limit,))
+    if backward: rows.reverse()
+    return rows
+
+def student_average(db, student_id):
+    """Return (average, grade count, rank in classe, classe size, classe average) from the summary tables.
+
+    Averages are None when there are no grades; rank and size only count
+    students of the classe that have grades.
+    """
+    r = db.query_one("SELECT IFNULL(s.classe,''), sa.weighted_sum / NULLIF(sa.coef_sum, 0), IFNULL(sa.grade_count, 0), "
+                     "ca.weighted_sum / NULLIF(ca.coef_sum, 0) FROM students s "
+                     "LEFT JOIN student_averages sa ON sa.student_id = s.id "
+                     "LEFT JOIN class_averages ca ON ca.classe = IFNULL(s.classe,'') WHERE s.id=?", (student_id,))
+    if r is None or r[1] is None:
+        return None, 0, None, None, r and r[3]
+    rank, size = db.query_one("SELECT 1 + IFNULL(SUM(sa.weighted_sum / sa.coef_sum > ?), 0), COUNT(*) FROM students s "
+                              "JOIN student_averages sa ON sa.student_id = s.id "
+                              "WHERE IFNULL(s.classe,'') = ? AND sa.coef_sum > 0", (r[1], r[0]))
+    return r[1], r[2], rank, size, r[3]
+
+def class_ranking(db, classe):
+    """(rank, id, code, last_name, first_name, average) for every graded student of `classe`, best first."""
+    return db.query("SELECT RANK() OVER (ORDER BY sa.weighted_sum / sa.coef_sum DESC), s.id, s.code, s.last_name, s.first_name, "
+                    "sa.weighted_sum / sa.coef_sum FROM students s JOIN student_averages sa ON sa.student_id = s.id "
+                    "WHERE IFNULL(s.classe,'') = ? AND sa.coef_sum > 0 ORDER BY 1, s.last_name", (classe or "",))
+
+# CSV exports
+EXPORT_BATCH = 500      # rows fetched and written per step
+EXPORT_COLUMNS = {
+    "students": ("code", "last_name", "first_name", "classe", "cycle", "year", "photo", "phone"),
+    "payments": ("student_id", "date", "amount", "method", "note"),
+}
+
+def export_csv(db, table, path, incremental=False, progress=None, cancelled=None):
+    """Stream `table` to a CSV file at `path`, gzip-compressed when it ends in .gz.
+
+    Rows are read from one snapshot in EXPORT_BATCH chunks, so memory stays
+    bounded. With `incremental`, only rows inserted or changed since the last
+    incremental export of `table` are written and the watermark is advanced.
+    progress(done, total) is called after each chunk; when cancelled() returns
+    True the export stops and nothing is written. Returns the row count, or
+    None if cancelled.
+    """
+    import csv, gzip
+    cols = EXPORT_COLUMNS[table]
+    select = ", ".join(f"t.{c}" for c in cols)
+    part = Path(f"{path}.part")
+    opener = gzip.open if str(path).endswith(".gz") else open
+    done, stopped = 0, False
+    with db.snapshot() as conn:
+        high = conn.execute("SELECT seq FROM change_counter WHERE id = 1").fetchone()[0]
+        if incremental:
+            low = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM export_watermarks WHERE name=?", (table,)).fetchone()[0]
+            source = f"FROM row_versions v JOIN {table} t ON t.id = v.row_id WHERE v.tbl = ? AND v.seq > ? AND v.seq <= ?"
+            params, order = (table, low, high), "v.seq"
+        else:
+            source, params, order = f"FROM {table} t", (), "t.id"
+        total = conn.execute(f"SELECT COUNT(*) {source}", params).fetchone()[0]
+        cur = conn.execute(f"SELECT {select} {source} ORDER BY {order}", params)
+        with opener(part, "wt", newline="", encoding="utf-8") as f:
+            w = csv.writer(f); w.writerow(cols)
+            while True:
+                if cancelled and cancelled():
+                    stopped = True; break
+                rows = cur.fetchmany(EXPORT_BATCH)
+                if not rows: break
+                w.writerows(rows); done += len(rows)
+                if progress: progress(done, total)
+        cur.close()
+    if stopped:
+        part.unlink(missing_ok=True); return None
+    os.replace(part, path)
+    if incremental:
+        db.execute("INSERT INTO export_watermarks (name, seq) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET seq = excluded.seq", (table, high))
+    return done
+
+# CSV imports: same layouts as the exports. Payments and lessons name their
+# student by student_id or, across databases, by student_code.
+IMPORT_BATCH = 500      # rows per executemany (stays under SQLite's 999 variables)
+MAX_REPORTED_ERRORS = 50
+IMPORT_TABLES = {"students": "élèves", "payments": "paiements", "lessons": "leçons"}
+
+class ImportReport:
+    def __init__(self, table, dry_run):
+        self.table, self.dry_run = table, dry_run
+        self.inserted = self.updated = self.rejected = 0
+        self.errors = []    # (line, message); only the first MAX_REPORTED_ERRORS
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS: self.errors.append((line, message))
+
+    def summary(self):
+        head = "Simulation" if self.dry_run else "Import"
+        txt = f"{head} {IMPORT_TABLES[self.table]}: {self.inserted} ajoutés, {self.updated} mis à jour, {self.rejected} rejetés"
+        for line, message in sorted(self.errors):
+            txt += f"\nligne {line}: {message}"
+        if self.rejected > len(self.errors): txt += "\n..."
+        return txt
+
+class _ImportCancelled(Exception):
+    pass
+
+def _text(rec, col):
+    return (rec.get(col) or "").strip()
+
+def _number(value, label, kind=float):
+    value = (value or "").strip().replace(",", ".")
+    try: return kind(value)
+    except ValueError: raise ValueError(f"{label} non numérique: '{value}'") from None
+
+def _import_students(c, batch, report, upsert, dry_run, seen):
+    cols = IMPORT_COLUMNS["students"]
+    # columns the file has; the others are NULL for new students and left alone by upsert
+    present = [col for col in cols if col in batch[0][1]]
+    rows = []
+    for line, rec in batch:
+        row = tuple(_text(rec, col) if col in present else None for col in cols)
+        if not row[0]:
+            report.reject(line, "code requis"); continue
+        if row[0] in seen:
+            report.reject(line, f"code {row[0]} en double dans le fichier"); continue
+        seen.add(row[0]); rows.append((line, row))
+    if not rows: return
+    existing = {r[0] for r in c.execute(f"SELECT code FROM students WHERE code IN ({','.join('?' * len(rows))})", [r[0] for _, r in rows])}
+    new, updates = [], []
+    for line, row in rows:
+        if row[0] in existing:
+            if upsert: updates.append(row)
+            else: report.reject(line, f"code {row[0]} existe déjà")
+        elif not row[2]: report.reject(line, "prénom requis pour un nouvel élève")
+        else: new.append(row)
+    changed = [col for col in present if col != "code"]
+    if not dry_run:
+        c.executemany(f"INSERT INTO students ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", new)
+        if changed and updates:
+            idx = [cols.index(col) for col in changed]
+            c.executemany(f"UPDATE students SET {', '.join(f'{col}=?' for col in changed)} WHERE code=?",
+                          [tuple(row[k] for k in idx) + (row[0],) for row in updates])
+    report.inserted += len(new); report.updated += len(updates)
+
+def _resolve_students(c, rows):
+    """Map each row's ("id", n) / ("code", s) reference to an existing student id (None if unknown)."""
+    ids = {ref for kind, ref in (r[1] for r in rows) if kind == "id"}
+    codes = {ref for kind, ref in (r[1] for r in rows) if kind == "code"}
+    found = {}
+    if ids:
+        found.update((("id", r[0]), r[0]) for r in c.execute(f"SELECT id FROM students WHERE id IN ({','.join('?' * len(ids))})", list(ids)))
+    if codes:
+        found.update((("code", r[0]), r[1]) for r in c.execute(f"SELECT code, id FROM students WHERE code IN ({','.join('?' * len(codes))})", list(codes)))
+    return found
+
+def _import_student_rows(table, parse):
+    """Build the batch importer of a table whose rows belong to a student."""
+    cols = IMPORT_COLUMNS[table][1:]
+    sql = f"INSERT INTO {table} (student_id, {', '.join(cols)}) VALUES (?, {', '.join('?' * len(cols))})"
+    def load(c, batch, report, upsert, dry_run, seen):
+        rows = []
+        for line, rec in batch:
+            try:
+                sid, code = _text(rec, "student_id"), _text(rec, "student_code")
+                if sid: ref = ("id", _number(sid, "student_id", int))
+                elif code: ref = ("code", code)
+                else: raise ValueError("élève manquant (student_id ou student_code)")
+                rows.append((line, ref, parse(rec)))
+            except ValueError as e:
+                report.reject(line, str(e))
+        found = _resolve_students(c, rows) if rows else {}
+        values = []
+        for line, ref, row in rows:
+            if ref in found: values.append((found[ref],) + row)
+            else: report.reject(line, f"élève inconnu: {ref[1]}")
+        if not dry_run: c.executemany(sql, values)
+        report.inserted += len(values)
+    return load
+
+IMPORT_COLUMNS = {
+    "students": EXPORT_COLUMNS["students"],
+    "payments": EXPORT_COLUMNS["payments"],
+    "lessons": ("student_id", "date", "topic", "duration", "note"),
+}
+_IMPORTERS = {
+    "students": _import_students,
+    "payments": _import_student_rows("payments", lambda rec: (
+        normalize_date(rec.get("date")), _number(rec.get("amount"), "montant"), _text(rec, "method"), _text(rec, "note"))),
+    "lessons": _import_student_rows("lessons", lambda rec: (
+        normalize_date(rec.get("date")), _text(rec, "topic"),
+        _number(rec.get("duration"), "durée", int) if _text(rec, "duration") else 0, _text(rec, "note"))),
+}
+
+def import_csv(db, table, path, upsert=False, dry_run=False, progress=None, cancelled=None):
+    """Load a CSV (or .csv.gz) file into `table` and return an ImportReport.
+
+    The file is streamed and validated row by row; valid rows are inserted
+    with executemany in batches of IMPORT_BATCH, all in one transaction, and
+    invalid rows are reported and skipped. `upsert` (students only) updates
+    students whose code already exists instead of rejecting them. `dry_run`
+    validates against the database without writing anything. Returns None if
+    cancelled() became True, in which case nothing is written either.
+    """
+    import csv, gzip
+    size = max(os.path.getsize(path), 1)
+    report, seen, load = ImportReport(table, dry_run), set(), _IMPORTERS[table]
+    with open(path, "rb") as raw:
+        stream = gzip.GzipFile(fileobj=raw) if str(path).endswith(".gz") else raw
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        header = set(reader.fieldnames or ())
+        required = {"code"} if table == "students" else {"date"}
+        if not required <= header or (table != "students" and not header & {"student_id", "student_code"}):
+            raise ValueError(f"Colonnes attendues: {', '.join(IMPORT_COLUMNS[table])}")
+        try:
+            with (db.snapshot() if dry_run else db.transaction()) as c:
+                batch = []
+                for line, rec in enumerate(reader, 2):
+                    batch.append((line, rec))
+                    if len(batch) < IMPORT_BATCH: continue
+                    if cancelled and cancelled(): raise _ImportCancelled
+                    load(c, batch, report, upsert, dry_run, seen); batch = []
+                    if progress: progress(raw.tell(), size)
+                if cancelled and cancelled(): raise _ImportCancelled
+                if batch: load(c, batch, report, upsert, dry_run, seen)
+        except _ImportCancelled:
+            return None
+    if progress: progress(size, size)
+    return report
+
+# Photo store. A photo is saved once as photos/<h[:2]>/<h>.<ext>, h being the
+# SHA-256 of its bytes; students.photo holds that file name, so the same
+# picture chosen twice is stored once. Thumbnails are cached in photos/thumbs.
+THUMB_SIZE = 160
+PHOTO_KEY = re.compile(r"[0-9a-f]{64}\.\w+")
+
+def store_photo(src):
+    """Copy `src` into the store (unless already there), make its thumbnail and
+    return its key."""
+    import hashlib, shutil
+    digest = hashlib.sha256()
+    with open(src, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): digest.update(block)
+    key = digest.hexdigest() + (Path(src).suffix.lower() or ".img")
+    dest = photo_path(key)
+    if not dest.exists():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _part_file(dest)
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    else:
+        # marks it as just chosen, for photo_maintenance (PHOTO_GRACE)
+        os.utime(dest)
+    # made now rather than on first display, where it would slow the student view
+    ensure_thumbnail(key)
+    return key
+
+def _part_file(path):
+    # unique per writer: bulletin worker processes may build the same thumbnail
+    return path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.part")
+
+def photo_path(photo):
+    """File of a students.photo value: a store key, or a path saved by older versions."""
+    if not photo: return None
+    if PHOTO_KEY.fullmatch(photo): return PHOTOS / photo[:2] / photo
+    legacy = Path(photo)
+    # the app folder may have moved since the path was saved
+    return legacy if legacy.exists() else PHOTOS / legacy.name.split("\\")[-1]
+
+def thumbnail_path(photo):
+    return THUMBS / (Path(photo).stem + ".png") if photo and PHOTO_KEY.fullmatch(photo) else None
+
+_Image = False      # PIL.Image after the first _pil() call, None if PIL is not installed
+
+def _pil():
+    # optional: JPEG thumbnails (PNG/GIF ones fall back to Tk); slow to import, so only when a thumbnail is missing
+    global _Image
+    if _Image is False:
+        try: from PIL import Image as _Image
+        except ImportError: _Image = None
+    return _Image
+
+def ensure_thumbnail(photo):
+    """Cached thumbnail of a stored photo, made with PIL when missing. Returns its
+    path, or None (no photo, legacy path, PIL absent for this format)."""
+    thumb = thumbnail_path(photo)
+    if thumb is None or thumb.exists(): return thumb
+    Image = _pil()
+    if Image is None: return None
+    try:
+        with Image.open(photo_path(photo)) as img:
+            img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            THUMBS.mkdir(exist_ok=True)
+            tmp = _part_file(thumb)
+            img.save(tmp, format="PNG")
+        os.replace(tmp, thumb)
+        return thumb
+    except (OSError, ValueError):
+        return None
+
+PHOTO_GRACE = 30 * 60   # seconds a newly stored photo is kept before its student is saved
+
+def photo_maintenance(db, progress=None, cancelled=None):
+    """Move photos referenced by old-style paths into the store, then delete
+    store files, thumbnails and adopted copies no students.photo refers to.
+    Files stored in the last PHOTO_GRACE seconds are kept: the form they were
+    chosen for may not be saved yet. Returns (adopted, removed files, bytes
+    freed), or None if cancelled. Raises ValueError for any database but DB.
+    """
+    # photos/ belongs to data.db: judged by another base (a copy, a benchmark
+    # or test base) every photo of the live one would look unused
+    if Path(db.path).resolve() != Path(DB).resolve():
+        raise ValueError(f"Nettoyage des photos: {PHOTOS} sert à {DB}, pas à {db.path}")
+    adopted, copies = 0, set()
+    legacy = [r for r in db.query("SELECT id, photo FROM students WHERE photo IS NOT NULL AND photo != ''")
+              if not PHOTO_KEY.fullmatch(r[1])]
+    for n, (sid, photo) in enumerate(legacy, 1):
+        if cancelled and cancelled(): return None
+        src = photo_path(photo)
+        if src.is_file():
+            db.execute("UPDATE students SET photo=? WHERE id=?", (store_photo(src), sid)); adopted += 1
+            if src.parent == PHOTOS: copies.add(src)
+        if progress: progress(n, len(legacy) + 1)
+    keys = {r[0] for r in db.query("SELECT DISTINCT photo FROM students WHERE photo IS NOT NULL")}
+    keep = {photo_path(k) for k in keys} | {thumbnail_path(k) for k in keys}
+    removed = freed = 0
+    recent = time.time() - PHOTO_GRACE
+    for f in list(PHOTOS.rglob("*")):
+        if not f.is_file() or f in keep or f.stat().st_mtime > recent: continue
+        # other flat files in photos/ are left alone: only copies adopted above go
+        if PHOTO_KEY.fullmatch(f.name) or f.parent == THUMBS or f.suffix == ".part" or f in copies:
+            freed += f.stat().st_size; f.unlink(); removed += 1
+    if progress: progress(len(legacy) + 1, len(legacy) + 1)
+    return adopted, removed, freed
+
+# Bulletins. Templates are parsed once; every value is HTML-escaped before
+# substitution, only the already-rendered fragments (lists, average) are not.
+BULLETIN_PAGE = string.Template("""<html><head><meta charset='utf-8'><title>$title</title>
+<style>body{font-family:Helvetica,Arial,sans-serif} .bulletin{page-break-after:always} .bulletin:last-child{page-break-after:auto}</style>
+</head><body>$body</body></html>""")
+BULLETIN_BODY = string.Template("<div class='bulletin'><h1>Bulletin - COURS PRIVÉ</h1>$photo<h2>$first_name $last_name ($code)</h2>"
+                                "<p>Classe: $classe | Cycle: $cycle | Année: $year</p><p>Téléphone: $phone</p>"
+                                "<h3>Leçons / Contrôles</h3><ul>$lessons</ul><h3>Notes</h3><ul>$grades</ul>$average</div>")
+BULLETIN_LESSON = string.Template("<li>$date - $topic - Durée $duration - Note: $note</li>")
+BULLETIN_GRADE = string.Template("<li>$date - $subject ($term) - $value/20 coef. $coefficient - $comment</li>")
+BULLETIN_AVERAGE = string.Template("<p><b>Moyenne: $average/20</b> - Rang $rank/$size</p>")
+BULLETIN_PHOTO = string.Template("<img src='$src' alt='' style='float:right;max-width:${size}px;max-height:${size}px'>")
+BULLETIN_SCOPES = {"classe": "Classe", "cycle": "Cycle", "year": "Année"}
+BULLETIN_CHUNK = 200        # students handed to the worker pool per round
+BULLETIN_POOL_MIN = 100     # below this, starting worker processes costs more than it saves
+
+def _esc(value):
+    return html.escape("" if value is None else str(value))
+
+def render_bulletin(data):
+    """Return (code, HTML body) for one bulletin_data() item (runs in worker processes)."""
+    student, lessons, grades, ranking = data
+    code, last_name, first_name, classe, cycle, year, phone, photo, _ = student
+    src = ensure_thumbnail(photo) or photo_path(photo)
+    photo_html = BULLETIN_PHOTO.substitute(src=_esc(src.resolve().as_uri()), size=THUMB_SIZE) if src and src.is_file() else ""
+    lessons_html = "".join(BULLETIN_LESSON.substitute(date=_esc(L[0]), topic=_esc(L[1]), duration=_esc(L[2]), note=_esc(L[3]))
+                           for L in lessons)
+    grades_html = "".join(BULLETIN_GRADE.substitute(date=_esc(G[0]), subject=_esc(G[1]), term=_esc(G[2] or "-"), value=f"{G[3]:g}",
+                                                    coefficient=f"{G[4]:g}", comment=_esc(G[5])) for G in grades)
+    average = BULLETIN_AVERAGE.substitute(average=f"{ranking[0]:.2f}", rank=ranking[1], size=ranking[2]) if ranking else ""
+    return code, BULLETIN_BODY.substitute(code=_esc(code), last_name=_esc(last_name), first_name=_esc(first_name), classe=_esc(classe),
+                                          cycle=_esc(cycle), year=_esc(year), phone=_esc(phone),
+                                          lessons=lessons_html, grades=grades_html, average=average, photo=photo_html)
+
+def _bulletin_filter(scope, value, student_id):
+    if student_id is not None: return "s.id = ?", (student_id,)
+    return f"IFNULL(s.{scope},'') = ?", (value or "",)
+
+def _rows_by_student(cur):
+    """Return take(sid) -> rows of `cur` (ordered by student id) belonging to sid, without the id column."""
+    groups = itertools.groupby(cur, key=lambda r: r[0])
+    current = next(groups, None)
+    def take(sid):
+        nonlocal current
+        while current and current[0] < sid: current = next(groups, None)
+        if not current or current[0] != sid: return []
+        rows = [r[1:] for r in current[1]]
+        current = next(groups, None)
+        return rows
+    return take
+
+def bulletin_data(conn, scope=None, value=None, student_id=None):
+    """Yield (student, lessons, grades, (average, rank, size) or None) per selected student;
+    `student` is (code, last_name, first_name, classe, cycle, year, phone, photo, id).
+
+    The selection is one student, or every student whose `scope` column
+    (classe, cycle or year) equals `value`. Four queries cover the whole
+    selection; lessons and grades are merged in by student id as they stream.
+    """
+    where, params = _bulletin_filter(scope, value, student_id)
+    # ranks are computed within each whole classe, as in student_average()
+    ranking = {r[0]: r[1:] for r in conn.execute(
+        "SELECT id, avg, RANK() OVER (PARTITION BY cl ORDER BY avg DESC), COUNT(*) OVER (PARTITION BY cl) FROM ("
+        "SELECT s.id, IFNULL(s.classe,'') AS cl, sa.weighted_sum / sa.coef_sum AS avg FROM students s "
+        "JOIN student_averages sa ON sa.student_id = s.id WHERE sa.coef_sum > 0 "
+        f"AND IFNULL(s.classe,'') IN (SELECT IFNULL(classe,'') FROM students s WHERE {where}))", params)}
+    lessons = _rows_by_student(conn.execute(
+        f"SELECT l.student_id, l.date, l.topic, l.duration, l.note FROM lessons l JOIN students s ON s.id = l.student_id "
+        f"WHERE {where} ORDER BY l.student_id, l.date DESC", params))
+    grades = _rows_by_student(conn.execute(
+        f"SELECT g.student_id, g.date, g.subject, g.term, g.value, g.coefficient, g.comment FROM grades g "
+        f"JOIN students s ON s.id = g.student_id WHERE {where} ORDER BY g.student_id, g.date DESC", params))
+    for row in conn.execute(f"SELECT s.id, s.code, s.last_name, s.first_name, s.classe, s.cycle, s.year, s.phone, s.photo, s.id "
+                            f"FROM students s WHERE {where} ORDER BY s.id", params):
+        sid = row[0]
+        yield row[1:], lessons(sid), grades(sid), ranking.get(sid)
+
+def _safe_name(text):
+    return re.sub(r"[^\w.-]", "_", str(text))
+
+def bulletin_filename(code, student_id, taken=None):
+    """bulletin_<code>.html, or bulletin_id<id>.html for a student without code.
+    `taken` holds the names already used by a run (lower case, as Windows
+    compares them): a code that sanitises to one of them gets the id appended."""
+    name = f"bulletin_{_safe_name(code)}" if code else f"bulletin_id{student_id}"
+    if taken is not None:
+        while f"{name}.html".lower() in taken: name += f"_id{student_id}"
+        taken.add(f"{name}.html".lower())
+    return f"{name}.html"
+
+def write_bulletins(db, scope, value, out_dir, combined=False, progress=None, cancelled=None):
+    """Write one bulletin file per student of the selection into out_dir, plus
+    one printable file with every bulletin when `combined`.
+
+    Large selections are rendered on a process pool, BULLETIN_CHUNK students
+    at a time. Files are written as .part and renamed only once every
+    bulletin is written, so a cancelled or failed run leaves nothing behind.
+    Returns the number of bulletins, or None if cancelled.
+    """
+    out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+    where, params = _bulletin_filter(scope, value, None)
+    title = f"Bulletins {BULLETIN_SCOPES[scope]} {value}"
+    done, staged, complete, names = 0, [], False, set()     # staged: (.part file, final file)
+    def stage(path):
+        part = _part_file(path); staged.append((part, path))
+        return part
+    with db.snapshot() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM students s WHERE {where}", params).fetchone()[0]
+        if total >= BULLETIN_POOL_MIN:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor()
+        else:
+            pool = None
+        head, tail = BULLETIN_PAGE.substitute(title=_esc(title), body="\0").split("\0")
+        all_file = open(stage(out_dir / f"bulletins_{_safe_name(value)}.html"), "w", encoding="utf-8") if combined else None
+        try:
+            if all_file: all_file.write(head)
+            items = bulletin_data(conn, scope, value)
+            while True:
+                chunk = list(itertools.islice(items, BULLETIN_CHUNK))
+                if not chunk: break
+                if cancelled and cancelled(): return None
+                rendered = pool.map(render_bulletin, chunk, chunksize=16) if pool else map(render_bulletin, chunk)
+                for (student, *_), (code, body) in zip(chunk, rendered):
+                    stage(out_dir / bulletin_filename(code, student[-1], names)).write_text(
+                        BULLETIN_PAGE.substitute(title=_esc(f"Bulletin {code or student[-1]}"), body=body), encoding="utf-8")
+                    if all_file: all_file.write(body)
+                done += len(chunk)
+                if progress: progress(done, total)
+            if all_file: all_file.write(tail)
+            complete = True
+        finally:
+            if all_file: all_file.close()
+            if pool: pool.shutdown(cancel_futures=True)
+            for part, path in staged:
+                if complete: os.replace(part, path)
+                elif part.exists(): part.unlink()
+    return done
+
+def student_values(row):
+    """Treeview values (STUDENT_COLUMNS order) for a student row starting with id and ending with its unread count."""
+    return tuple(v or "" for v in row[1:5]) + (f"✉ {row[-1]}" if row[-1] else "",)
+
+def student_tags(row):
+    return ("unread",) if row[-1] else ()
+
+def student_rows(db, ids):
+    """(id, code, last_name, first_name, classe, unread) of the given students, for refreshing list rows."""
+    ids = list(ids)
+    return db.query(f"SELECT id, code, last_name, first_name, classe, {UNREAD_SQL} FROM students s "
+                    f"WHERE id IN ({','.join('?' * len(ids))})", ids)
+
+# Ledger
+FEE_SCOPES = {"classe": "Classe", "cycle": "Cycle"}
+
+def set_fee(db, scope, value, amount):
+    """Create or change the fee of a classe or cycle; balances follow by trigger."""
+    db.execute("INSERT INTO fee_schedules (scope, value, amount) VALUES (?, ?, ?) "
+               "ON CONFLICT(scope, value) DO UPDATE SET amount = excluded.amount", (scope, value or "", amount))
+
+def delete_fee(db, scope, value):
+    db.execute("DELETE FROM fee_schedules WHERE scope=? AND value=?", (scope, value or ""))
+
+def student_balance(db, sid):
+    """(fees due, paid in the student's school year, still owed) for one student."""
+    r = db.query_one("SELECT fees_due, paid FROM student_balances WHERE student_id=?", (sid,)) or (0.0, 0.0)
+    return r[0], r[1], r[0] - r[1]
+
+def overdue_students(db, limit=-1):
+    """(id, code, last_name, first_name, classe, fees due, paid, owed) of students who still owe, largest debt first."""
+    return db.query("SELECT s.id, s.code, s.last_name, s.first_name, s.classe, b.fees_due, b.paid, b.fees_due - b.paid "
+                    "FROM student_balances b JOIN students s ON s.id = b.student_id "
+                    "WHERE b.fees_due - b.paid > 0 ORDER BY b.fees_due - b.paid DESC LIMIT ?", (limit,))
+
+def revenue(db, period="monthly", start="", end="\uffff"):
+    """(period, method, total, count) rows of revenue_daily / revenue_monthly with start <= period <= end."""
+    table = {"daily": "revenue_daily", "monthly": "revenue_monthly"}[period]
+    return db.query(f"SELECT period, method, total, count FROM {table} WHERE period BETWEEN ? AND ? AND count > 0 "
+                    "ORDER BY period DESC, method", (start, end))
+
+# Messages
+MESSAGE_PAGE = 30       # messages of a student shown at once; older ones on demand
+INBOX_LIMIT = 200
+
+def message_page(db, sid, before=None, limit=MESSAGE_PAGE):
+    """(id, date, sender, content, read_flag) of student `sid`, newest first,
+    older than the (date, id) key `before`: a seek on idx_messages_student_date."""
+    if before is None:
+        return db.query("SELECT id, date, sender, content, read_flag FROM messages WHERE student_id=? "
+                        "ORDER BY date DESC, id DESC LIMIT ?", (sid, limit))
+    return db.query("SELECT id, date, sender, content, read_flag FROM messages WHERE student_id=? AND date <= ? "
+                    "AND (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?", (sid, before[0], before[0], before[1], limit))
+
+def unread_messages(db, limit=INBOX_LIMIT):
+    """(id, student_id, code, last_name, first_name, date, sender, content) of unread messages, newest first."""
+    return db.query("SELECT m.id, m.student_id, s.code, s.last_name, s.first_name, m.date, m.sender, m.content "
+                    "FROM messages m INDEXED BY idx_messages_unread JOIN students s ON s.id = m.student_id "
+                    "WHERE m.read_flag = 0 ORDER BY m.date DESC LIMIT ?", (limit,))
+
+def mark_read(db, message_ids=None, student_id=None):
+    """Mark the given messages, a student's messages, or (neither given) every
+    message read, in one statement. Returns the ids of the students affected."""
+    if message_ids is not None:
+        ids = list(message_ids)
+        where, params = f"id IN ({','.join('?' * len(ids))})", ids
+    elif student_id is not None:
+        where, params = "student_id = ?", [student_id]
+    else:
+        where, params = "1", []
+    with db.transaction() as c:
+        sids = [r[0] for r in c.execute(f"SELECT DISTINCT student_id FROM messages WHERE read_flag = 0 AND {where}", params)]
+        c.execute(f"UPDATE messages SET read_flag = 1 WHERE read_flag = 0 AND {where}", params)
+    return sids
+
+def broadcast_message(db, classe, sender, content):
+    """Send one message to every student of `classe` with a single INSERT ... SELECT.
+    Returns the ids of the recipients."""
+    with db.transaction() as c:
+        sids = [r[0] for r in c.execute("SELECT id FROM students WHERE IFNULL(classe,'') = ?", (classe or "",))]
+        c.execute("INSERT INTO messages (student_id, date, sender, content, read_flag) "
+                  "SELECT id, ?, ?, ?, 0 FROM students WHERE IFNULL(classe,'') = ?", (now_timestamp(), sender, content, classe or ""))
+    return sids
+
+# Date ranges
+DATED_COLUMNS = {
+    "lessons": "id, student_id, date, topic, duration, note",
+    "payments": "id, student_id, date, amount, method, note",
+    "grades": "id, student_id, date, subject, term, value, coefficient, comment",
+    "messages": "id, student_id, date, sender, content, read_flag",
+}
+
+def rows_between(db, table, start, end, student_id=None):
+    """Rows of `table` dated in [start, end), oldest first. A range scan of
+    idx_<table>_date, or of idx_<table>_student_date for one student."""
+    where = "date >= ? AND date < ?"
+    params = (start, end)
+    if student_id is not None:
+        where = "student_id = ? AND " + where; params = (student_id,) + params
+    return db.query(f"SELECT {DATED_COLUMNS[table]} FROM {table} WHERE {where} ORDER BY date", params)
+
+def rows_in_period(db, table, period, day=None, student_id=None):
+    """e.g. rows_in_period(db, "lessons", "week") or rows_in_period(db, "payments", "month", "2025-11-01")."""
+    return rows_between(db, table, *period_bounds(period, day), student_id=student_id)
+
+# Scheduling
+WEEKDAYS = ("Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche")
+SCHEDULE_RESOURCES = {"student_id": "élève", "teacher_id": "enseignant", "room_id": "salle"}
+OPEN_UNTIL = "9999-12-31"   # valid_until of a slot without end date
+
+class ScheduleConflict(ValueError):
+    """Raised by add_slot; `conflicts` holds the clashing slot rows."""
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__("Conflit avec: " + "; ".join(describe_slot(r) for r in conflicts[:5]))
+
+def parse_time(value):
+    """'HH:MM' (or 'HHhMM', 'HH') -> minutes since midnight, up to 24:00."""
+    m = re.fullmatch(r"\s*(\d{1,2})(?:[:hH](\d{2})?)?\s*", str(value or ""))
+    minutes = int(m.group(1)) * 60 + int(m.group(2) or 0) if m else -1
+    if not m or int(m.group(2) or 0) > 59 or minutes > 24 * 60:
+        raise ValueError(f"heure invalide: '{value}' (HH:MM, 24:00 au plus)")
+    return minutes
+
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def resource_id(c, table, name):
+    """Id of the teacher / room called `name`, created on first use; None for a blank name."""
+    name = (name or "").strip()
+    if not name: return None
+    c.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+    return c.execute(f"SELECT id FROM {table} WHERE name=?", (name,)).fetchone()[0]
+
+# slot rows as shown to the user
+SLOT_SELECT = ("SELECT sl.id, sl.weekday, sl.start_min, sl.end_min, TRIM(IFNULL(s.first_name,'') || ' ' || IFNULL(s.last_name,'')), "
+               "t.name, r.name, sl.topic, sl.valid_from, sl.valid_until, sl.student_id FROM schedule_slots sl "
+               "JOIN students s ON s.id = sl.student_id LEFT JOIN teachers t ON t.id = sl.teacher_id "
+               "LEFT JOIN rooms r ON r.id = sl.room_id")
+
+def describe_slot(r):
+    return f"{WEEKDAYS[r[1]]} {format_time(r[2])}-{format_time(r[3])} {r[4]} / {r[5] or '-'} / {r[6] or '-'}"
+
+def slot_conflicts(c, weekday, start, end, valid_from, valid_until=None, exclude=None, **resources):
+    """Slots sharing one of `resources` (student_id=, teacher_id=, room_id=)
+    that overlap [start, end) on `weekday` during [valid_from, valid_until)."""
+    found = {}
+    for col, rid in resources.items():
+        if rid is None: continue
+        rows = c.execute(f"{SLOT_SELECT} WHERE sl.{col} = ? AND sl.weekday = ? AND sl.start_min < ? AND sl.end_min > ? "
+                         "AND sl.valid_from < ? AND IFNULL(sl.valid_until, ?) > ? AND sl.id IS NOT ?",
+                         (rid, weekday, end, start, valid_until or OPEN_UNTIL, OPEN_UNTIL, valid_from, exclude)).fetchall()
+        found.update((r[0], r) for r in rows)
+    return sorted(found.values(), key=lambda r: (r[2], r[0]))
+
+def add_slot(db, student_id, weekday, start, end, valid_from, valid_until=None, teacher="", room="", topic=""):
+    """Insert a recurring slot after checking it against the timetable in the
+    same write transaction; raises ScheduleConflict instead of double booking."""
+    if end <= start: raise ValueError("l'heure de fin doit suivre l'heure de début")
+    if valid_until and valid_until <= valid_from: raise ValueError("la date de fin doit suivre la date de début")
+    with db.transaction() as c:
+        teacher_id, room_id = resource_id(c, "teachers", teacher), resource_id(c, "rooms", room)
+        conflicts = slot_conflicts(c, weekday, start, end, valid_from, valid_until,
+                                   student_id=student_id, teacher_id=teacher_id, room_id=room_id)
+        if conflicts: raise ScheduleConflict(conflicts)
+        c.execute("INSERT INTO schedule_slots (student_id, teacher_id, room_id, weekday, start_min, end_min, valid_from, valid_until, topic) "
+                  "VALUES (?,?,?,?,?,?,?,?,?)", (student_id, teacher_id, room_id, weekday, start, end, valid_from, valid_until or None, topic))
+        return c.lastrowid
+
+def timetable_conflicts(db):
+    """(slot id, slot id, shared resource) for every double booking already stored."""
+    found = []
+    for col, label in SCHEDULE_RESOURCES.items():
+        found += db.query(f"SELECT a.id, b.id, ? FROM schedule_slots a JOIN schedule_slots b "
+                          f"ON b.{col} = a.{col} AND b.weekday = a.weekday AND b.start_min < a.end_min AND b.end_min > a.start_min "
+                          "AND b.id > a.id AND b.valid_from < IFNULL(a.valid_until, ?) AND IFNULL(b.valid_until, ?) > a.valid_from "
+                          f"WHERE a.{col} IS NOT NULL", (label, OPEN_UNTIL, OPEN_UNTIL))
+    return found
+
+def week_schedule(db, day=None):
+    """Slot rows taking place in the week of `day`, with their date, in time order: one range query."""
+    start, end = period_bounds("week", day)
+    return db.query(f"SELECT date(?, '+' || sl.weekday || ' days') AS day, * FROM ({SLOT_SELECT} "
+                    "WHERE sl.valid_from < ? AND IFNULL(sl.valid_until, ?) > ?) sl "
+                    "WHERE sl.valid_from <= day AND IFNULL(sl.valid_until, ?) > day ORDER BY sl.weekday, sl.start_min",
+                    (start, end, OPEN_UNTIL, start, OPEN_UNTIL))
+
+def find_free_slots(db, duration, weekdays=range(6), day_start=8 * 60, day_end=20 * 60, valid_from=None, **resources):
+    """(weekday, start, end) windows of at least `duration` minutes where none
+    of `resources` (student_id=, teacher_id=, room_id=) is booked, from
+    `valid_from` on; busy intervals come from one query over the indexes."""
+    valid_from = valid_from or datetime.date.today().isoformat()
+    wanted = [(col, rid) for col, rid in resources.items() if rid is not None]
+    busy = {d: [] for d in weekdays}
+    if wanted:
+        where = " OR ".join(f"{col} = ?" for col, _ in wanted)
+        for weekday, start, end in db.query(f"SELECT weekday, start_min, end_min FROM schedule_slots WHERE ({where}) "
+                                            "AND IFNULL(valid_until, ?) > ? ORDER BY weekday, start_min",
+                                            [rid for _, rid in wanted] + [OPEN_UNTIL, valid_from]):
+            if weekday in busy: busy[weekday].append((start, end))
+    free = []
+    for weekday in weekdays:
+        cursor = day_start
+        for start, end in busy[weekday] + [(day_end, day_end)]:
+            if min(start, day_end) - cursor >= duration:
+                free.append((weekday, cursor, min(start, day_end)))
+            cursor = max(cursor, end)
+    return free
+
+# Students, lessons, grades and payments
+STUDENT_FIELDS = ("code", "last_name", "first_name", "classe", "cycle", "year", "photo", "phone")
+
+def get_student(db, sid):
+    """(code, last_name, first_name, classe, cycle, year, photo, notes, phone) or None."""
+    return db.query_one("SELECT code,last_name,first_name,classe,cycle,year,photo,notes,phone FROM students WHERE id=?", (sid,))
+
+def student_classe(db, sid):
+    return (db.query_one("SELECT classe FROM students WHERE id=?", (sid,)) or (None,))[0]
+
+def save_student(db, fields, sid=None):
+    """Insert a student from a STUDENT_FIELDS dict, or update student `sid`. Returns the id."""
+    if not fields.get("code") or not fields.get("first_name"):
+        raise ValueError("Code et prénom requis")
+    values = tuple(fields.get(f) for f in STUDENT_FIELDS)
+    if sid is None:
+        return db.execute(f"INSERT INTO students ({','.join(STUDENT_FIELDS)}) VALUES ({','.join('?' * len(STUDENT_FIELDS))})", values)
+    db.execute(f"UPDATE students SET {', '.join(f + '=?' for f in STUDENT_FIELDS)} WHERE id=?", values + (sid,))
+    return sid
+
+def delete_student(db, sid):
+    # lessons, payments, messages, grades and slots follow through ON DELETE CASCADE
+    db.execute("DELETE FROM students WHERE id=?", (sid,))
+
+def add_lesson(db, sid, date, topic="", duration=60, note=""):
+    return db.execute("INSERT INTO lessons (student_id,date,topic,duration,note) VALUES (?,?,?,?,?)",
+                      (sid, normalize_date(date), topic, duration, note))
+
+def delete_lesson(db, lesson_id):
+    db.execute("DELETE FROM lessons WHERE id=?", (lesson_id,))
+
+def add_grade(db, sid, date, subject, value, coefficient=1.0, term=None, comment=""):
+    """Record a grade out of 20; the term defaults to the one of `date`."""
+    if not 0 <= value <= 20 or coefficient <= 0:
+        raise ValueError("Valeur entre 0 et 20, coefficient positif")
+    date = normalize_date(date)
+    return db.execute("INSERT INTO grades (student_id,date,subject,term,value,coefficient,comment) VALUES (?,?,?,?,?,?,?)",
+                      (sid, date, subject, term or school_term(date), value, coefficient, comment))
+
+def delete_grade(db, grade_id):
+    db.execute("DELETE FROM grades WHERE id=?", (grade_id,))
+
+def add_payment(db, sid, date, amount, method="", note=""):
+    return db.execute("INSERT INTO payments (student_id,date,amount,method,note) VALUES (?,?,?,?,?)",
+                      (sid, normalize_date(date), amount, method, note))
+
+def student_payments(db, sid):
+    return db.query("SELECT id,date,amount,method,note FROM payments WHERE student_id=? ORDER BY date DESC", (sid,))
+
+def send_message(db, sid, sender, content):
+    return db.execute("INSERT INTO messages (student_id,date,sender,content,read_flag) VALUES (?,?,?,?,0)",
+                      (sid, now_timestamp(), sender, content))
+
+def scope_values(db, scope):
+    """Distinct values of a BULLETIN_SCOPES column, for pickers."""
+    return [r[0] for r in db.query(f"SELECT DISTINCT IFNULL({scope},'') FROM students ORDER BY 1")]
+
+def fee_schedule(db):
+    return db.query("SELECT scope, value, amount FROM fee_schedules ORDER BY scope, value")
+
+def resource_names(db, table):
+    return [r[0] for r in db.query(f"SELECT name FROM {table} ORDER BY name")]
+
+def find_resource(db, table, name):
+    """Id of the teacher / room called `name`, or None."""
+    r = db.query_one(f"SELECT id FROM {table} WHERE name=?", (name.strip(),)) if name and name.strip() else None
+    return r and r[0]
+
+def delete_slot(db, slot_id):
+    db.execute("DELETE FROM schedule_slots WHERE id=?", (slot_id,))
+
+def week_lessons(db, day=None):
+    """(date, student name, topic, duration) of the lessons recorded in the week of `day`."""
+    lessons = rows_in_period(db, "lessons", "week", day)
+    ids = sorted({r[1] for r in lessons})
+    # imported students may lack a first or last name
+    names = {r[0]: " ".join(filter(None, r[1:])) for r in db.query(
+        f"SELECT id, first_name, last_name FROM students WHERE id IN ({','.join('?' * len(ids))})", ids)}
+    return [(r[2], names.get(r[1], "?"), r[3], r[4]) for r in lessons]
+
+def load_student_view(db, sid):
+    """Everything the right-hand tabs show for one student, or None if it is gone."""
+    student = get_student(db, sid)
+    if student is None: return None
+    return {
+        "id": sid,
+        "student": student,
+        "lessons": db.query("SELECT id,date,topic,duration,note FROM lessons WHERE student_id=? ORDER BY date DESC", (sid,)),
+        "grades": db.query("SELECT id,date,subject,term,value,coefficient,comment FROM grades WHERE student_id=? ORDER BY date DESC", (sid,)),
+        "messages": message_page(db, sid),
+        "average": student_average(db, sid),
+        "balance": student_balance(db, sid),
+        "thumbnail": ensure_thumbnail(student[6]),
+    }
+
+# Backups. A snapshot is data.db copied with SQLite's online backup API,
+# BACKUP_PAGES pages per step with a pause in between, checked with
+# PRAGMA integrity_check and gzip-compressed as backups/data-<time>.db.gz.
+# Photos are mirrored once into backups/photos/ (only new or changed files
+# are copied) and each snapshot's manifest lists the ones it uses. A snapshot
+# identical to the previous one is not kept; prune_backups() keeps the newest
+# snapshot of each of the last BACKUP_KEEP hours, days and weeks.
+BACKUP_DIR = Path(os.environ.get("COURS_PRIVE_BACKUPS", THIS_DIR / "backups"))
+BACKUP_PAGES = 256          # pages copied per step (1 MB with 4 KB pages)
+BACKUP_PAUSE = 0.02         # seconds between steps, for the app's own writes
+BACKUP_INTERVAL = 60        # minutes between scheduled snapshots
+BACKUP_KEEP = {"hourly": 12, "daily": 7, "weekly": 4}
+BACKUP_BUCKETS = {
+    "hourly": lambda t: (t.date(), t.hour),
+    "daily": lambda t: t.date(),
+    "weekly": lambda t: t.isocalendar()[:2],
+}
+BACKUP_NAME = re.compile(r"data-(\d{8}-\d{6})\.db\.gz")
+
+class _BackupCancelled(Exception):
+    pass
+
+def _manifest_path(snapshot):
+    return snapshot.with_name(snapshot.name[:-len(".db.gz")] + ".txt")
+
+def read_manifest(snapshot):
+    """(sha256, size of the uncompressed database, {photo path: size}) of a snapshot."""
+    digest, size, photos = None, 0, {}
+    with open(_manifest_path(snapshot), encoding="utf-8") as f:
+        for line in f:
+            kind, _, rest = line.rstrip("\n").partition(" ")
+            if kind == "db": digest, size = rest.split(" "); size = int(size)
+            elif kind == "photo": n, _, rel = rest.partition(" "); photos[rel] = int(n)
+    return digest, size, photos
+
+def list_backups(backup_dir=None):
+    """(path, datetime) of every snapshot, newest first."""
+    backup_dir = Path(backup_dir or BACKUP_DIR)
+    found = []
+    for f in backup_dir.glob("data-*.db.gz"):
+        m = BACKUP_NAME.fullmatch(f.name)
+        if m and _manifest_path(f).exists():
+            found.append((f, datetime.datetime.strptime(m.group(1), "%Y%m%d-%H%M%S")))
+    return sorted(found, key=lambda r: r[1], reverse=True)
+
+def _write_manifest(manifest, digest, size, photos, checked):
+    part = _part_file(manifest)
+    with open(part, "w", encoding="utf-8") as f:
+        f.write(f"db {digest} {size}\n")
+        f.write(f"checked {checked:%Y%m%d-%H%M%S}\n")
+        f.writelines(f"photo {n} {rel}\n" for rel, n in photos.items())
+    os.replace(part, manifest)
+
+def last_checked(snapshot):
+    """When the database was last found identical to `snapshot` (the snapshot's
+    own time for manifests written before that was recorded)."""
+    with open(_manifest_path(snapshot), encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("checked "): return datetime.datetime.strptime(line.split()[1], "%Y%m%d-%H%M%S")
+    return datetime.datetime.strptime(BACKUP_NAME.fullmatch(snapshot.name).group(1), "%Y%m%d-%H%M%S")
+
+def backup_due(backup_dir=None, interval=BACKUP_INTERVAL):
+    # an unchanged database gets no new snapshot, only a new check time
+    snaps = list_backups(backup_dir)
+    return not snaps or datetime.datetime.now() - last_checked(snaps[0][0]) >= datetime.timedelta(minutes=interval)
+
+def _intact(snapshot, digest, size):
+    # the .db.gz is there and decompresses to the database its manifest records
+    import gzip, hashlib, zlib
+    check, n = hashlib.sha256(), 0
+    try:
+        with gzip.open(snapshot, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""): check.update(block); n += len(block)
+    except (OSError, EOFError, zlib.error):
+        return False
+    return check.hexdigest() == digest and n == size
+
+def _copy_file(src, dest):
+    # through a .part file, so a copy cut short is never taken for a good one
+    import shutil
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _part_file(dest)
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+def _photo_files():
+    # thumbnails are rebuilt on demand, so they are not backed up
+    return {f.relative_to(PHOTOS).as_posix(): f for f in PHOTOS.rglob("*")
+            if f.is_file() and f.suffix != ".part" and THUMBS not in f.parents}
+
+def backup_database(db, backup_dir=None, progress=None, cancelled=None):
+    """Take a snapshot of the database and photos while the app keeps working.
+
+    Returns (snapshot path, whether it is new, photos copied); when nothing
+    changed since the latest snapshot and its file is intact, that one is
+    returned and only its check time moves forward. Returns None if
+    cancelled() became True. Raises sqlite3.DatabaseError if the copy fails
+    its integrity check.
+    """
+    import gzip, hashlib, shutil
+    backup_dir = Path(backup_dir or BACKUP_DIR); backup_dir.mkdir(parents=True, exist_ok=True)
+    when = datetime.datetime.now().replace(microsecond=0)
+    # names must stay unique: restore_backup() snapshots right before restoring
+    while (backup_dir / f"data-{when:%Y%m%d-%H%M%S}.db.gz").exists(): when += datetime.timedelta(seconds=1)
+    stamp = f"{when:%Y%m%d-%H%M%S}"
+    snapshot = backup_dir / f"data-{stamp}.db.gz"
+    manifest = _manifest_path(snapshot)
+    raw, part = _part_file(backup_dir / f"data-{stamp}.db"), _part_file(snapshot)
+    photos, pages = _photo_files(), [0]
+    def step(status, remaining, total):
+        if cancelled and cancelled(): raise _BackupCancelled()
+        pages[0] = total
+        if progress: progress(total - remaining, total + len(photos))
+    try:
+        src, dest = db.connection(), sqlite3.connect(raw)
+        try:
+            # In WAL mode an open read transaction pins one state of the database
+            # for every step; otherwise each write by another connection would
+            # restart the copy. Writers are not blocked by it.
+            pinned = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            if pinned: src.execute("BEGIN"); src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+            try: src.backup(dest, pages=BACKUP_PAGES, progress=step, sleep=BACKUP_PAUSE)
+            finally:
+                if pinned: src.execute("COMMIT")
+            check = dest.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            dest.close()
+        if check != [("ok",)]:
+            raise sqlite3.DatabaseError(f"Sauvegarde invalide: {'; '.join(r[0] for r in check[:5])}")
+        digest, size = hashlib.sha256(), raw.stat().st_size
+        with open(raw, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""): digest.update(block)
+        digest = digest.hexdigest()
+        # photos: content-addressed store files never change, so this copies new ones only
+        mirror, copied, listed = backup_dir / "photos", 0, {}
+        for n, (rel, f) in enumerate(sorted(photos.items()), 1):
+            if cancelled and cancelled(): raise _BackupCancelled()
+            st, copy = f.stat(), mirror / rel
+            if not copy.exists() or copy.stat().st_size != st.st_size or copy.stat().st_mtime < st.st_mtime:
+                _copy_file(f, copy); copied += 1
+            listed[rel] = st.st_size
+            if progress and n % 50 == 0: progress(pages[0] + n, pages[0] + len(photos))
+        latest = list_backups(backup_dir)
+        if latest and read_manifest(latest[0][0]) == (digest, size, listed) and _intact(latest[0][0], digest, size):
+            _write_manifest(_manifest_path(latest[0][0]), digest, size, listed, when)
+            return latest[0][0], False, copied
+        with open(raw, "rb") as f, gzip.open(part, "wb", compresslevel=6) as out:
+            shutil.copyfileobj(f, out, 1 << 20)
+        _write_manifest(manifest, digest, size, listed, when)
+        os.replace(part, snapshot)
+        return snapshot, True, copied
+    except _BackupCancelled:
+        return None
+    finally:
+        for f in (raw, part, _part_file(manifest)):
+            if f.exists(): f.unlink()
+
+def prune_backups(backup_dir=None, keep=None):
+    """Delete the snapshots the hourly/daily/weekly rotation no longer keeps,
+    and the mirrored photos no remaining snapshot uses. Returns the number of
+    snapshots deleted."""
+    backup_dir = Path(backup_dir or BACKUP_DIR)
+    snaps = list_backups(backup_dir)
+    kept = {path for path, _ in snaps[:1]}
+    for period, count in (BACKUP_KEEP if keep is None else keep).items():
+        buckets = set()
+        for path, when in snaps:
+            bucket = BACKUP_BUCKETS[period](when)
+            if bucket in buckets: continue
+            if len(buckets) == count: break
+            buckets.add(bucket); kept.add(path)
+    removed, used = 0, set()
+    for path, _ in snaps:
+        if path in kept:
+            used.update(read_manifest(path)[2]); continue
+        path.unlink(); _manifest_path(path).unlink(); removed += 1
+    mirror = backup_dir / "photos"
+    for f in list(mirror.rglob("*")):
+        if f.is_file() and f.relative_to(mirror).as_posix() not in used: f.unlink()
+    # left behind by a backup the app was closed during
+    for f in backup_dir.glob("*.part"):
+        if time.time() - f.stat().st_mtime > 24 * 3600: f.unlink()
+    return removed
+
+@contextmanager
+def _unpacked(snapshot):
+    # the snapshot decompressed next to it, verified against its manifest
+    import gzip, hashlib, shutil
+    digest, size, photos = read_manifest(snapshot)
+    raw = _part_file(snapshot.with_suffix(""))
+    try:
+        with gzip.open(snapshot, "rb") as f, open(raw, "wb") as out:
+            shutil.copyfileobj(f, out, 1 << 20)
+        check = hashlib.sha256()
+        with open(raw, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""): check.update(block)
+        if check.hexdigest() != digest or raw.stat().st_size != size:
+            raise sqlite3.DatabaseError(f"{snapshot.name}: contenu différent du manifeste")
+        yield raw, photos
+    finally:
+        if raw.exists(): raw.unlink()
+
+def verify_backup(snapshot):
+    """Check a snapshot: checksum, PRAGMA integrity_check and mirrored photos.
+    Returns the list of problems (empty when it can be restored)."""
+    import zlib
+    snapshot, problems = Path(snapshot), []
+    try:
+        with _unpacked(snapshot) as (raw, photos):
+            conn = sqlite3.connect(raw)
+            try: check = conn.execute("PRAGMA integrity_check").fetchall()
+            finally: conn.close()
+    except (OSError, EOFError, ValueError, zlib.error, sqlite3.Error) as e:
+        return [str(e)]
+    if check != [("ok",)]: problems += [r[0] for r in check[:5]]
+    mirror = snapshot.parent / "photos"
+    for rel, size in photos.items():
+        copy = mirror / rel
+        if not copy.is_file() or copy.stat().st_size != size: problems.append(f"photo manquante: {rel}")
+    return problems
+
+def restore_backup(db, snapshot, progress=None):
+    """Replace the database and missing photos with a snapshot's.
+
+    The current state is snapshotted first, so a restore can be undone. The
+    copy goes through the backup API into the live database, so connections
+    other threads hold stay valid; an older schema is then migrated. Returns
+    the snapshot taken before restoring.
+    """
+    snapshot = Path(snapshot)
+    problems = verify_backup(snapshot)
+    if problems: raise sqlite3.DatabaseError(f"{snapshot.name}: {'; '.join(problems[:5])}")
+    before = backup_database(db, snapshot.parent)[0]
+    with _unpacked(snapshot) as (raw, photos):
+        src = sqlite3.connect(raw)
+        try: src.backup(db.connection(), progress=(lambda s, r, t: progress(t - r, t + len(photos))) if progress else None)
+        finally: src.close()
+    mirror = snapshot.parent / "photos"
+    for rel, size in photos.items():
+        dest = PHOTOS / rel
+        if not dest.exists() or dest.stat().st_size != size: _copy_file(mirror / rel, dest)
+    db.schema_version = None
+    init_db(db)
+    return before
+
+# Command line: batch jobs without the window, e.g. from start.bat
+def _print_rows(rows):
+    for r in rows: print("\t".join("" if v is None else str(v) for v in r))
+
+def _progress(done, total):
+    print(f"\r{done}/{total}", end="", file=sys.stderr, flush=True)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="cours_prive", description="COURS PRIVÉ - opérations sans interface graphique")
+    parser.add_argument("--db", default=str(DB), help="fichier de base (défaut: data.db)")
+    cmd = parser.add_subparsers(dest="command", required=True)
+    cmd.add_parser("migrate", help="mettre le schéma à jour")
+    p = cmd.add_parser("search", help="rechercher des élèves"); p.add_argument("text")
+    p = cmd.add_parser("export", help="exporter une table en CSV (.gz compressé)")
+    p.add_argument("table", choices=sorted(EXPORT_COLUMNS)); p.add_argument("path")
+    p.add_argument("--incremental", action="store_true", help="seulement les changements depuis le dernier export incrémental")
+    p = cmd.add_parser("import", help="importer un CSV")
+    p.add_argument("table", choices=sorted(IMPORT_TABLES)); p.add_argument("path")
+    p.add_argument("--upsert", action="store_true"); p.add_argument("--dry-run", action="store_true")
+    p = cmd.add_parser("bulletins", help="générer les bulletins d'une classe, d'un cycle ou d'une année")
+    p.add_argument("scope", choices=sorted(BULLETIN_SCOPES)); p.add_argument("value"); p.add_argument("out_dir")
+    p.add_argument("--combined", action="store_true", help="ajouter un fichier imprimable unique")
+    cmd.add_parser("overdue", help="élèves en retard de paiement")
+    p = cmd.add_parser("revenue", help="recettes par mois (ou par jour)"); p.add_argument("--daily", action="store_true")
+    cmd.add_parser("photos", help="ranger les photos et supprimer celles qui ne servent plus (data.db seulement)")
+    p = cmd.add_parser("backup", help="sauvegarder la base et les photos, puis appliquer la rotation")
+    p.add_argument("--dir", help="dossier des sauvegardes (défaut: backups)")
+    p = cmd.add_parser("backups", help="lister les sauvegardes"); p.add_argument("--dir")
+    p.add_argument("--verify", action="store_true", help="vérifier chaque sauvegarde")
+    p = cmd.add_parser("restore", help="restaurer une sauvegarde (l'état actuel est sauvegardé avant)")
+    p.add_argument("snapshot", help="fichier data-AAAAMMJJ-HHMMSS.db.gz (nom ou chemin)"); p.add_argument("--dir")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        with TRACE.operation(f"cli {args.command}"):
+            return _run_command(db, args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 2
+    finally:
+        db.close(); TRACE.save_summary()
+
+def _run_command(db, args):
+    init_db(db)
+    if args.command == "search":
+        _print_rows(search_students(db, args.text))
+    elif args.command == "export":
+        count = export_csv(db, args.table, args.path, args.incremental, _progress)
+        print(f"\n{count} lignes exportées vers {args.path}")
+    elif args.command == "import":
+        report = import_csv(db, args.table, args.path, args.upsert, args.dry_run, _progress)
+        print("\n" + report.summary())
+        return 1 if report.rejected else 0
+    elif args.command == "bulletins":
+        count = write_bulletins(db, args.scope, args.value, args.out_dir, args.combined, _progress)
+        print(f"\n{count} bulletins générés dans {args.out_dir}")
+    elif args.command == "overdue":
+        _print_rows(overdue_students(db))
+    elif args.command == "revenue":
+        _print_rows(revenue(db, "daily" if args.daily else "monthly"))
+    elif args.command == "photos":
+        adopted, removed, freed = photo_maintenance(db, _progress)
+        print(f"\n{adopted} photos rangées, {removed} fichiers supprimés ({freed / 1e6:.1f} Mo libérés)")
+    elif args.command == "backup":
+        snapshot, new, copied = backup_database(db, args.dir, _progress)
+        removed = prune_backups(args.dir)
+        print(f"\n{snapshot}{'' if new else ' (inchangée)'}, {copied} photos copiées, {removed} anciennes sauvegardes supprimées")
+    elif args.command == "backups":
+        failed = 0
+        for path, when in list_backups(args.dir):
+            problems = verify_backup(path) if args.verify else []
+            failed += bool(problems)
+            print(f"{when:%Y-%m-%d %H:%M:%S}\t{path.stat().st_size / 1e6:.1f} Mo\t{path.name}" + (f"\t{'; '.join(problems)}" if problems else ""))
+        return 1 if failed else 0
+    elif args.command == "restore":
+        snapshot = Path(args.snapshot)
+        if not snapshot.exists(): snapshot = Path(args.dir or BACKUP_DIR) / snapshot
+        before = restore_backup(db, snapshot, _progress)
+        print(f"\n{snapshot.name} restaurée; état précédent sauvegardé dans {before.name}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
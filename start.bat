@@ -1,21 +1,13 @@
-Option 2️⃣ — Application complète
-
-Avec :
-
-Gestion des élèves
-
-Inscription
-
-Notes
-
-Paiements
-
-Messagerie
-
-Planning
-
-Export CSV
-
-Interface moderne 2 couleurs
-
-Ta signature "DR.ALMOUSTAPHA MANOMI"
\ No newline at end of file
+@echo off
+rem COURS PRIVE - sans argument: ouvre l'application.
+rem Avec arguments: commande sans interface, par exemple pour une tache planifiee la nuit :
+rem   start.bat export payments exports\paiements.csv.gz --incremental
+rem   start.bat bulletins classe 6e bulletins --combined
+rem Miniatures des photos JPEG : installer Pillow une fois avec
+rem   python -m pip install -r requirements.txt
+cd /d "%~dp0"
+if "%~1"=="" (
+    start "" pythonw "APPLICATION DE GESTIONS DES ELEVES COURS PRIVEE.py"
+) else (
+    python cours_prive.py %*
+)
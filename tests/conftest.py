@@ -0,0 +1,36 @@
+# Tests of the headless core (cours_prive). Each test works on its own copy of
+# a database under pytest's tmp_path; the shipped data.db is never written.
+import shutil, sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import cours_prive as cp
+
+@pytest.fixture(autouse=True)
+def photos(tmp_path, monkeypatch):
+    """The photo store of a test; the application's photos/ is never touched."""
+    store = tmp_path / "photos"; store.mkdir()
+    monkeypatch.setattr(cp, "PHOTOS", store)
+    monkeypatch.setattr(cp, "THUMBS", store / "thumbs")
+    return store
+
+@pytest.fixture
+def shipped_db(tmp_path):
+    """A Database on a copy of the data.db shipped with the application, not migrated yet."""
+    path = tmp_path / "data.db"
+    shutil.copyfile(ROOT / "data.db", path)
+    db = cp.Database(path)
+    yield db
+    db.close()
+
+@pytest.fixture
+def db(tmp_path):
+    """A migrated, empty Database."""
+    db = cp.Database(tmp_path / "empty.db")
+    cp.init_db(db)
+    yield db
+    db.close()
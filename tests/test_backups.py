@@ -0,0 +1,105 @@
+import datetime, os, sqlite3
+
+import pytest
+
+import cours_prive as cp
+
+@pytest.fixture
+def backups(tmp_path):
+    return tmp_path / "backups"
+
+def snapshot_count(backups):
+    return len(cp.list_backups(backups))
+
+def test_backup_and_restore(db, backups, tmp_path, photos):
+    (tmp_path / "face.png").write_bytes(b"png bytes")
+    sid = cp.save_student(db, {"code": "B1", "first_name": "Awa", "photo": cp.store_photo(tmp_path / "face.png")})
+    cp.add_payment(db, sid, "2025-10-01", 500)
+    snapshot, new, copied = cp.backup_database(db, backups)
+    assert new and copied == 1
+    assert cp.verify_backup(snapshot) == []
+    cp.delete_student(db, sid)
+    assert cp.get_student(db, sid) is None
+    for f in photos.rglob("*"):
+        if f.is_file(): f.unlink()
+    before = cp.restore_backup(db, snapshot)
+    assert before != snapshot and cp.verify_backup(before) == []
+    code, photo = cp.get_student(db, sid)[0], cp.get_student(db, sid)[6]
+    assert code == "B1" and cp.photo_path(photo).read_bytes() == b"png bytes"
+    assert cp.student_balance(db, sid)[1] == 500
+    assert not list(backups.glob("*.part"))
+
+def test_restore_refuses_damaged_snapshot(db, backups):
+    cp.save_student(db, {"code": "B1", "first_name": "Awa"})
+    snapshot = cp.backup_database(db, backups)[0]
+    with open(snapshot, "r+b") as f: f.truncate(40)
+    cp.save_student(db, {"code": "B2", "first_name": "Ali"})
+    assert cp.verify_backup(snapshot)
+    with pytest.raises(sqlite3.DatabaseError):
+        cp.restore_backup(db, snapshot)
+    assert db.query_one("SELECT COUNT(*) FROM students")[0] == 2
+
+def test_unchanged_database_is_not_copied_again(db, backups):
+    cp.save_student(db, {"code": "B1", "first_name": "Awa"})
+    first = cp.backup_database(db, backups)
+    again = cp.backup_database(db, backups)
+    assert (again[0], again[1]) == (first[0], False)
+    assert snapshot_count(backups) == 1
+    cp.save_student(db, {"code": "B2", "first_name": "Ali"})
+    assert cp.backup_database(db, backups)[1]
+    assert snapshot_count(backups) == 2
+
+def test_unchanged_check_resets_backup_due(db, backups):
+    snapshot = cp.backup_database(db, backups)[0]
+    assert not cp.backup_due(backups)
+    # as if the snapshot had been taken, and last checked, two hours ago
+    digest, size, listed = cp.read_manifest(snapshot)
+    cp._write_manifest(cp._manifest_path(snapshot), digest, size, listed, datetime.datetime.now() - datetime.timedelta(hours=2))
+    assert cp.backup_due(backups)
+    assert cp.backup_database(db, backups)[1] is False
+    assert not cp.backup_due(backups)
+
+def test_damaged_latest_snapshot_is_replaced(db, backups):
+    cp.save_student(db, {"code": "B1", "first_name": "Awa"})
+    damaged = cp.backup_database(db, backups)[0]
+    with open(damaged, "r+b") as f: f.truncate(40)
+    snapshot, new, _ = cp.backup_database(db, backups)
+    assert new and snapshot != damaged
+    assert cp.verify_backup(snapshot) == []
+
+def test_missing_snapshot_file_is_replaced(db, backups):
+    damaged = cp.backup_database(db, backups)[0]
+    damaged.write_bytes(b"")
+    assert cp.backup_database(db, backups)[1]
+
+def test_verify_reports_missing_photo(db, backups, tmp_path):
+    (tmp_path / "face.png").write_bytes(b"png bytes")
+    cp.save_student(db, {"code": "B1", "first_name": "Awa", "photo": cp.store_photo(tmp_path / "face.png")})
+    snapshot = cp.backup_database(db, backups)[0]
+    for f in (backups / "photos").rglob("*"):
+        if f.is_file(): f.unlink()
+    assert [p for p in cp.verify_backup(snapshot) if p.startswith("photo manquante")]
+
+def test_cancelled_backup_leaves_nothing(db, backups):
+    assert cp.backup_database(db, backups, cancelled=lambda: True) is None
+    assert snapshot_count(backups) == 0 and not list(backups.glob("*.part"))
+
+def test_prune_rotation(db, backups):
+    snapshot = cp.backup_database(db, backups)[0]
+    manifest = cp._manifest_path(snapshot).read_text(encoding="utf-8")
+    data = snapshot.read_bytes()
+    snapshot.unlink(); cp._manifest_path(snapshot).unlink()
+    newest = datetime.datetime(2026, 10, 18, 12, 0, 0)
+    for hours in range(50):
+        path = backups / f"data-{newest - datetime.timedelta(hours=hours):%Y%m%d-%H%M%S}.db.gz"
+        path.write_bytes(data); cp._manifest_path(path).write_text(manifest, encoding="utf-8")
+    (backups / "photos" / "zz").mkdir(parents=True)
+    (backups / "photos" / "zz" / "orphan.png").write_bytes(b"x")
+    old_part = backups / "data-x.db.1-1.part"; old_part.write_bytes(b"x")
+    os.utime(old_part, (0, 0))
+    removed = cp.prune_backups(backups, keep={"hourly": 2, "daily": 2, "weekly": 1})
+    # hourly: 12:00 and 11:00 on the 18th; daily: the 18th and 23:00 on the 17th; weekly: the newest
+    assert [when for _, when in cp.list_backups(backups)] == [newest, newest - datetime.timedelta(hours=1),
+                                                              newest - datetime.timedelta(hours=13)]
+    assert removed == 47
+    assert not (backups / "photos" / "zz" / "orphan.png").exists() and not old_part.exists()
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import cours_prive as cp
+
+@pytest.fixture
+def classe(db):
+    """Three students of 6A with grades; one without a code."""
+    ids = [cp.save_student(db, {"code": code, "first_name": name, "last_name": "<Diallo>", "classe": "6A"})
+           for code, name in (("C1", "Awa"), ("C2", "Ali"))]
+    ids.append(db.execute("INSERT INTO students (first_name, classe) VALUES ('Sans code', '6A')"))
+    for sid, value in zip(ids, (15, 12, 9)):
+        cp.add_grade(db, sid, "2025-10-01", "maths", value, comment="bien & vite")
+    cp.add_lesson(db, ids[0], "2025-10-02", "fractions")
+    return ids
+
+def test_render_bulletin_escapes_and_ranks(db, classe):
+    data = next(cp.bulletin_data(db.connection(), student_id=classe[0]))
+    code, body = cp.render_bulletin(data)
+    assert code == "C1"
+    assert "&lt;Diallo&gt;" in body and "<Diallo>" not in body
+    assert "bien &amp; vite" in body and "fractions" in body
+    assert "Moyenne: 15.00/20</b> - Rang 1/3" in body
+
+def test_write_bulletins(db, classe, tmp_path):
+    out = tmp_path / "out"
+    assert cp.write_bulletins(db, "classe", "6A", out, combined=True) == 3
+    names = sorted(os.listdir(out))
+    assert names == ["bulletin_C1.html", "bulletin_C2.html", f"bulletin_id{classe[2]}.html", "bulletins_6A.html"]
+    combined = (out / "bulletins_6A.html").read_text(encoding="utf-8")
+    assert combined.count("<div class='bulletin'>") == 3
+
+def test_colliding_names_do_not_overwrite(db, tmp_path):
+    for code in ("a/b", "a_b", "A1", "a1", None, None):
+        db.execute("INSERT INTO students (code, first_name, classe) VALUES (?, 'X', '6B')", (code,))
+    out = tmp_path / "out"
+    assert cp.write_bulletins(db, "classe", "6B", out) == 6
+    assert len({n.lower() for n in os.listdir(out)}) == 6
+
+def test_cancelled_run_leaves_nothing(db, classe, tmp_path, monkeypatch):
+    monkeypatch.setattr(cp, "BULLETIN_CHUNK", 1)
+    calls = []
+    def cancelled():
+        calls.append(1); return len(calls) > 2
+    assert cp.write_bulletins(db, "classe", "6A", tmp_path / "out", combined=True, cancelled=cancelled) is None
+    assert os.listdir(tmp_path / "out") == []
+
+def test_failed_run_leaves_nothing(db, classe, tmp_path, monkeypatch):
+    render = cp.render_bulletin
+    def failing(data):
+        if data[0][0] is None: raise OSError("disque plein")
+        return render(data)
+    monkeypatch.setattr(cp, "render_bulletin", failing)
+    with pytest.raises(OSError):
+        cp.write_bulletins(db, "classe", "6A", tmp_path / "out", combined=True)
+    assert os.listdir(tmp_path / "out") == []
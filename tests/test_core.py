@@ -0,0 +1,293 @@
+import csv, random, sqlite3
+
+import pytest
+
+import cours_prive as cp
+
+# Summary tables recomputed from the base tables, (key, values...) sorted by key
+AVERAGES_SQL = ("SELECT student_id, SUM(value * coefficient), SUM(coefficient), COUNT(*) FROM grades "
+                "GROUP BY student_id ORDER BY 1")
+CLASS_AVERAGES_SQL = ("SELECT IFNULL(s.classe,''), SUM(g.value * g.coefficient), SUM(g.coefficient), COUNT(*) "
+                      "FROM grades g JOIN students s ON s.id = g.student_id GROUP BY 1 ORDER BY 1")
+BALANCES_SQL = f"SELECT s.id, {cp.FEE_DUE_SQL}, {cp.PAID_SQL} FROM students s ORDER BY 1"
+REVENUE_SQL = ("SELECT substr(IFNULL(date,''), 1, {length}), IFNULL(method,''), SUM(amount), COUNT(*) FROM payments "
+               "GROUP BY 1, 2 ORDER BY 1, 2")
+UNREAD_SQL = "SELECT student_id, COUNT(*) FROM messages WHERE read_flag = 0 GROUP BY student_id ORDER BY 1"
+
+def rows(db, sql):
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in r) for r in db.query(sql)]
+
+def assert_summaries(db):
+    """Every trigger-maintained summary equals the same figures computed from scratch."""
+    # rows whose counts dropped back to zero are kept by the triggers; they hold nothing
+    assert rows(db, "SELECT * FROM student_averages WHERE grade_count > 0 ORDER BY 1") == rows(db, AVERAGES_SQL)
+    assert rows(db, "SELECT * FROM class_averages WHERE grade_count > 0 ORDER BY 1") == rows(db, CLASS_AVERAGES_SQL)
+    assert rows(db, "SELECT student_id, fees_due, paid FROM student_balances ORDER BY 1") == rows(db, BALANCES_SQL)
+    for period, length in (("daily", 10), ("monthly", 7)):
+        assert rows(db, f"SELECT * FROM revenue_{period} WHERE count > 0 ORDER BY 1, 2") == rows(db, REVENUE_SQL.format(length=length))
+    assert rows(db, "SELECT student_id, unread FROM unread_counts WHERE unread > 0 ORDER BY 1") == rows(db, UNREAD_SQL)
+
+# Database
+
+def test_transaction_rolls_back_on_error(db):
+    with pytest.raises(ValueError):
+        with db.transaction() as c:
+            c.execute("INSERT INTO students (code, first_name) VALUES ('R1', 'Awa')")
+            with db.transaction() as inner:
+                inner.execute("INSERT INTO students (code, first_name) VALUES ('R2', 'Ali')")
+            raise ValueError
+    assert db.query_one("SELECT COUNT(*) FROM students")[0] == 0
+    assert not db.connection().in_transaction
+
+def test_transaction_recovers_from_failed_commit(db):
+    # a deferred foreign key makes COMMIT itself fail and leaves the transaction open
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction() as c:
+            c.execute("PRAGMA defer_foreign_keys = ON")
+            c.execute("INSERT INTO payments (student_id, date, amount) VALUES (999, '2025-10-01', 10)")
+    assert not db.connection().in_transaction
+    assert db.query_one("SELECT COUNT(*) FROM payments")[0] == 0
+    sid = cp.save_student(db, {"code": "C1", "first_name": "Awa"})
+    assert cp.get_student(db, sid)[0] == "C1"
+
+# Migrations
+
+def test_migrate_shipped_database(shipped_db):
+    before = shipped_db.query_one("SELECT COUNT(*) FROM students")[0]
+    cp.init_db(shipped_db)
+    assert shipped_db.query_one("PRAGMA user_version")[0] == cp.SCHEMA_VERSION
+    assert shipped_db.query("PRAGMA foreign_key_check") == []
+    assert shipped_db.query_one("PRAGMA integrity_check")[0] == "ok"
+    assert shipped_db.query_one("SELECT COUNT(*) FROM students")[0] == before
+    assert_summaries(shipped_db)
+
+def test_migrate_is_idempotent(shipped_db):
+    cp.init_db(shipped_db)
+    shipped_db.close()
+    again = cp.Database(shipped_db.path)
+    try:
+        cp.init_db(again)
+        assert again.query_one("PRAGMA user_version")[0] == cp.SCHEMA_VERSION
+        assert_summaries(again)
+    finally:
+        again.close()
+
+def test_migrated_search_finds_shipped_students(shipped_db):
+    cp.init_db(shipped_db)
+    code, first_name = shipped_db.query_one("SELECT code, first_name FROM students WHERE first_name <> '' ORDER BY id")
+    assert code in [r[1] for r in cp.search_students(shipped_db, first_name)]
+
+# Summaries
+
+def random_workload(db, seed, steps=400):
+    """Random inserts, updates and deletes touching every summary table."""
+    rnd = random.Random(seed)
+    classes, cycles = ["6A", "6B", "5A", None], ["college", "lycee", None]
+    years, methods = ["2025", "2025/2026", "2024-2025", "", None], ["cash", "cheque", None]
+    day = lambda: f"{rnd.choice([2024, 2025, 2026])}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+    ids = lambda table: [r[0] for r in db.query(f"SELECT id FROM {table}")]
+    for n in range(steps):
+        students = ids("students")
+        op = rnd.random()
+        if not students or op < 0.12:
+            db.execute("INSERT INTO students (code, first_name, classe, cycle, year) VALUES (?,?,?,?,?)",
+                       (f"S{seed}-{n}", "Prénom", rnd.choice(classes), rnd.choice(cycles), rnd.choice(years)))
+        elif op < 0.30:
+            cp.add_grade(db, rnd.choice(students), day(), "maths", rnd.randint(0, 40) / 2, rnd.choice([1, 2, 0.5]))
+        elif op < 0.48:
+            cp.add_payment(db, rnd.choice(students), day(), rnd.choice([100, 250.5, 1000]), rnd.choice(methods))
+        elif op < 0.58:
+            cp.send_message(db, rnd.choice(students), "admin", "bonjour")
+        elif op < 0.64:
+            cp.set_fee(db, rnd.choice(["classe", "cycle"]), rnd.choice(classes + cycles), rnd.choice([0, 5000, 12000]))
+        elif op < 0.72:
+            db.execute("UPDATE students SET classe=?, cycle=?, year=? WHERE id=?",
+                       (rnd.choice(classes), rnd.choice(cycles), rnd.choice(years), rnd.choice(students)))
+        elif op < 0.78 and ids("grades"):
+            db.execute("UPDATE grades SET value=?, coefficient=?, student_id=? WHERE id=?",
+                       (rnd.randint(0, 20), rnd.choice([1, 3]), rnd.choice(students), rnd.choice(ids("grades"))))
+        elif op < 0.84 and ids("payments"):
+            db.execute("UPDATE payments SET amount=?, date=?, method=?, student_id=? WHERE id=?",
+                       (rnd.choice([50, 75.25]), day(), rnd.choice(methods), rnd.choice(students), rnd.choice(ids("payments"))))
+        elif op < 0.88:
+            cp.mark_read(db, student_id=rnd.choice(students))
+        elif op < 0.91 and ids("grades"):
+            cp.delete_grade(db, rnd.choice(ids("grades")))
+        elif op < 0.94 and ids("payments"):
+            db.execute("DELETE FROM payments WHERE id=?", (rnd.choice(ids("payments")),))
+        elif op < 0.96:
+            fees = cp.fee_schedule(db)
+            if fees: cp.delete_fee(db, *rnd.choice(fees)[:2])
+        else:
+            cp.delete_student(db, rnd.choice(students))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_summaries_follow_random_changes(db, seed):
+    random_workload(db, seed)
+    assert_summaries(db)
+
+def test_summaries_on_shipped_database(shipped_db):
+    cp.init_db(shipped_db)
+    random_workload(shipped_db, 42, steps=200)
+    assert_summaries(shipped_db)
+
+def test_balance_counts_school_year_only(db):
+    sid = cp.save_student(db, {"code": "A1", "first_name": "Awa", "classe": "6A", "year": "2025/2026"})
+    cp.set_fee(db, "classe", "6A", 10000)
+    cp.add_payment(db, sid, "2025-06-30", 4000)     # previous school year
+    cp.add_payment(db, sid, "2025-09-01", 3000)
+    assert cp.student_balance(db, sid) == (10000, 3000, 7000)
+    db.execute("UPDATE students SET year='2024' WHERE id=?", (sid,))
+    assert cp.student_balance(db, sid) == (10000, 4000, 6000)
+
+# Student list
+
+@pytest.fixture
+def crowd(db):
+    """Students with repeated and missing sort values, to page through."""
+    names = ["Ba", "ba", None, "Sow", "Ba", "", "Diallo", None, "Sow", "Ndiaye", "Ba"]
+    for n, name in enumerate(names):
+        db.execute("INSERT INTO students (code, last_name, first_name, classe) VALUES (?,?,?,?)",
+                   (f"K{n % 4}{n}", name, name and name[::-1], ["6A", None, "5B"][n % 3]))
+    return db
+
+@pytest.mark.parametrize("sort", sorted(cp.SORT_KEYS))
+@pytest.mark.parametrize("descending", [False, True])
+def test_student_page_keyset(crowd, sort, descending):
+    expr, direction = cp.SORT_KEYS[sort], "DESC" if descending else "ASC"
+    expected = [r[0] for r in crowd.query(f"SELECT id FROM students ORDER BY {expr} {direction}, id {direction}")]
+    forward, page = [], cp.student_page(crowd, sort, descending, limit=3)
+    while page:
+        forward += page
+        page = cp.student_page(crowd, sort, descending, after=(page[-1][5], page[-1][0]), limit=3)
+    assert [r[0] for r in forward] == expected
+    backward, page = [], forward[-3:]
+    while page:
+        backward = page + backward
+        page = cp.student_page(crowd, sort, descending, before=(page[0][5], page[0][0]), limit=3)
+    assert [r[0] for r in backward] == expected
+
+def test_student_page_unread_column(crowd):
+    sid = crowd.query_one("SELECT id FROM students ORDER BY id")[0]
+    cp.send_message(crowd, sid, "admin", "bonjour"); cp.send_message(crowd, sid, "admin", "rappel")
+    assert cp.student_page(crowd, limit=1)[0][6] == 2
+    cp.mark_read(crowd, student_id=sid)
+    assert cp.student_page(crowd, limit=1)[0][6] == 0
+
+# Imports
+
+def write_csv(path, header, records):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f); w.writerow(header); w.writerows(records)
+    return path
+
+def test_import_rejects(db, tmp_path):
+    cp.save_student(db, {"code": "E1", "first_name": "Ali"})
+    path = write_csv(tmp_path / "s.csv", ("code", "last_name", "first_name"), [
+        ("", "Sans", "Code"),           # code requis
+        ("E1", "Deja", "La"),           # existe déjà without upsert
+        ("N1", "Sans", ""),             # prénom requis
+        ("N2", "Bon", "Eleve"),
+        ("N2", "Double", "Eleve"),      # en double dans le fichier
+    ])
+    report = cp.import_csv(db, "students", path)
+    assert (report.inserted, report.updated, report.rejected) == (1, 0, 4)
+    assert [line for line, _ in sorted(report.errors)] == [2, 3, 4, 6]
+    assert db.query("SELECT code FROM students ORDER BY code") == [("E1",), ("N2",)]
+
+def test_import_missing_columns(db, tmp_path):
+    with pytest.raises(ValueError):
+        cp.import_csv(db, "students", write_csv(tmp_path / "s.csv", ("last_name",), [("X",)]))
+    with pytest.raises(ValueError):
+        cp.import_csv(db, "payments", write_csv(tmp_path / "p.csv", ("date", "amount"), [("2025-01-01", "5")]))
+
+def test_import_upsert_updates_present_columns_only(db, tmp_path):
+    sid = cp.save_student(db, {"code": "U1", "last_name": "Diallo", "first_name": "Awa", "classe": "6A", "phone": "555"})
+    path = write_csv(tmp_path / "s.csv", ("code", "classe"), [("U1", "5A"), ("U2", "5B")])
+    report = cp.import_csv(db, "students", path, upsert=True)
+    # U1 is updated without a first_name; U2 is new and needs one
+    assert (report.inserted, report.updated, report.rejected) == (0, 1, 1)
+    assert cp.get_student(db, sid)[:4] == ("U1", "Diallo", "Awa", "5A")
+    assert cp.get_student(db, sid)[8] == "555"
+    path = write_csv(tmp_path / "s2.csv", ("code", "first_name"), [("U2", "Moussa")])
+    cp.import_csv(db, "students", path, upsert=True)
+    assert db.query_one("SELECT classe, phone FROM students WHERE code='U2'") == (None, None)
+
+def test_import_dry_run_writes_nothing(db, tmp_path):
+    path = write_csv(tmp_path / "s.csv", ("code", "first_name"), [("D1", "Fatou")])
+    report = cp.import_csv(db, "students", path, dry_run=True)
+    assert report.inserted == 1
+    assert db.query_one("SELECT COUNT(*) FROM students")[0] == 0
+
+def test_import_payments_by_code(db, tmp_path):
+    sid = cp.save_student(db, {"code": "P1", "first_name": "Ibrahim"})
+    path = write_csv(tmp_path / "p.csv", ("student_code", "date", "amount", "method"), [
+        ("P1", "15/10/2025", "1500", "cash"),
+        ("P1", "2025-10-16", "12,5", ""),
+        ("P9", "2025-10-16", "10", ""),         # élève inconnu
+        ("P1", "2025-10-16", "dix", ""),        # montant non numérique
+    ])
+    report = cp.import_csv(db, "payments", path)
+    assert (report.inserted, report.rejected) == (2, 2)
+    assert cp.student_payments(db, sid)[0][1:3] == ("2025-10-16", 12.5)
+    assert cp.student_payments(db, sid)[1][1:3] == ("2025-10-15", 1500)
+    assert_summaries(db)
+
+STUDENT_SQL = "SELECT code, last_name, first_name, classe, cycle, year, photo, phone FROM students ORDER BY code"
+PAYMENT_SQL = ("SELECT s.code, p.date, p.amount, p.method, p.note FROM payments p JOIN students s ON s.id = p.student_id "
+               "ORDER BY 1, 2, 3, 4")
+
+def blank(rs):
+    # exported NULLs come back as empty text
+    return [tuple("" if v is None else v for v in r) for r in rs]
+
+@pytest.fixture
+def copy_db(tmp_path):
+    db = cp.Database(tmp_path / "copy.db")
+    cp.init_db(db)
+    yield db
+    db.close()
+
+@pytest.mark.parametrize("name", ["students.csv", "students.csv.gz"])
+def test_students_round_trip(db, copy_db, tmp_path, name):
+    random_workload(db, 7, steps=150)
+    count = db.query_one("SELECT COUNT(*) FROM students")[0]
+    assert cp.export_csv(db, "students", tmp_path / name) == count
+    assert cp.import_csv(copy_db, "students", tmp_path / name).inserted == count
+    assert blank(copy_db.query(STUDENT_SQL)) == blank(db.query(STUDENT_SQL))
+    # importing the same file again with upsert changes nothing
+    report = cp.import_csv(copy_db, "students", tmp_path / name, upsert=True)
+    assert (report.inserted, report.updated, report.rejected) == (0, count, 0)
+    assert blank(copy_db.query(STUDENT_SQL)) == blank(db.query(STUDENT_SQL))
+
+def test_payments_round_trip(db, copy_db, tmp_path):
+    random_workload(db, 8, steps=150)
+    cp.export_csv(db, "students", tmp_path / "students.csv")
+    cp.export_csv(db, "payments", tmp_path / "payments.csv")
+    cp.import_csv(copy_db, "students", tmp_path / "students.csv")
+    # across databases student ids differ; the copy names students by code
+    codes = dict(db.query("SELECT id, code FROM students"))
+    with open(tmp_path / "payments.csv", encoding="utf-8", newline="") as f:
+        records = [(codes[int(r["student_id"])], r["date"], r["amount"], r["method"], r["note"]) for r in csv.DictReader(f)]
+    path = write_csv(tmp_path / "by_code.csv", ("student_code", "date", "amount", "method", "note"), records)
+    assert cp.import_csv(copy_db, "payments", path).inserted == len(records)
+    assert blank(copy_db.query(PAYMENT_SQL)) == blank(db.query(PAYMENT_SQL))
+    assert_summaries(copy_db)
+
+def test_incremental_export_only_changed_rows(db, tmp_path):
+    for n in range(3): cp.save_student(db, {"code": f"I{n}", "first_name": "X"})
+    assert cp.export_csv(db, "students", tmp_path / "a.csv", incremental=True) == 3
+    db.execute("UPDATE students SET classe='6A' WHERE code='I1'")
+    assert cp.export_csv(db, "students", tmp_path / "b.csv", incremental=True) == 1
+    assert [r["code"] for r in csv.DictReader(open(tmp_path / "b.csv", encoding="utf-8"))] == ["I1"]
+
+# Planning
+
+@pytest.mark.parametrize("text,minutes", [("8:30", 510), ("08h30", 510), ("24:00", 1440), ("0", 0)])
+def test_parse_time(text, minutes):
+    assert cp.parse_time(text) == minutes
+
+@pytest.mark.parametrize("text", ["24:01", "25:00", "9:75", "midi"])
+def test_parse_time_rejects(text):
+    with pytest.raises(ValueError):
+        cp.parse_time(text)
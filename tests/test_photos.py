@@ -0,0 +1,70 @@
+import os, time
+
+import pytest
+
+import cours_prive as cp
+
+def picture(path, content=b"picture"):
+    path.write_bytes(content)
+    return path
+
+def age(path, seconds=2 * cp.PHOTO_GRACE):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+@pytest.fixture
+def live_db(db, monkeypatch):
+    # photo_maintenance() only runs on the database the store belongs to
+    monkeypatch.setattr(cp, "DB", db.path)
+    return db
+
+def test_store_photo_is_content_addressed(tmp_path, photos):
+    key = cp.store_photo(picture(tmp_path / "Face.JPG"))
+    assert cp.PHOTO_KEY.fullmatch(key) and key.endswith(".jpg")
+    assert cp.photo_path(key) == photos / key[:2] / key
+    assert cp.store_photo(picture(tmp_path / "copy.jpg")) == key
+    assert [f for f in photos.rglob("*") if f.is_file()] == [cp.photo_path(key)]
+
+def test_thumbnail_made_on_store(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    Image.new("RGB", (800, 600), "red").save(tmp_path / "face.jpg")
+    key = cp.store_photo(tmp_path / "face.jpg")
+    with Image.open(cp.thumbnail_path(key)) as thumb:
+        assert max(thumb.size) == cp.THUMB_SIZE
+
+def test_maintenance_removes_unused_files_only(live_db, tmp_path, photos):
+    used = cp.store_photo(picture(tmp_path / "a.png", b"a"))
+    unused = cp.store_photo(picture(tmp_path / "b.png", b"b"))
+    fresh = cp.store_photo(picture(tmp_path / "c.png", b"c"))
+    cp.save_student(live_db, {"code": "P1", "first_name": "Awa", "photo": used})
+    cp.THUMBS.mkdir(exist_ok=True)
+    stale_thumb = picture(cp.thumbnail_path(unused), b"t")
+    other = picture(photos / "notes.txt", b"keep me")
+    for f in (cp.photo_path(used), cp.photo_path(unused), stale_thumb, other): age(f)
+    adopted, removed, freed = cp.photo_maintenance(live_db)
+    assert (adopted, removed, freed) == (0, 2, 2)
+    assert cp.photo_path(used).exists() and other.exists()
+    # stored within PHOTO_GRACE: its student may not be saved yet
+    assert cp.photo_path(fresh).exists()
+    assert not cp.photo_path(unused).exists() and not stale_thumb.exists()
+
+def test_storing_again_renews_the_grace(live_db, tmp_path):
+    key = cp.store_photo(picture(tmp_path / "a.png"))
+    age(cp.photo_path(key))
+    assert cp.store_photo(picture(tmp_path / "again.png")) == key
+    cp.photo_maintenance(live_db)
+    assert cp.photo_path(key).exists()
+
+def test_maintenance_adopts_legacy_paths(live_db, tmp_path):
+    legacy = picture(tmp_path / "old photo.png", b"legacy")
+    sid = cp.save_student(live_db, {"code": "P1", "first_name": "Awa", "photo": str(legacy)})
+    assert cp.photo_maintenance(live_db)[0] == 1
+    key = cp.get_student(live_db, sid)[6]
+    assert cp.PHOTO_KEY.fullmatch(key) and cp.photo_path(key).read_bytes() == b"legacy"
+
+def test_maintenance_refuses_other_database(db, tmp_path):
+    key = cp.store_photo(picture(tmp_path / "a.png"))
+    age(cp.photo_path(key))
+    with pytest.raises(ValueError):
+        cp.photo_maintenance(db)
+    assert cp.photo_path(key).exists()
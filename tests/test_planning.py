@@ -0,0 +1,77 @@
+import pytest
+
+import cours_prive as cp
+
+MONDAY = "2026-10-12"
+
+@pytest.fixture
+def students(db):
+    awa = cp.save_student(db, {"code": "A", "first_name": "Awa", "last_name": "Diallo"})
+    # imported students may have no last name
+    ali = db.execute("INSERT INTO students (code, first_name) VALUES ('B', 'Ali')")
+    return awa, ali
+
+def test_add_slot_conflicts(db, students):
+    awa, ali = students
+    cp.add_slot(db, awa, 0, 8 * 60, 9 * 60, MONDAY, teacher="M. Sow", room="Salle 1")
+    with pytest.raises(cp.ScheduleConflict) as student:
+        cp.add_slot(db, awa, 0, 8 * 60 + 30, 10 * 60, MONDAY)
+    assert "Awa Diallo" in str(student.value)
+    with pytest.raises(cp.ScheduleConflict):
+        cp.add_slot(db, ali, 0, 8 * 60 + 30, 10 * 60, MONDAY, teacher="m. sow")
+    with pytest.raises(cp.ScheduleConflict):
+        cp.add_slot(db, ali, 0, 7 * 60, 8 * 60 + 1, MONDAY, room="Salle 1")
+    # back to back, another day, or once the first slot has ended: no conflict
+    cp.add_slot(db, ali, 0, 9 * 60, 10 * 60, MONDAY, teacher="M. Sow", room="Salle 1")
+    cp.add_slot(db, ali, 1, 8 * 60, 9 * 60, MONDAY, teacher="M. Sow")
+    cp.add_slot(db, awa, 2, 8 * 60, 9 * 60, MONDAY, valid_until="2026-10-19")
+    cp.add_slot(db, awa, 2, 8 * 60, 9 * 60, "2026-10-19")
+    assert cp.timetable_conflicts(db) == []
+
+def test_conflict_names_student_without_last_name(db, students):
+    ali = students[1]
+    cp.add_slot(db, ali, 0, 8 * 60, 9 * 60, MONDAY)
+    with pytest.raises(cp.ScheduleConflict) as conflict:
+        cp.add_slot(db, ali, 0, 8 * 60, 9 * 60, MONDAY)
+    assert conflict.value.conflicts[0][4] == "Ali"
+    assert "08:00-09:00 Ali /" in str(conflict.value)
+
+def test_timetable_conflicts_finds_stored_double_bookings(db, students):
+    awa, ali = students
+    cp.add_slot(db, awa, 3, 10 * 60, 11 * 60, MONDAY, room="Salle 2")
+    room = cp.find_resource(db, "rooms", "Salle 2")
+    slot = db.execute("INSERT INTO schedule_slots (student_id, room_id, weekday, start_min, end_min, valid_from) "
+                      "VALUES (?, ?, 3, 630, 700, ?)", (ali, room, MONDAY))
+    assert cp.timetable_conflicts(db) == [(slot - 1, slot, "salle")]
+
+def test_find_free_slots(db, students):
+    awa, ali = students
+    cp.add_slot(db, awa, 0, 10 * 60, 11 * 60, MONDAY, teacher="M. Sow")
+    cp.add_slot(db, ali, 0, 14 * 60, 15 * 60, MONDAY, teacher="M. Sow")
+    teacher = cp.find_resource(db, "teachers", "M. Sow")
+    free = cp.find_free_slots(db, 60, weekdays=[0, 1], valid_from=MONDAY, teacher_id=teacher)
+    assert free == [(0, 480, 600), (0, 660, 840), (0, 900, 1200), (1, 480, 1200)]
+    assert cp.find_free_slots(db, 150, weekdays=[0], valid_from=MONDAY, teacher_id=teacher) == [(0, 660, 840), (0, 900, 1200)]
+    # free for the teacher and for Awa at once
+    assert cp.find_free_slots(db, 60, weekdays=[0], valid_from=MONDAY, teacher_id=teacher, student_id=awa)[0] == (0, 480, 600)
+    # slots over before valid_from do not count
+    cp.add_slot(db, awa, 1, 8 * 60, 20 * 60, MONDAY, valid_until="2026-10-19", teacher="M. Sow")
+    assert cp.find_free_slots(db, 60, weekdays=[1], valid_from=MONDAY, teacher_id=teacher) == []
+    assert cp.find_free_slots(db, 60, weekdays=[1], valid_from="2026-10-19", teacher_id=teacher) == [(1, 480, 1200)]
+
+def test_week_schedule(db, students):
+    awa, ali = students
+    cp.add_slot(db, awa, 4, 9 * 60, 10 * 60, MONDAY, topic="maths")
+    cp.add_slot(db, ali, 0, 8 * 60, 9 * 60, MONDAY)
+    # starts on Wednesday: not on that week's Monday or Tuesday
+    cp.add_slot(db, ali, 1, 8 * 60, 9 * 60, "2026-10-14")
+    cp.add_slot(db, awa, 2, 8 * 60, 9 * 60, "2026-10-05", valid_until=MONDAY)
+    week = cp.week_schedule(db, "2026-10-15")
+    assert [(r[0], r[5]) for r in week] == [("2026-10-12", "Ali"), ("2026-10-16", "Awa Diallo")]
+    assert [r[0] for r in cp.week_schedule(db, "2026-10-21")] == ["2026-10-19", "2026-10-20", "2026-10-23"]
+
+def test_week_lessons(db, students):
+    awa, ali = students
+    cp.add_lesson(db, ali, "2026-10-13", "lecture", 45)
+    cp.add_lesson(db, awa, "2026-10-19", "hors semaine")
+    assert cp.week_lessons(db, MONDAY) == [("2026-10-13", "Ali", "lecture", 45)]